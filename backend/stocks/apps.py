@@ -1,7 +1,24 @@
+import os
+import sys
+
 from django.apps import AppConfig
 # 移除异步线程，改为同步执行
 
 
+def _serving_process():
+    """
+    当前进程是否为 Web 服务进程：runserver 的自动重载子进程（RUN_MAIN=true，或 --noreload 时的主进程）
+    或 gunicorn / uwsgi 等 WSGI / ASGI 服务器。migrate 等其他 manage.py 命令与自动重载的父进程返回 False。
+    """
+    argv = sys.argv or ['']
+    if 'runserver' in argv[1:2]:
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in argv
+    prog = os.path.basename(argv[0])
+    if prog in ('manage.py', 'django-admin') or prog.startswith('django-admin'):
+        return False
+    return any(name in prog for name in ('gunicorn', 'uwsgi', 'daphne', 'uvicorn', 'hypercorn'))
+
+
 class StocksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stocks'
@@ -36,6 +53,21 @@ class StocksConfig(AppConfig):
         except Exception:
             # 启动期不阻塞服务；如果失败可以在运行时兜底或手动脚本创建
             pass
+        # 上次运行遗留的 spool（数据库不可用时转存的行）：启动后台回放
+        try:
+            from data_pipeline.spool import default_spool, start_replayer
+            if default_spool().segments():
+                start_replayer(qdb_connect)
+        except Exception:
+            pass
+        # 卡死任务回收：按任务类型超时将处理中的任务退回重试（见 stocks.tasks.reaper），TASK_REAPER=0 关闭；
+        # 只在 Web 服务进程中启动（qdb_worker 进程自带回收线程）
+        try:
+            if _serving_process() and (os.getenv('TASK_REAPER') or '1').strip().lower() not in ('0', 'false', 'off', 'no'):
+                from .tasks.reaper import start_reaper
+                start_reaper(qdb_connect)
+        except Exception:
+            pass
          # 同步执行：服务启动时直接加载所有计划任务配置
         try:
             from global_config import GlobalConfig
@@ -5,6 +5,26 @@ import os
 import re
 from datetime import datetime
 
+try:
+    from data_pipeline.adjust import apply_adjust
+    from data_pipeline.collector import qdb_get_factors
+except Exception:
+    apply_adjust = None
+    qdb_get_factors = None
+
+_SELECT_COLUMNS = ('trade_date', 'open', 'close', 'high', 'low', 'volume', 'amount', 'turnover', 'outstanding_share')
+
+
+def _adjust_rows(rows, factors, adj):
+    """对查询出的不复权行（列序见 _SELECT_COLUMNS）按因子复权，返回同结构的行。"""
+    import pandas as pd
+    frame = apply_adjust(pd.DataFrame(rows, columns=_SELECT_COLUMNS), factors, adj)
+    for name in ('open', 'close', 'high', 'low'):
+        frame[name] = frame[name].round(4)
+    frame = frame.astype(object).where(frame.notna(), None)
+    return list(frame.itertuples(index=False, name=None))
+
+
 class DailyDataView(APIView):
     def get(self, request):
         """按代码与日期范围返回QuestDB中的股票日线数据（JSON）。
@@ -13,6 +33,7 @@ class DailyDataView(APIView):
           - start_date: YYYYMMDD（默认 19900101）
           - end_date: YYYYMMDD（默认 21000118）
           - adjust: ""/"hfq"/"qfq"；为空字符串表示查询 adjust_type 为 NULL；未传则不筛选复权类型
+            qfq/hfq 优先由不复权日线 × 复权因子（adj_factor）实时计算；该代码无因子时回退到已存储的复权序列
         """
         try:
             import psycopg2
@@ -46,12 +67,20 @@ class DailyDataView(APIView):
         except Exception as e:
             return Response({'error': f'连接异常: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        # 前/后复权：有因子时查询不复权日线，取出后按因子计算
+        factors = None
+        if adjust is not None and str(adjust).strip() in ('qfq', 'hfq') and qdb_get_factors is not None:
+            try:
+                factors = qdb_get_factors(code, conn=conn)
+            except Exception:
+                factors = None
+
         cur = conn.cursor()
         where = ["code=%s", "trade_date >= %s", "trade_date <= %s"]
         params = [code, start_date, end_date]
         if adjust is not None:
             adj = str(adjust).strip()
-            if adj == '':
+            if adj == '' or factors is not None:
                 where.append("adjust_type IS NULL")
             else:
                 where.append("adjust_type=%s")
@@ -70,6 +99,8 @@ class DailyDataView(APIView):
                 params
             )
             rows = cur.fetchall() or []
+            if factors is not None and rows:
+                rows = _adjust_rows(rows, factors, str(adjust).strip())
             for r in rows:
                 td = r[0]
                 td_s = None
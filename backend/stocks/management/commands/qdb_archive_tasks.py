@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "归档已结束的旧任务：把早于保留天数的任务（含最终状态）写入 tasks_archive 表或 Parquet 文件，"
+        "核对后删除 tasks / task_events / worker_heartbeats 中对应的分区。可配置为每日定时任务。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, help='保留最近多少天的任务（默认 TASK_RETENTION_DAYS=30）')
+        parser.add_argument('--target', choices=['table', 'parquet'], default='table',
+                            help='table=写入 tasks_archive 表；parquet=每天一个 Parquet 文件（需 --dir）')
+        parser.add_argument('--dir', help='Parquet 输出目录')
+        parser.add_argument('--dry-run', action='store_true', help='只计算截止时间与待归档任务数，不写入不删除')
+
+    def handle(self, *args, **opts):
+        project_root = Path(settings.BASE_DIR).parent
+        if str(project_root) not in sys.path:
+            sys.path.append(str(project_root))
+        try:
+            from data_pipeline.collector import qdb_connect, qdb_ensure_tables
+            from stocks.tasks.archive import archive_finished_tasks
+        except Exception as e:
+            raise CommandError(f'导入 data_pipeline 失败: {e}')
+        if opts['target'] == 'parquet' and not opts['dir']:
+            raise CommandError('Parquet 归档需要 --dir')
+
+        conn = qdb_connect()
+        if not conn:
+            raise CommandError('QuestDB 连接失败')
+        try:
+            qdb_ensure_tables(conn)
+            result = archive_finished_tasks(
+                conn, days=opts['days'], target=opts['target'], directory=opts['dir'], dry_run=opts['dry_run'],
+            )
+        finally:
+            conn.close()
+        if result['cutoff'] is None:
+            self.stdout.write('未启用保留（days <= 0），无需归档')
+            return
+        self.stdout.write(
+            f"截止 {result['cutoff']}：{result['days']} 天 {result['tasks']} 个任务，已归档 {result['archived']} 行"
+        )
+        if result['dropped']:
+            self.stdout.write(self.style.SUCCESS('已删除截止时间之前的分区'))
+        elif not opts['dry_run'] and result['tasks']:
+            self.stderr.write('归档未核对通过，分区未删除（见日志）')
@@ -0,0 +1,146 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "批量导入历史数据包（CSV/Parquet）到 QuestDB：stock_daily / stock_basic / inst_trading_tracker。"
+        "并行预处理与校验，经 HTTP /imp（默认）或服务端 COPY 导入，完成后等待 WAL 应用并输出各表行数。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='文件或目录（目录下递归查找 .csv/.csv.gz/.parquet）')
+        parser.add_argument('--table', choices=['stock_daily', 'stock_basic', 'inst_trading_tracker'],
+                            help='目标表；不指定时按文件名前缀推断')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='并行预处理进程数')
+        parser.add_argument('--chunk-rows', type=int, default=1_000_000, help='每个导入 CSV 的最大行数')
+        parser.add_argument('--mode', choices=['imp', 'copy'], default='imp',
+                            help='imp=HTTP /imp 上传；copy=服务端 COPY（需 --copy-root 为服务端 cairo.sql.copy.root 的本地挂载）')
+        parser.add_argument('--copy-root', help='COPY 模式下预处理文件的输出目录（服务端可见）')
+        parser.add_argument('--http-host', default=os.getenv('QDB_HTTP_HOST') or os.getenv('QDB_HOST', 'localhost'))
+        parser.add_argument('--http-port', type=int, default=int(os.getenv('QDB_HTTP_PORT', '9000')))
+        parser.add_argument('--truncate', action='store_true', help='导入前清空目标表（stock_basic 等无去重键的表重复导入会产生重复行）')
+        parser.add_argument('--dry-run', action='store_true', help='只做预处理与校验，不导入')
+
+    def handle(self, *args, **opts):
+        project_root = Path(settings.BASE_DIR).parent
+        if str(project_root) not in sys.path:
+            sys.path.append(str(project_root))
+        try:
+            from data_pipeline.bulk_import import (
+                discover, infer_table, prepare_file, import_http, import_copy, wait_wal_applied,
+            )
+            from data_pipeline.collector import qdb_connect, qdb_ensure_tables
+        except Exception as e:
+            raise CommandError(f'导入 data_pipeline 失败: {e}')
+
+        files = discover(opts['paths'])
+        if not files:
+            raise CommandError('未找到 .csv/.csv.gz/.parquet 文件')
+        jobs = []
+        for f in files:
+            table = opts['table'] or infer_table(f)
+            if not table:
+                self.stderr.write(f'跳过（无法从文件名推断目标表）: {f}')
+                continue
+            jobs.append((f, table))
+        if not jobs:
+            raise CommandError('没有可导入的文件')
+
+        conn = None
+        if not opts['dry_run']:
+            conn = qdb_connect()
+            if not conn:
+                raise CommandError('QuestDB 连接失败')
+            qdb_ensure_tables(conn)
+            if opts['truncate']:
+                for table in sorted({t for _, t in jobs}):
+                    conn.cursor().execute(f'truncate table {table}')
+                    self.stdout.write(f'已清空 {table}')
+
+        if opts['mode'] == 'copy':
+            if not opts['copy_root']:
+                raise CommandError('COPY 模式需要 --copy-root')
+            out_dir = opts['copy_root']
+            cleanup = False
+        else:
+            out_dir = tempfile.mkdtemp(prefix='qdb_import_')
+            cleanup = True
+
+        t0 = time.perf_counter()
+        totals = {'rows': 0, 'dropped': 0, 'imported': 0, 'rejected': 0}
+        failed = 0
+        try:
+            # 1. 并行预处理与校验；每完成一个文件立即导入，预处理与导入重叠进行
+            with ProcessPoolExecutor(max_workers=max(1, opts['workers'])) as pool:
+                futures = {pool.submit(prepare_file, f, t, out_dir, opts['chunk_rows']): f for f, t in jobs}
+                for i, fut in enumerate(as_completed(futures), 1):
+                    prep = fut.result()
+                    totals['rows'] += prep.rows
+                    totals['dropped'] += prep.dropped
+                    head = f'[{i}/{len(jobs)}] {os.path.basename(prep.source)} → {prep.table}: {prep.rows} 行'
+                    if prep.dropped:
+                        head += f'，丢弃 {prep.dropped} 行'
+                    self.stdout.write(head)
+                    for err in prep.errors:
+                        self.stderr.write(f'    {err}')
+                    if not prep.outputs:
+                        failed += 1
+                        continue
+                    if opts['dry_run']:
+                        continue
+                    # 2. 导入
+                    for out in prep.outputs:
+                        if opts['mode'] == 'copy':
+                            res = import_copy(conn, os.path.relpath(out, out_dir), prep.table)
+                        else:
+                            res = import_http(out, prep.table, host=opts['http_host'], port=opts['http_port'])
+                        totals['imported'] += res.imported
+                        totals['rejected'] += res.rejected
+                        rate = res.imported / res.elapsed if res.elapsed else 0
+                        if res.error:
+                            failed += 1
+                            self.stderr.write(f'    导入失败 {os.path.basename(out)}: {res.error}')
+                        else:
+                            self.stdout.write(
+                                f'    imported={res.imported} rejected={res.rejected} '
+                                f'{res.elapsed:.1f}s {rate:,.0f} rows/s'
+                            )
+                        if cleanup:
+                            try:
+                                os.remove(out)
+                            except OSError:
+                                pass
+
+            # 3. 等待 WAL 应用后输出各表行数（DataStatusView / UpdateStatusView 立即可见）
+            if conn is not None:
+                tables = sorted({t for _, t in jobs})
+                if not wait_wal_applied(conn, tables):
+                    self.stderr.write('等待 WAL 应用超时，部分数据可能稍后才可见')
+                cur = conn.cursor()
+                for table in tables:
+                    cur.execute(f'select count(*) from {table}')
+                    self.stdout.write(f'{table}: {cur.fetchone()[0]} 行')
+        finally:
+            if cleanup:
+                shutil.rmtree(out_dir, ignore_errors=True)
+            if conn is not None:
+                conn.close()
+
+        dt = time.perf_counter() - t0
+        summary = (
+            f"完成：源行数={totals['rows']} 丢弃={totals['dropped']} 导入={totals['imported']} "
+            f"拒绝={totals['rejected']} 失败文件={failed} 耗时={dt:.1f}s"
+        )
+        if failed:
+            self.stderr.write(summary)
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,87 @@
+import multiprocessing
+import signal
+import sys
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "运行任务工作进程：从 tasks 队列按租约认领并执行任务，定期心跳并回收过期租约。"
+        "可在多台机器上各自运行，--processes 在本机启动多个进程。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='本机工作进程数')
+        parser.add_argument('--concurrency', type=int, help='每进程执行线程数（默认 FETCH_CONCURRENCY=4）')
+        parser.add_argument('--prefetch', type=int, help='每次认领的任务数（默认 concurrency * 2）')
+        parser.add_argument('--batch-size', type=int, help='合批执行的最大任务数（默认 TASK_BATCH_SIZE=8，1 为逐个执行）')
+        parser.add_argument('--lease', type=int, help='租约秒数（默认 TASK_LEASE_SECONDS=120）')
+        parser.add_argument('--heartbeat', type=float, help='心跳间隔秒数（默认租约的 1/4）')
+        parser.add_argument('--task-type', action='append', dest='task_types', help='只处理指定类型，可重复')
+        parser.add_argument('--worker-id', help='工作进程标识（默认 主机名:进程号）')
+        parser.add_argument('--once', action='store_true', help='队列为空且在途任务完成后退出')
+
+    def handle(self, *args, **opts):
+        project_root = Path(settings.BASE_DIR).parent
+        if str(project_root) not in sys.path:
+            sys.path.append(str(project_root))
+        try:
+            from stocks.tasks.worker import TaskWorker, TASK_RUNNERS, run_worker_process
+        except Exception as e:
+            raise CommandError(f'导入任务工作进程失败: {e}')
+        unknown = [t for t in (opts['task_types'] or []) if t not in TASK_RUNNERS]
+        if unknown:
+            raise CommandError(f'未注册的任务类型: {unknown}（可选: {sorted(TASK_RUNNERS)}）')
+
+        options = {
+            'worker_id': opts['worker_id'],
+            'concurrency': opts['concurrency'],
+            'prefetch': opts['prefetch'],
+            'batch_size': opts['batch_size'],
+            'lease_seconds': opts['lease'],
+            'heartbeat_interval': opts['heartbeat'],
+            'task_types': opts['task_types'],
+            'exit_when_idle': opts['once'],
+        }
+        processes = max(1, opts['processes'])
+        if processes == 1:
+            worker = TaskWorker(**options)
+            signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+            try:
+                stats = worker.run()
+            except KeyboardInterrupt:
+                worker.stop()
+                return
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f'{worker.worker_id} 退出: {stats}'))
+            return
+
+        ctx = multiprocessing.get_context('spawn')
+        procs = [
+            ctx.Process(target=run_worker_process, args=(i, options), name=f'task-worker-{i}')
+            for i in range(processes)
+        ]
+        for p in procs:
+            p.start()
+        self.stdout.write(f'已启动 {processes} 个工作进程: {[p.pid for p in procs]}')
+
+        def terminate(*_):
+            for p in procs:
+                if p.is_alive():
+                    p.terminate()
+
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            for p in procs:
+                p.join()
+        except KeyboardInterrupt:
+            terminate()
+            for p in procs:
+                p.join(timeout=30)
+        failed = [p.name for p in procs if p.exitcode not in (0, None, -signal.SIGTERM)]
+        if failed:
+            raise CommandError(f'工作进程异常退出: {failed}')
@@ -3,6 +3,7 @@ from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 
 from .base import BaseTask
+from .retry import retry_policy
 
 # 数据源：Akshare（尽量兼容不同接口）
 try:
@@ -12,9 +13,14 @@ except Exception:
 
 # QuestDB 连接（沿用 data_pipeline.collector 的连接方式）
 try:
-    from data_pipeline.collector import qdb_connect
+    from data_pipeline.collector import qdb_connect, qdb_write_rows, INST_TRADING_COLUMNS
+    from data_pipeline.source_limiter import source_call
 except Exception:
     qdb_connect = None
+    qdb_write_rows = None
+
+    def source_call(source, fn, *args, stop_event=None, fresh=False, **kwargs):
+        return fn(*args, **kwargs)
 
 logger = logging.getLogger(__name__)
 
@@ -28,36 +34,43 @@ def _num(x) -> Optional[float]:
 
 
 
-def _fetch_lhb_day(date_s: str):
-    """尽可能使用 Akshare 拉取指定日期的龙虎榜明细。返回 DataFrame 或 None。"""
+def _fetch_lhb_day(date_s: str, stop_event=None):
+    """
+    尽可能使用 Akshare 拉取指定日期的龙虎榜明细。返回 DataFrame 或 None。
+    各接口 / 日期格式都未取到数据且其间出现过可重试异常（网络、超时、已取消，见 stocks.tasks.retry）时抛出该异常，
+    由任务记录为 last_error 并按重试策略重试；其他异常（接口不存在、参数不兼容）仍视为无数据。
+    """
     if not ak:
         return None
+    retryable = retry_policy("inst_trading_tracker").retryable
+    transient: Optional[BaseException] = None
     # 兼容多种可能的函数名/参数格式
     for fn_name in [
         "stock_lhb_detail_em",  # EastMoney
         "stock_lhb_detail_sina",  # Sina（若可用）
     ]:
-        try:
-            fn = getattr(ak, fn_name, None)
-            if not fn:
-                continue
-            # 兼容 YYYYMMDD / YYYY-MM-DD 两种日期格式
+        fn = getattr(ak, fn_name, None)
+        if not fn:
+            continue
+        # 兼容 YYYYMMDD / YYYY-MM-DD 两种日期格式
+        for d in (date_s, datetime.strptime(date_s, "%Y%m%d").strftime("%Y-%m-%d")):
             try:
-                df = fn(date=date_s)
-            except Exception:
-                try:
-                    d = datetime.strptime(date_s, "%Y%m%d").strftime("%Y-%m-%d")
-                    df = fn(date=d)
-                except Exception:
-                    df = None
+                df = source_call("akshare", fn, date=d, stop_event=stop_event)
+            except Exception as e:
+                if retryable(e):
+                    transient = e
+                continue
             if df is not None and not getattr(df, "empty", True):
                 return df
-        except Exception:
-            continue
+            break
+    if transient is not None:
+        raise transient
     return None
 
 
-def _aggregate_lhb(codes: List[str], start_date: datetime, end_date: datetime) -> List[Tuple[str, str, float, float, float, float, float]]:
+def _aggregate_lhb(
+    codes: List[str], start_date: datetime, end_date: datetime, stop_event=None,
+) -> List[Tuple[str, str, float, float, float, float, float]]:
     """
     在 [start_date, end_date] 区间内按代码聚合：
     返回列表项为 (code, name, buy_amount, buy_times, sell_amount, sell_times, net_amount)
@@ -72,7 +85,7 @@ def _aggregate_lhb(codes: List[str], start_date: datetime, end_date: datetime) -
     day = start_date
     while day <= end_date:
         ds = day.strftime("%Y%m%d")
-        df = _fetch_lhb_day(ds)
+        df = _fetch_lhb_day(ds, stop_event=stop_event)
         if df is not None and not df.empty:
             # 兼容常见列名
             # 期望列：股票代码 / 股票简称 / 买入金额(万元) / 卖出金额(万元) / 净额(万元)
@@ -156,56 +169,29 @@ def _aggregate_lhb(codes: List[str], start_date: datetime, end_date: datetime) -
 def _insert_inst_trading(rows: List[Tuple[str, str, float, float, float, float, float]], query_type: int, conn=None) -> int:
     if not rows:
         return 0
-    conn_local = conn or (qdb_connect() if qdb_connect else None)
-    if not conn_local:
-        return 0
-    try:
-        cur = conn_local.cursor()
-        ingest_date = datetime.now().date()
-        values = [
-            (
-                ingest_date,
-                cd,
-                name,
-                _num(buy_amt),
-                _num(buy_times),
-                _num(sell_amt),
-                _num(sell_times),
-                _num(net_amt),
-                int(query_type),
-            )
-            for (cd, name, buy_amt, buy_times, sell_amt, sell_times, net_amt) in rows
-        ]
-        try:
-            cur.executemany(
-                """
-                insert into inst_trading_tracker (
-                  ingest_date, code, name, buy_amount, buy_times, sell_amount, sell_times, net_amount, query_type
-                ) values (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """,
-                values,
-            )
-        except Exception as e:
-            logger.exception("批量写入失败: %s", e)
-            if conn is None:
-                try:
-                    conn_local.close()
-                except Exception:
-                    pass
-            return 0
-        if conn is None:
-            try:
-                conn_local.close()
-            except Exception:
-                pass
-        return len(values)
-    except Exception:
-        try:
-            if conn is None:
-                conn_local.close()
-        except Exception:
-            pass
+    ingest_date = datetime.now().date()
+    values = [
+        (
+            ingest_date,
+            cd,
+            name,
+            _num(buy_amt),
+            _num(buy_times),
+            _num(sell_amt),
+            _num(sell_times),
+            _num(net_amt),
+            int(query_type),
+        )
+        for (cd, name, buy_amt, buy_times, sell_amt, sell_times, net_amt) in rows
+    ]
+    if not qdb_write_rows:
         return 0
+    report = qdb_write_rows('inst_trading_tracker', INST_TRADING_COLUMNS, values, conn=conn, flush=True)
+    if report.rejected:
+        logger.warning("批量写入部分失败: %s, errors=%s", report.summary(), report.errors[:3])
+    else:
+        logger.info("批量写入: %s", report.summary())
+    return report.written + report.spooled
 
 
 class DTBInstTradingTrackerTask(BaseTask):
@@ -277,7 +263,13 @@ class DTBInstTradingTrackerTask(BaseTask):
         start_date = end_date - timedelta(days=qt - 1)
 
         # 聚合
-        agg_rows = _aggregate_lhb(codes, start_date=start_date, end_date=end_date)
+        try:
+            agg_rows = _aggregate_lhb(codes, start_date=start_date, end_date=end_date, stop_event=self.stop_event)
+        except Exception as e:
+            # 数据源暂时不可用：记录异常，由重试策略决定是否重试
+            logger.warning("拉取龙虎榜失败: codes=%s, error=%s", codes, e)
+            self.last_error = e
+            return False
         if not agg_rows:
             logger.warning("在时间窗内未聚合到龙虎榜数据: codes=%s, query_type=%s", codes, qt)
             return False
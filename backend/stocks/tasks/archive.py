@@ -0,0 +1,162 @@
+"""
+已结束任务的归档与保留。
+
+tasks 以 created_at 为指定时间戳按天分区，task_events / worker_heartbeats 以 ts 按天分区（见 data_pipeline.collector）。
+每次全量更新会为每只股票生成任务与若干事件，表持续增长后任务列表、计数与投影加载都会变慢。
+archive_finished_tasks() 把旧任务移出热表：
+  - 截止时间 cutoff = 当前 - TASK_RETENTION_DAYS 天（默认 30），取整到天；若仍有更早创建的未结束任务
+    （待处理 / 处理中 / 重试中），cutoff 退到该任务创建当天，整分区删除不会丢掉未结束任务
+  - 按天把 created_at < cutoff 的任务连同当前状态（最终状态、开始 / 结束时间、执行者、最后事件 detail）
+    写入 tasks_archive 表（target='table'，服务端 insert ... select），
+    或写成 Parquet 文件（target='parquet'，每天一个 tasks_YYYYMMDD.parquet）
+  - 等待 WAL 应用并核对行数后，删除 tasks、task_events、worker_heartbeats 中 cutoff 之前的分区
+任务事件的 ts 不早于任务的创建时间，cutoff 之前的事件都属于已归档的任务；
+已归档任务在 cutoff 之后的少量事件随下一次归档删除。tasks_archive 按 (created_at, task_id) 去重，重复执行幂等。
+由 manage.py qdb_archive_tasks 执行（可配置为每日定时任务）。
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    from data_pipeline.bulk_import import wait_wal_applied
+except Exception:
+    wait_wal_applied = None
+
+from .events import TASK_COLUMNS, oldest_active_before, task_state_sql
+
+logger = logging.getLogger(__name__)
+
+# tasks_archive 的列顺序与 TASK_COLUMNS 一致
+ARCHIVE_TABLE = 'tasks_archive'
+
+
+def retention_days() -> float:
+    try:
+        return float(os.getenv('TASK_RETENTION_DAYS', '30'))
+    except ValueError:
+        return 30.0
+
+
+def _lit(ts: datetime) -> str:
+    return f"'{ts:%Y-%m-%dT%H:%M:%S.%f}Z'"
+
+
+def _day(ts: datetime) -> datetime:
+    return datetime(ts.year, ts.month, ts.day)
+
+
+def archive_cutoff(conn, days: float, now: Optional[datetime] = None) -> Optional[datetime]:
+    """可归档的截止时间（不含）：days 天前的零点，且不晚于最早的未结束任务的创建当天。"""
+    if days <= 0:
+        return None
+    cutoff = _day((now or datetime.utcnow()) - timedelta(days=days))
+    oldest_active = oldest_active_before(conn, cutoff)
+    if oldest_active is not None:
+        logger.info("存在 %s 创建的未结束任务，归档截止时间退到该日", oldest_active)
+        cutoff = _day(oldest_active)
+    return cutoff
+
+
+def _count(cur, sql: str, params: tuple = ()) -> int:
+    cur.execute(sql, params)
+    return int((cur.fetchone() or [0])[0] or 0)
+
+
+def _archive_day_table(cur, day: datetime, end: datetime) -> None:
+    cols = ', '.join(TASK_COLUMNS)
+    cur.execute(
+        f"insert into {ARCHIVE_TABLE} ({cols}) select {cols} from ({task_state_sql(day)}) where created_at < %s",
+        (end,),
+    )
+
+
+def _archive_day_parquet(cur, day: datetime, end: datetime, directory: Path) -> int:
+    import pandas as pd
+
+    cur.execute(
+        f"select {', '.join(TASK_COLUMNS)} from ({task_state_sql(day)}) where created_at < %s",
+        (end,),
+    )
+    rows = cur.fetchall() or []
+    if not rows:
+        return 0
+    df = pd.DataFrame(rows, columns=list(TASK_COLUMNS))
+    path = directory / f"tasks_{day:%Y%m%d}.parquet"
+    tmp = path.with_suffix('.parquet.tmp')
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+    return len(df)
+
+
+def archive_finished_tasks(
+    conn,
+    days: Optional[float] = None,
+    target: str = 'table',
+    directory: Optional[str] = None,
+    dry_run: bool = False,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """
+    归档 created_at 早于截止时间的任务并删除热表中对应的分区，返回
+    {'cutoff', 'days', 'tasks', 'archived', 'dropped'}（dropped 为是否已删除分区）。
+    归档结果核对不一致时不删除分区。
+    """
+    if target not in ('table', 'parquet'):
+        raise ValueError(f"未知的归档目标: {target}")
+    if target == 'parquet' and not directory:
+        raise ValueError("Parquet 归档需要指定目录")
+    days = retention_days() if days is None else float(days)
+    result: Dict[str, Any] = {'cutoff': None, 'days': 0, 'tasks': 0, 'archived': 0, 'dropped': False}
+    cutoff = archive_cutoff(conn, days, now=now)
+    if cutoff is None:
+        return result
+    result['cutoff'] = cutoff.isoformat()
+    cur = conn.cursor()
+    cur.execute("select min(created_at) from tasks where created_at < %s", (cutoff,))
+    first = (cur.fetchone() or [None])[0]
+    if first is None:
+        return result
+    result['tasks'] = _count(cur, "select count_distinct(task_id) from tasks where created_at < %s", (cutoff,))
+    day_list: List[datetime] = []
+    day = _day(first)
+    while day < cutoff:
+        day_list.append(day)
+        day += timedelta(days=1)
+    result['days'] = len(day_list)
+    if dry_run:
+        return result
+
+    out_dir = Path(directory) if target == 'parquet' else None
+    if out_dir is not None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+    archived = 0
+    for day in day_list:
+        end = min(day + timedelta(days=1), cutoff)
+        if out_dir is not None:
+            archived += _archive_day_parquet(cur, day, end, out_dir)
+        else:
+            _archive_day_table(cur, day, end)
+        logger.info("已归档 %s 创建的任务", day.date())
+
+    if target == 'table':
+        if wait_wal_applied is not None and not wait_wal_applied(conn, [ARCHIVE_TABLE], timeout=300):
+            logger.warning("%s 的 WAL 未在超时内应用，本次不删除分区", ARCHIVE_TABLE)
+            return result
+        archived = _count(
+            cur, f"select count(*) from {ARCHIVE_TABLE} where created_at >= %s and created_at < %s", (_day(first), cutoff),
+        )
+    result['archived'] = archived
+    if archived < result['tasks']:
+        logger.warning("归档行数 %s 少于待归档任务数 %s，本次不删除分区", archived, result['tasks'])
+        return result
+
+    lit = _lit(cutoff)
+    cur.execute(f"alter table tasks drop partition where created_at < {lit}")
+    cur.execute(f"alter table task_events drop partition where ts < {lit}")
+    cur.execute(f"alter table worker_heartbeats drop partition where ts < {lit}")
+    result['dropped'] = True
+    logger.info("已删除 %s 之前的任务分区（%s 个任务）", cutoff.date(), result['tasks'])
+    return result
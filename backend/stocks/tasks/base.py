@@ -1,9 +1,12 @@
 import json
 import uuid
 import logging
-from typing import Any, Dict, Optional, Union
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 from abc import ABC, abstractmethod
 
+from .retry import task_outcome
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,7 +17,10 @@ class BaseTask(ABC):
       期望 ORM 对象至少实现：
         * insert_task(task_id, task_type, task_desc, task_params, priority, status)
         * update_task_status(task_id, status)
-    - 运行任务：默认流程更新任务状态（待处理→处理中→成功/失败）
+      批量生成（generate_many）优先使用 insert_tasks(rows)，未实现时逐条 insert_task；
+      ORM 实现 coalesce_tasks / supersede_tasks 时先与未结束的同键任务合并
+    - 运行任务：默认流程更新任务状态（待处理→处理中→成功/失败）；
+      失败原因可重试（见 stocks.tasks.retry）时置为“重试中”并在 detail 中记录尝试次数与下次尝试时间
     子类必须实现 `run()` 执行具体逻辑。
     """
 
@@ -32,6 +38,10 @@ class BaseTask(ABC):
         self.params_str = self._ensure_json_str(params)
         self.priority = priority
         self.task_id: Optional[str] = None
+        # run() 返回 False 时最近一次的异常（数据源 / 写入），用于判断是否可重试
+        self.last_error: Optional[BaseException] = None
+        # 执行方的停止标记（如 views 的 ctrl['stop_event']）：数据源调用等待限流时据此放弃
+        self.stop_event: Optional[threading.Event] = None
 
     @staticmethod
     def _ensure_json_str(params: Optional[Union[Dict[str, Any], str]]) -> str:
@@ -73,12 +83,54 @@ class BaseTask(ABC):
             logger.exception("生成任务失败: %s", e)
             raise
 
+    def generate_many(
+        self,
+        task_type: str,
+        items: Iterable[Tuple[str, Optional[Union[Dict[str, Any], str]]]],
+        priority: int = 0,
+        coalesce: bool = True,
+    ) -> List[str]:
+        """
+        批量生成任务：items 为 (task_desc, params) 序列，全部以“待处理”写入，返回 task_id 列表（与 items 顺序一致）。
+        ORM 实现 insert_tasks(rows) 时整批一次写入（rows 元素同 insert_task 的参数元组），否则逐条插入。
+        coalesce=True 且 ORM 支持时，与已有同键任务合并（见 stocks.tasks.coalesce），
+        被合并的请求返回其所并入任务的 task_id，因此返回列表中可能有重复。
+        """
+        prio = int(priority or 0)
+        rows = [
+            (uuid.uuid4().hex, task_type, desc or "", self._ensure_json_str(params), prio, "待处理")
+            for desc, params in items
+        ]
+        if not rows:
+            return []
+        ids = [r[0] for r in rows]
+        superseded: List[Tuple[str, str]] = []
+        if coalesce and hasattr(self.orm, 'coalesce_tasks'):
+            rows, ids, superseded = self.orm.coalesce_tasks(rows)
+        try:
+            written = len(rows)
+            if hasattr(self.orm, 'insert_tasks'):
+                written = self.orm.insert_tasks(rows)
+                if written < len(rows):
+                    logger.warning("批量生成任务部分失败: %s/%s (%s)", written, len(rows), task_type)
+            else:
+                for row in rows:
+                    self.orm.insert_task(*row)
+            # 新任务全部写入后才取消被合并的旧任务，部分失败时保留旧任务
+            if superseded and written == len(rows):
+                self.orm.supersede_tasks(superseded)
+            logger.info("批量生成任务: %s 条 (%s)", len(rows), task_type)
+            return ids
+        except Exception as e:
+            logger.exception("批量生成任务失败: %s", e)
+            raise
+
     def execute(self) -> bool:
         """
         执行任务：
         - 若未生成则先生成任务（状态=待处理）
         - 更新状态为“处理中”，执行 `run()`
-        - 根据结果更新为“成功”或“失败”
+        - 根据结果更新为“成功”，或按重试策略更新为“重试中” / “失败”
         返回布尔值表示成功/失败。
         """
         if not self.task_id:
@@ -90,21 +142,23 @@ class BaseTask(ABC):
             except Exception:
                 pass
         try:
-            ok = self.run()
+            ok = bool(self.run())
+            error = None if ok else self.last_error
         except Exception as exc:
             logger.exception("任务执行异常: %s", exc)
-            if hasattr(self.orm, 'update_task_status'):
-                try:
-                    self.orm.update_task_status(self.task_id, "失败")
-                except Exception:
-                    pass
-            return False
+            ok, error = False, exc
+        status, detail = task_outcome(
+            self.task_type, self.task_id, ok, error, getattr(self.orm, 'projection', None), conn=getattr(self.orm, '_conn', None),
+        )
         if hasattr(self.orm, 'update_task_status'):
             try:
-                self.orm.update_task_status(self.task_id, "成功" if ok else "失败")
+                if detail is None:
+                    self.orm.update_task_status(self.task_id, status)
+                else:
+                    self.orm.update_task_status(self.task_id, status, detail)
             except Exception:
                 pass
-        return bool(ok)
+        return ok
 
     @abstractmethod
     def run(self) -> bool:
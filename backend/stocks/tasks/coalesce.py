@@ -0,0 +1,124 @@
+"""
+按 (任务类型, 代码, 复权方式) 合并重复任务，以及按代码的在途互斥。
+
+重复点击“全量更新”会为每只股票再生成一个 download_daily 任务，队列随后重复下载同一代码。
+提交时（BaseTask.generate_many → QdbOrm.coalesce_tasks）：
+  - 已有同键的待处理 / 重试中任务：两者合并为一个新任务（日期区间取并集、优先级取最高），
+    旧任务追加“已取消”事件（detail 记录 merged_into）
+  - 已有同键的处理中任务：新请求的区间被其覆盖时直接丢弃，否则照常入队（执行时受在途互斥约束）
+  - 同一批次内的同键请求先相互合并
+在途互斥：
+  - 认领时（ActiveTaskProjection.claim_batch）跳过代码正在处理中的任务，多进程之间经事件投影生效
+  - 执行时 code_guard(code) 保证同一进程内同一代码同时只有一个线程在拉取
+只对单代码任务（params.code，或只含一个代码的 params.codes）生效。
+"""
+import json
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+CoalesceKey = Tuple[str, str, str]
+
+
+def task_code(params: Dict[str, Any]) -> Optional[str]:
+    code = params.get('code')
+    if not code and isinstance(params.get('codes'), list) and len(params['codes']) == 1:
+        code = params['codes'][0]
+    return str(code).strip() if code else None
+
+
+def parse_params(task_params: Optional[str]) -> Dict[str, Any]:
+    try:
+        params = json.loads(task_params or '{}')
+        return params if isinstance(params, dict) else {}
+    except Exception:
+        return {}
+
+
+def coalesce_key(task_type: Optional[str], params: Dict[str, Any]) -> Optional[CoalesceKey]:
+    code = task_code(params)
+    if not task_type or not code:
+        return None
+    return (task_type, code, str(params.get('adjust') or ''))
+
+
+def _d(v: Any) -> Optional[str]:
+    return str(v).replace('-', '')[:8] if v else None
+
+
+def _min_date(a: Any, b: Any) -> Optional[str]:
+    # 未指定起始日期表示从最早开始，为最宽区间
+    a, b = _d(a), _d(b)
+    return None if a is None or b is None else min(a, b)
+
+
+def _max_date(a: Any, b: Any) -> Optional[str]:
+    # 未指定结束日期表示到今天，为最宽区间
+    a, b = _d(a), _d(b)
+    return None if a is None or b is None else max(a, b)
+
+
+def merge_params(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """合并两个同键任务的参数：日期区间取并集，增量仅当两者都是增量时保留，其余字段以新请求为准。"""
+    merged = dict(old)
+    merged.update(new)
+    for key in ('start_date', 'full_start_date'):
+        if key in old or key in new:
+            merged[key] = _min_date(old.get(key, old.get('start_date')), new.get(key, new.get('start_date')))
+    merged['end_date'] = _max_date(old.get('end_date'), new.get('end_date'))
+    if 'incremental' in old or 'incremental' in new:
+        merged['incremental'] = bool(old.get('incremental')) and bool(new.get('incremental'))
+    if 'lookback_days' in old or 'lookback_days' in new:
+        merged['lookback_days'] = max(int(old.get('lookback_days') or 0), int(new.get('lookback_days') or 0))
+    return {k: v for k, v in merged.items() if v is not None}
+
+
+def covers(running: Dict[str, Any], new: Dict[str, Any]) -> bool:
+    """running 的日期区间是否覆盖 new（new 的请求无需再执行）。"""
+    rs, ns = _d(running.get('start_date')), _d(new.get('start_date'))
+    re_, ne = _d(running.get('end_date')), _d(new.get('end_date'))
+    if rs is not None and (ns is None or ns < rs):
+        return False
+    if re_ is not None and (ne is None or ne > re_):
+        return False
+    return not running.get('incremental') or bool(new.get('incremental'))
+
+
+class CodeGuard:
+    """进程内按代码互斥：同一代码同时只允许一个线程执行。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._refs: Dict[str, int] = {}
+
+    @contextmanager
+    def hold(self, code: Optional[str]) -> Iterator[None]:
+        if not code:
+            yield
+            return
+        with self._lock:
+            lock = self._locks.setdefault(code, threading.Lock())
+            self._refs[code] = self._refs.get(code, 0) + 1
+        lock.acquire()
+        try:
+            yield
+        finally:
+            lock.release()
+            with self._lock:
+                self._refs[code] -= 1
+                if not self._refs[code]:
+                    del self._refs[code]
+                    del self._locks[code]
+
+    def active(self) -> int:
+        with self._lock:
+            return len(self._refs)
+
+
+_guard = CodeGuard()
+
+
+def code_guard(code: Optional[str]):
+    """with code_guard(code): ... —— 同一进程内同一代码串行执行。"""
+    return _guard.hold(code)
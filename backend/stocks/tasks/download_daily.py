@@ -1,91 +1,83 @@
 import json
 import logging
-from typing import Any, Dict, List, Optional
-from datetime import datetime
+import os
+import threading
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from datetime import date, datetime, timedelta
 
 from .base import BaseTask
+from .coalesce import code_guard, coalesce_key, covers, merge_params, parse_params
+from .events import (
+    CLAIMABLE_STATUSES, ActiveTaskProjection, TASK_COLUMNS, TASK_STATE_SQL, TaskRecord, append_event, claim_winners,
+    count_tasks, default_projection, default_worker, iter_task_records, lease_detail, server_now, task_state_sql,
+)
 
-def _num(x):
-    try:
-        return float(x) if x not in (None, '') else None
-    except Exception:
-        return None
+# 日线列式转换（与 data_pipeline.collector 共用）
+try:
+    from data_pipeline.daily_frame import daily_rows, DAILY_INSERT_COLUMNS
+    from data_pipeline.adjust import FACTOR_ADJUST, factor_rows
+except Exception:
+    daily_rows = None
+    FACTOR_ADJUST = 'hfq-factor'
+
+# 写入入口（PG 批量写入 / ILP，由环境变量 QDB_WRITER 选择）
+try:
+    from data_pipeline.collector import qdb_write_rows, qdb_flush_writer, qdb_daily_watermarks, qdb_daily_since, qdb_insert_factors
+    from data_pipeline.bulk_writer import BulkWriter, WriteReport
+    from data_pipeline.source_limiter import source_call
+except Exception:
+    qdb_write_rows = None
+    BulkWriter = None
 
+# tasks / task_events 表批量插入列顺序（见 QdbOrm.insert_tasks / append_events）
+TASK_INSERT_COLUMNS = ('task_id', 'task_type', 'task_desc', 'task_params', 'priority', 'status', 'created_at')
+TASK_EVENT_COLUMNS = ('task_id', 'status', 'ts', 'worker', 'detail')
 
-def _int(x):
-    try:
-        return int(x) if x not in (None, '') else None
-    except Exception:
-        return None
 
 def _insert_daily(code, df, adj, conn=None):
     if df is None or getattr(df, 'empty', True):
         return 0
-    conn_local = conn 
-    if not conn_local:
-        return 0
+    report = _insert_daily_rows(daily_rows(code, df, adj).values, conn=conn)
+    return report.written + report.spooled
+
+
+def _insert_daily_rows(values, conn=None) -> "WriteReport":
+    """写入已转换好的日线元组（见 daily_frame.daily_rows），返回 WriteReport。"""
+    return qdb_write_rows('stock_daily', DAILY_INSERT_COLUMNS, values, conn=conn)
+
+
+def default_lookback_days() -> int:
+    """增量下载的回看天数（自然日），环境变量 DAILY_LOOKBACK_DAYS，默认 7。"""
     try:
-        cur = conn_local.cursor()
-        cols = {
-            '日期': 'date',
-            '开盘': 'open',
-            '收盘': 'close',
-            '最高': 'high',
-            '最低': 'low',
-            '成交量': 'volume',
-            '成交额': 'amount',
-            '换手率': 'turnover',
-            '流通股本': 'outstanding_share',
-        }
-        df = df.rename(columns=cols)
-        values = []
-        for _, r in df.iterrows():
-            d = r.get('date')
-            if not d:
-                continue
-            try:
-                trade_date = d if isinstance(d, datetime) else datetime.strptime(str(d), '%Y-%m-%d')
-            except Exception:
-                continue
-            adj_norm = adj if (adj and str(adj).strip()) else None
-            values.append((
-                code,
-                trade_date.date(),
-                adj_norm,
-                _num(r.get('open')),
-                _num(r.get('close')),
-                _num(r.get('high')),
-                _num(r.get('low')),
-                _int(r.get('volume')),
-                _num(r.get('amount')),
-                _num(r.get('turnover')),
-                _num(r.get('outstanding_share')),
-            ))
-        if values:
-            try:
-                cur.executemany(
-                    """
-                    insert into stock_daily (
-                      code, trade_date, adjust_type, open, close, high, low, volume, amount, turnover, outstanding_share
-                    ) values (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                    """,
-                    values
-                )
-            except Exception:
-                return 0
-        if conn is None:
-            try:
-                conn_local.close()
-            except Exception:
-                pass
-        return len(values)
+        return max(0, int(os.getenv('DAILY_LOOKBACK_DAYS', '7')))
     except Exception:
+        return 7
+
+
+def default_chunk_days() -> int:
+    """
+    单次拉取的日期窗口（自然日）：DAILY_CHUNK_DAYS（默认 365），且不超过每个工作线程的
+    在途行数上限 DAILY_MAX_INFLIGHT_ROWS（默认 5000）——日线每个自然日至多一行，窗口天数即在途行数上限。
+    """
+    def _env(name, default):
         try:
-            if conn is None:
-                conn_local.close()
+            return max(1, int(os.getenv(name) or default))
         except Exception:
-            pass
-        return 0
+            return default
+    return min(_env('DAILY_CHUNK_DAYS', 365), _env('DAILY_MAX_INFLIGHT_ROWS', 5000))
+
+
+def _changed(new_row: tuple, stored: Optional[tuple]) -> bool:
+    """比较新拉取行与已入库行的 (close, volume)，价格按相对误差 1e-6 判断。"""
+    if stored is None:
+        return True
+    close, volume = new_row[4], new_row[7]
+    s_close, s_volume = stored
+    if (close is None) != (s_close is None) or (volume is None) != (s_volume is None):
+        return True
+    if close is not None and abs(close - s_close) > 1e-6 * max(1.0, abs(s_close)):
+        return True
+    return volume is not None and int(volume) != int(s_volume)
 
 # 依赖：Akshare 数据源
 try:
@@ -96,6 +88,20 @@ except Exception:
 logger = logging.getLogger(__name__)
 
 
+class DailyUnit(NamedTuple):
+    """一个 (code, adjust) 下载单元。"""
+    code: str
+    symbol: str
+    adj: str
+    start_date: str
+    end_date: str
+    watermark: Optional[date] = None
+    lookback: int = 0
+    full_start: Optional[str] = None
+    # 绕过数据源缓存（前复权基准变化后整段重拉，缓存中是旧基准的数据）
+    fresh: bool = False
+
+
 class DownloadDailyTask(BaseTask):
     """
     从 BaseTask 派生的任务：下载并写入股票日线数据到 QuestDB。
@@ -105,12 +111,28 @@ class DownloadDailyTask(BaseTask):
       - market: 市场标识（可选，'SH'/'SZ'/'BJ'，默认空）
       - start_date: 开始日期（'YYYYMMDD'或'YYYY-MM-DD'）
       - end_date: 结束日期（'YYYYMMDD'或'YYYY-MM-DD'）
+      - adjust: ''/'qfq'/'hfq'/'all'
+        'all' 只下载不复权日线 + 后复权因子（adj_factor），前/后复权由 DailyDataView 按因子计算；
+        单独指定 'qfq'/'hfq' 时仍下载并存储对应的复权序列
+      - incremental: 是否按水位线增量下载（默认 False）
+      - lookback_days: 增量回看天数（默认环境变量 DAILY_LOOKBACK_DAYS=7）
+      - full_start_date: 需要全量重拉时的起始日期（默认同 start_date）
+      - chunk_days: 单次拉取的日期窗口（默认见 default_chunk_days）
     执行逻辑：为每个股票调用 ak.stock_zh_a_daily 并写入 QuestDB。
+    增量模式下每个 (code, adjust) 只拉取 [水位线+1-回看天数, end_date]：
+      - 回看窗口内与已入库数据一致的行不重复写入，有更正的行重新写入
+      - 前复权（qfq）序列在除权后整体重算，回看窗口内出现差异时改为从 full_start_date 全量重拉
+    长区间按 chunk_days 切成多个窗口，逐窗口拉取 → 转换 → 写入后再拉下一个，内存只保留一个窗口；
+    每个窗口完成后回调 on_progress(unit, saved)。某窗口失败即停止该 (code, adjust)，避免水位线越过缺口。
     """
 
     def __init__(self, orm):
         # 仅要求传入 orm，其余字段在 generate() 时设置
         super().__init__(orm, task_type="", task_desc="", params=None, priority=0)
+        self.write_report = WriteReport('stock_daily') if qdb_write_rows else None
+        self._report_lock = threading.Lock()
+        self.chunk_days = default_chunk_days()
+        self.on_progress: Optional[Callable[[DailyUnit, int], None]] = None
 
     def generate(self, task_type: str, task_desc: str = "", params: Optional[Dict[str, Any]] = None, priority: int = 0) -> str:
         # 在生成前配置必要字段
@@ -126,12 +148,27 @@ class DownloadDailyTask(BaseTask):
         except Exception:
             return {}
 
-    def run(self, conn=None) -> bool:
-        # 检查依赖
-        if not (ak):
-            logger.error("依赖不可用：akshare 未导入")
-            return False
-        params = self._parse_params()
+    def plan(self, conn) -> Optional[Tuple[List[DailyUnit], bool]]:
+        """
+        解析任务参数并拆分为 (code, adjust) 下载单元，增量模式下查询水位线。
+        返回 (units, incremental)；参数无效时返回 None。
+        """
+        spec = self.units_for(self._parse_params())
+        if spec is None:
+            return None
+        units, incremental = spec
+        if incremental:
+            units = self.with_watermarks(units, conn)
+        return units, incremental
+
+    @staticmethod
+    def with_watermarks(units: List[DailyUnit], conn) -> List[DailyUnit]:
+        """一次查询所有单元代码的水位线并填入单元。"""
+        watermarks = qdb_daily_watermarks(sorted({u.code for u in units}), conn=conn)
+        return [u._replace(watermark=watermarks.get((u.code, u.adj))) for u in units]
+
+    def units_for(self, params: Dict[str, Any]) -> Optional[Tuple[List[DailyUnit], bool]]:
+        """按参数拆分下载单元（不含水位线），返回 (units, incremental)；参数无效时返回 None。"""
         market = (params.get('market') or '').upper()
         adjust = (params.get('adjust') or '').lower()
         # 归一化日期
@@ -164,7 +201,7 @@ class DownloadDailyTask(BaseTask):
         codes = list(dict.fromkeys(codes))
         if not codes:
             logger.warning("未提供有效的股票代码（params 需包含 'code' 或 'codes'）")
-            return False
+            return None
 
         def make_symbol(c: str, m: str) -> str:
             m = (m or '').upper()
@@ -176,40 +213,57 @@ class DownloadDailyTask(BaseTask):
                 return 'bj' + c
             return 'sz' + c
 
-        conn_local = conn 
+        incremental = bool(params.get('incremental'))
+        try:
+            lookback = max(0, int(params.get('lookback_days')))
+        except Exception:
+            lookback = default_lookback_days()
+        full_start = _norm_date(params.get('full_start_date')) or start_date
+        try:
+            self.chunk_days = max(1, min(int(params.get('chunk_days')), default_chunk_days()))
+        except Exception:
+            self.chunk_days = default_chunk_days()
+
+        adjust_all = ['', FACTOR_ADJUST] if adjust == "all" else [adjust]
+        units = [
+            DailyUnit(
+                code, make_symbol(code, market), adj, start_date, end_date,
+                lookback=lookback, full_start=full_start,
+            )
+            for code in codes
+            for adj in adjust_all
+        ]
+        return units, incremental
+
+    def run(self, conn=None) -> bool:
+        # 检查依赖
+        if not (ak and daily_rows and qdb_write_rows):
+            logger.error("依赖不可用：akshare / pandas / data_pipeline 未导入")
+            return False
+        conn_local = conn
         if not conn_local:
             logger.error("QuestDB 连接失败")
             return False
         try:
+            plan = self.plan(conn_local)
+            if plan is None:
+                return False
+            units, incremental = plan
             total_saved = 0
-            latest_date: Optional[datetime] = None
-            for code in codes:
-                symbol = make_symbol(code, market)
-                adjust_all = ['', 'qfq', 'hfq'] if adjust == "all" else [adjust]
-                for adj in adjust_all:
-                    try:
-                        df = ak.stock_zh_a_daily(symbol=symbol, start_date=start_date, end_date=end_date, adjust=adj)
-                    except Exception as e:
-                        logger.exception("akshare 拉取失败: code=%s, symbol=%s, adj=%s, error=%s", code, symbol, adj, e)
-                        df = None
-                    try:
-                        saved = _insert_daily(code, df, adj, conn=conn_local)
-                        total_saved += int(saved or 0)
-                        if df is not None and not df.empty:
-                            df2 = df.rename(columns={'日期': 'date'})
-                            for _, r in df2.iterrows():
-                                d = r.get('date')
-                                if not d:
-                                    continue
-                                try:
-                                    td = d if isinstance(d, datetime) else datetime.strptime(str(d), '%Y-%m-%d')
-                                    latest_date = max(latest_date or td, td)
-                                except Exception:
-                                    pass
-                    except Exception as e:
-                        logger.exception("写入失败: code=%s, adj=%s, error=%s", code, adj, e)
-            logger.info("任务完成：codes=%s, total_saved=%s, latest_date=%s", codes, total_saved, latest_date.date() if latest_date else None)
-            return total_saved > 0
+            failures = 0
+            latest_date: Optional[date] = None
+            self.write_report = WriteReport('stock_daily')
+            for unit in units:
+                saved, latest, ok = self._sync_one(unit, conn_local)
+                total_saved += saved
+                failures += 0 if ok else 1
+                if latest:
+                    latest_date = max(latest_date or latest, latest)
+            if not qdb_flush_writer():
+                logger.error("ILP 缓冲推送失败: codes=%s", sorted({u.code for u in units}))
+                return False
+            logger.info("任务完成：codes=%s, total_saved=%s, latest_date=%s, %s", sorted({u.code for u in units}), total_saved, latest_date, self.write_report.summary())
+            return self.succeeded(incremental, total_saved, failures)
         finally:
             if conn is None:
                 try:
@@ -217,6 +271,171 @@ class DownloadDailyTask(BaseTask):
                 except Exception:
                     pass
 
+    def run_batch(self, items: Sequence[Dict[str, Any]], conn) -> Dict[str, bool]:
+        """
+        在同一连接与写入缓冲上批量执行多个任务（见 stocks.tasks.worker.run_task_batch），返回 task_id → 是否成功。
+        水位线对整批代码一次查询，ILP 缓冲整批推送一次；每个任务仍按自己的单元结果判定成功或失败，
+        各任务最近一次异常记入 self.errors（task_id → 异常），供重试判断。
+        """
+        self.errors: Dict[str, BaseException] = {}
+        if not (ak and daily_rows and qdb_write_rows):
+            logger.error("依赖不可用：akshare / pandas / data_pipeline 未导入")
+            return {item.get('task_id'): False for item in items}
+        planned: List[Tuple[str, List[DailyUnit], bool]] = []
+        results: Dict[str, bool] = {}
+        chunk_days = default_chunk_days()
+        for item in items:
+            spec = self.units_for(parse_params(item.get('task_params')))
+            if spec is None:
+                results[item.get('task_id')] = False
+                continue
+            chunk_days = min(chunk_days, self.chunk_days)
+            planned.append((item.get('task_id'), spec[0], spec[1]))
+        self.chunk_days = chunk_days
+        incremental_units = [u for _, units, incremental in planned if incremental for u in units]
+        marks = {(u.code, u.adj): u.watermark for u in self.with_watermarks(incremental_units, conn)} if incremental_units else {}
+        self.write_report = WriteReport('stock_daily')
+        outcome: Dict[str, Tuple[bool, int, int]] = {}
+        for task_id, units, incremental in planned:
+            total_saved = failures = 0
+            self.last_error = None
+            for unit in units:
+                if incremental:
+                    unit = unit._replace(watermark=marks.get((unit.code, unit.adj)))
+                saved, _, ok = self._sync_one(unit, conn)
+                total_saved += saved
+                failures += 0 if ok else 1
+            outcome[task_id] = (incremental, total_saved, failures)
+            if self.last_error is not None:
+                self.errors[task_id] = self.last_error
+        flushed = qdb_flush_writer()
+        if not flushed:
+            logger.error("ILP 缓冲推送失败: batch=%s", len(items))
+        for task_id, (incremental, total_saved, failures) in outcome.items():
+            results[task_id] = flushed and self.succeeded(incremental, total_saved, failures)
+        logger.info(
+            "批量任务完成：tasks=%s, ok=%s, %s", len(items), sum(1 for ok in results.values() if ok), self.write_report.summary(),
+        )
+        return results
+
+    @staticmethod
+    def succeeded(incremental: bool, total_saved: int, failures: int) -> bool:
+        if incremental:
+            # 增量模式下无新数据（如节假日）也算成功
+            return failures == 0
+        return total_saved > 0
+
+    # 单元级步骤：拉取 → 转换 → 写入（run() 串行组合；stocks.tasks.pipeline 分阶段并行执行）
+    @staticmethod
+    def window(unit: DailyUnit) -> Tuple[str, Optional[date]]:
+        """返回 (实际拉取起始日 YYYYMMDD, 回看比对起始日)。拉取起始日晚于 end_date 表示已是最新。"""
+        if not unit.watermark:
+            return unit.start_date, None
+        since = unit.watermark + timedelta(days=1 - unit.lookback) if unit.lookback else unit.watermark + timedelta(days=1)
+        return max(unit.start_date, since.strftime('%Y%m%d')), since
+
+    def chunks(self, unit: DailyUnit) -> List[DailyUnit]:
+        """将单元的实际拉取区间按 chunk_days 切成按时间顺序排列的窗口单元（因子表不切分）。"""
+        fetch_start, _ = self.window(unit)
+        if unit.adj == FACTOR_ADJUST or fetch_start > unit.end_date:
+            return [unit]
+        try:
+            start = datetime.strptime(fetch_start, '%Y%m%d').date()
+            end = datetime.strptime(unit.end_date, '%Y%m%d').date()
+        except Exception:
+            return [unit]
+        out = []
+        while start <= end:
+            stop = min(end, start + timedelta(days=self.chunk_days - 1))
+            out.append(unit._replace(start_date=start.strftime('%Y%m%d'), end_date=stop.strftime('%Y%m%d')))
+            start = stop + timedelta(days=1)
+        return out
+
+    def progress(self, unit: DailyUnit, saved: int) -> None:
+        logger.debug("窗口完成: code=%s, adj=%s, %s-%s, saved=%s", unit.code, unit.adj, unit.start_date, unit.end_date, saved)
+        if self.on_progress is not None:
+            try:
+                self.on_progress(unit, saved)
+            except Exception:
+                pass
+
+    def fetch(self, unit: DailyUnit):
+        fetch_start, _ = self.window(unit)
+        # 同一进程内同一代码不并发拉取（跨进程由认领时的在途互斥保证）
+        with code_guard(unit.code):
+            return source_call(
+                'akshare', ak.stock_zh_a_daily, symbol=unit.symbol, start_date=fetch_start, end_date=unit.end_date, adjust=unit.adj,
+                stop_event=self.stop_event, fresh=unit.fresh,
+            )
+
+    @staticmethod
+    def transform(unit: DailyUnit, df):
+        """拉取结果 → 入库元组（日线见 daily_rows，因子见 adjust.factor_rows）。"""
+        if unit.adj == FACTOR_ADJUST:
+            return factor_rows(unit.code, df)
+        return daily_rows(unit.code, df, unit.adj)
+
+    def store(self, unit: DailyUnit, rows, conn) -> Tuple[int, Optional[date], bool]:
+        """过滤回看窗口内未变化的行后写入，返回 (写入行数, 最大交易日, 是否成功)。"""
+        if unit.adj == FACTOR_ADJUST:
+            # 因子表整表覆盖写入（按 (ex_date, code) 去重），不参与日线水位线
+            return qdb_insert_factors(rows.values, conn=conn), None, True
+        values = rows.values
+        watermark = unit.watermark
+        if watermark and values and any(v[1] <= watermark for v in values):
+            _, since = self.window(unit)
+            stored = qdb_daily_since(unit.code, unit.adj, since, conn=conn) if unit.lookback else {}
+            if unit.adj == 'qfq' and any(v[1] <= watermark and _changed(v, stored.get(v[1])) for v in values if v[1] in stored):
+                # 前复权基准已变化：回看窗口内历史价格不一致，整段重拉
+                logger.info("前复权序列已重算，全量重拉: code=%s, from=%s", unit.code, unit.full_start)
+                return self._sync_one(
+                    unit._replace(start_date=unit.full_start or unit.start_date, watermark=None, fresh=True), conn,
+                )
+            values = [v for v in values if v[1] > watermark or _changed(v, stored.get(v[1]))]
+        report = _insert_daily_rows(values, conn=conn)
+        with self._report_lock:
+            self.write_report.merge(report)
+        if report.rejected:
+            logger.warning("写入部分失败: code=%s, adj=%s, %s", unit.code, unit.adj, report.summary())
+        if report.spooled:
+            # 数据库暂不可用：行已转存本地 spool，由后台回放写入，不必重新拉取
+            logger.warning("数据库不可用，已转存 spool: code=%s, adj=%s, %s", unit.code, unit.adj, report.summary())
+        saved = report.written + report.spooled
+        return saved, rows.latest_date or watermark, not report.rejected or bool(saved)
+
+    def _sync_one(self, unit: DailyUnit, conn) -> Tuple[int, Optional[date], bool]:
+        """按窗口依次拉取并写入单个 (code, adjust)，返回 (写入行数, 最大交易日, 是否成功)。"""
+        fetch_start, _ = self.window(unit)
+        if fetch_start > unit.end_date:
+            return 0, unit.watermark, True
+        total, latest = 0, None
+        for chunk in self.chunks(unit):
+            saved, chunk_latest, ok = self._sync_chunk(chunk, conn)
+            total += saved
+            if chunk_latest:
+                latest = max(latest or chunk_latest, chunk_latest)
+            self.progress(chunk, saved)
+            if not ok:
+                # 停在第一个失败的窗口，后续窗口若写入会让水位线越过缺口
+                return total, latest, False
+        return total, latest or unit.watermark, True
+
+    def _sync_chunk(self, unit: DailyUnit, conn) -> Tuple[int, Optional[date], bool]:
+        try:
+            df = self.fetch(unit)
+        except Exception as e:
+            logger.exception("akshare 拉取失败: code=%s, symbol=%s, adj=%s, error=%s", unit.code, unit.symbol, unit.adj, e)
+            self.last_error = e
+            return 0, None, False
+        try:
+            rows = self.transform(unit, df)
+            del df
+            return self.store(unit, rows, conn)
+        except Exception as e:
+            logger.exception("写入失败: code=%s, adj=%s, error=%s", unit.code, unit.adj, e)
+            self.last_error = e
+            return 0, None, False
+
 # 迁移自 qdb_orm.py：提供 QuestDB 任务表的轻量 ORM 适配器
 try:
     from data_pipeline.collector import qdb_connect
@@ -227,26 +446,36 @@ except Exception:
 class QdbOrm:
     """
     最简 QuestDB ORM 适配器：提供任务表的常用操作，供 BaseTask 使用。
+    tasks 表保存任务定义，状态迁移追加到 task_events（只追加，见 stocks.tasks.events），
+    读取时以每个任务的最新事件为当前状态。
     提供：
       - insert_task(task_id, task_type, task_desc, task_params, priority, status)
-      - update_task_status(task_id, status)
-      - get_task(task_id)
-      - list_tasks(status=None, task_type=None, limit=100, offset=0)
+      - insert_tasks(rows)：批量插入，多行 VALUES 单条语句
+      - coalesce_tasks(rows) / supersede_tasks(pairs)：提交前与未结束的同键任务合并（见 stocks.tasks.coalesce）
+      - update_task_status(task_id, status, detail=None)：追加状态事件
+      - get_task(task_id) -> TaskRecord
+      - iter_tasks(status=None, task_type=None, chunk_size=1000)：流式遍历，产出 TaskRecord
+      - count_tasks(status=None, task_type=None)：COUNT 查询
+      - list_tasks(status=None, task_type=None, limit=100, offset=0, since=None)：since 限定创建时间（只扫描近期分区）
       - create_task(...)
       - update_task(...)
       - delete_task(task_id)
-      - next_pending_task(task_type=None)
-      - claim_task(task_id)
+      - next_pending_task(task_type=None)：从内存投影选取
+      - claim_task(task_id)：内存投影内判断并追加“处理中”事件
+      - claim_tasks(n, task_type=None)：一次认领 n 个任务，“处理中”事件单条语句写入
+      - claim_ids(task_ids, lease=None)：认领指定的任务（如全量更新本次运行生成的任务）
+      - append_events(rows)：批量追加状态事件
       - complete_task(task_id, success)
     可复用外部连接或内部创建连接。
     """
 
-    def __init__(self, conn: Optional[object] = None) -> None:
+    def __init__(self, conn: Optional[object] = None, projection: Optional[ActiveTaskProjection] = None) -> None:
         self._external_conn = conn
         self._conn = conn or (qdb_connect() if qdb_connect else None)
         if not self._conn:
             raise RuntimeError("QuestDB 连接不可用")
-        
+        self.projection = projection or default_projection()
+        self.worker = default_worker()
 
     def close(self) -> None:
         if not self._external_conn and self._conn:
@@ -257,47 +486,137 @@ class QdbOrm:
 
     # 基础插入/更新
     def insert_task(self, task_id: str, task_type: str, task_desc: str, task_params: str, priority: int, status: str) -> None:
+        created_at = server_now(self._conn)
         cur = self._conn.cursor()
         cur.execute(
             """
             insert into tasks (task_id, task_type, task_desc, task_params, priority, status, created_at)
-            values (%s, %s, %s, %s, %s, %s, now())
+            values (%s, %s, %s, %s, %s, %s, %s)
             """,
-            (task_id, task_type, task_desc, task_params, int(priority or 0), status),
+            (task_id, task_type, task_desc, task_params, int(priority or 0), status, created_at),
         )
-
-    def update_task_status(self, task_id: str, status: str) -> None:
-        cur = self._conn.cursor()
-        # 当置为"处理中"时设置 started_at；当置为"成功/失败/已取消"时设置 ended_at
-        cur.execute(
-            """
-            update tasks
-            set status=%s,
-                started_at = (case when %s='处理中' and started_at is null then now() else started_at end),
-                ended_at   = (case when %s in ('成功','失败','已取消') then now() else ended_at end)
-            where task_id=%s
-            """,
-            (status, status, status, task_id),
-        )
-
-    # 查询/列表
-    def _row_to_dict(self, cur, row):
+        self.projection.add(TaskRecord(task_id, task_type, task_desc, task_params, int(priority or 0), status, created_at))
+
+    def insert_tasks(self, rows: Sequence[Tuple[str, str, str, str, int, str]]) -> int:
+        """
+        批量插入任务，rows 元素为 (task_id, task_type, task_desc, task_params, priority, status)。
+        整批打包为一条多行 VALUES 语句（超过 BulkWriter 单批上限时分批），返回写入行数。
+        """
+        if not rows:
+            return 0
+        if BulkWriter is None:
+            for row in rows:
+                self.insert_task(*row)
+            return len(rows)
+        # created_at 与 now() 一致使用 UTC；同批逐行递增 1 微秒，保持插入顺序并使 iter_tasks 的键集分页唯一
+        created_at = server_now(self._conn)
+        values = [
+            (tid, tt, desc, params, int(prio or 0), st, created_at + timedelta(microseconds=i))
+            for i, (tid, tt, desc, params, prio, st) in enumerate(rows)
+        ]
+        writer = BulkWriter(self._conn, 'tasks', TASK_INSERT_COLUMNS, batch_size=len(values), adaptive=False)
+        report = writer.write(values)
+        # 只有确认写入的任务进入投影（rejected_rows 为全部未写入的行）
+        rejected = {r[0] for r in report.rejected_rows}
+        for v in values:
+            if v[0] not in rejected:
+                self.projection.add(TaskRecord(*v))
+        return report.written
+
+    def coalesce_tasks(
+        self, rows: Sequence[Tuple[str, str, str, str, int, str]],
+    ) -> Tuple[List[Tuple[str, str, str, str, int, str]], List[str], List[Tuple[str, str]]]:
+        """
+        与未结束的同键任务合并（rows 元素同 insert_tasks），返回 (需写入的行, 每个请求对应的 task_id, 被取代的 (旧, 新) 任务)。
+          - 同批同键：合并为一行
+          - 已有待处理 / 重试中：并入新行（区间取并集、优先级取最高），旧任务由 supersede_tasks 取消
+          - 已有处理中且其区间覆盖新请求：不写入，返回处理中任务的 id
+        """
+        self.projection.refresh(self._conn, max_age=float(os.getenv('TASK_REFRESH_INTERVAL', '2')))
+        active = self.projection.active_by_key()
+        out: List[Tuple[str, str, str, str, int, str]] = []
+        ids: List[str] = []
+        superseded: List[Tuple[str, str]] = []
+        slot: Dict[Tuple[str, str, str], int] = {}
+        for row in rows:
+            task_id, task_type, desc, params_str, prio, st = row
+            params = parse_params(params_str)
+            key = coalesce_key(task_type, params)
+            if key is None:
+                out.append(row)
+                ids.append(task_id)
+                continue
+            if key in slot:
+                i = slot[key]
+                prev = out[i]
+                merged = merge_params(parse_params(prev[3]), params)
+                out[i] = (prev[0], task_type, prev[2], json.dumps(merged, ensure_ascii=False), max(int(prev[4] or 0), int(prio or 0)), prev[5])
+                ids.append(prev[0])
+                continue
+            existing = active.get(key, [])
+            pending = [r for r in existing if r.status in CLAIMABLE_STATUSES]
+            running = [r for r in existing if r.status == '处理中']
+            if not pending:
+                cover = next((r for r in running if covers(parse_params(r.task_params), params)), None)
+                if cover is not None:
+                    ids.append(cover.task_id)
+                    continue
+            prio = int(prio or 0)
+            for r in pending:
+                params = merge_params(parse_params(r.task_params), params)
+                prio = max(prio, int(r.priority or 0))
+                superseded.append((r.task_id, task_id))
+            slot[key] = len(out)
+            out.append((task_id, task_type, desc, json.dumps(params, ensure_ascii=False), prio, st))
+            ids.append(task_id)
+        if len(out) < len(rows) or superseded:
+            logger.info("合并重复任务: 请求 %s 条, 写入 %s 条, 取代待处理 %s 条", len(rows), len(out), len(superseded))
+        return out, ids, superseded
+
+    def supersede_tasks(self, pairs: Sequence[Tuple[str, str]]) -> int:
+        """取消已被合并的旧任务：追加“已取消”事件，detail 记录 {"merged_into": 新任务}；已被认领的旧任务不再取消。"""
+        ts = server_now(self._conn)
+        rows = []
+        cancelled = []
+        for old_id, new_id in pairs:
+            rec = self.projection.try_cancel(old_id, self.worker, ts)
+            if rec is not None:
+                cancelled.append(rec)
+                rows.append((old_id, "已取消", ts, self.worker, json.dumps({'merged_into': new_id})))
         try:
-            cols = [d[0] for d in (cur.description or [])]
-            return {cols[i]: row[i] for i in range(len(cols))}
+            self.append_events(rows)
         except Exception:
-            return None
+            for rec in cancelled:
+                self.projection.restore(rec)
+            raise
+        return len(rows)
+
+    def update_task_status(self, task_id: str, status: str, detail: Optional[str] = None) -> None:
+        # 追加事件；started_at / ended_at 由事件时间推导（见 events.TASK_STATE_SQL）
+        ts = append_event(self._conn, task_id, status, self.worker, detail)
+        self.projection.apply(task_id, status, ts, self.worker, detail)
 
-    def get_task(self, task_id: str):
+    # 查询/列表
+    def get_task(self, task_id: str) -> Optional[TaskRecord]:
         cur = self._conn.cursor()
         cur.execute(
-            "select task_id, task_type, task_desc, task_params, priority, status from tasks where task_id=%s limit 1",
+            f"select {', '.join(TASK_COLUMNS)} from ({TASK_STATE_SQL}) where task_id=%s limit 1",
             (task_id,),
         )
         row = cur.fetchone()
-        return self._row_to_dict(cur, row) if row else None
+        return TaskRecord(*row) if row else None
 
-    def list_tasks(self, status: Optional[str] = None, task_type: Optional[str] = None, limit: int = 100, offset: int = 0):
+    def iter_tasks(self, status: Optional[str] = None, task_type: Optional[str] = None, chunk_size: int = 1000) -> Iterator[TaskRecord]:
+        """按创建时间流式遍历任务（每次取 chunk_size 行），产出 TaskRecord；内存占用与积压规模无关。"""
+        return iter_task_records(self._conn, status=status, task_type=task_type, chunk_size=chunk_size)
+
+    def count_tasks(self, status: Optional[str] = None, task_type: Optional[str] = None) -> int:
+        return count_tasks(self._conn, status=status, task_type=task_type)
+
+    def list_tasks(
+        self, status: Optional[str] = None, task_type: Optional[str] = None, limit: int = 100, offset: int = 0,
+        since: Optional[datetime] = None,
+    ):
         cur = self._conn.cursor()
         where = []
         params: List[object] = []
@@ -310,11 +629,12 @@ class QdbOrm:
         where_sql = (" where " + " and ".join(where)) if where else ""
         # QuestDB 不支持 OFFSET，移除 offset，仅保留 limit
         cur.execute(
-            f"select task_id, task_type, task_desc, task_params, priority, status from tasks{where_sql} order by priority desc limit %s",
+            f"select task_id, task_type, task_desc, task_params, priority, status from ({task_state_sql(since)}){where_sql} order by priority desc limit %s",
             (*params, int(limit or 100)),
         )
         rows = cur.fetchall() or []
-        return [self._row_to_dict(cur, r) for r in rows]
+        cols = [d[0] for d in (cur.description or [])]
+        return [dict(zip(cols, r)) for r in rows]
 
     # 便捷创建/更新/删除
     def create_task(self, task_type: str, task_desc: str = "", task_params: str = "{}", priority: int = 0, status: str = "待处理", task_id: Optional[str] = None) -> str:
@@ -336,45 +656,143 @@ class QdbOrm:
             sets.append("priority=%s")
             params.append(int(priority))
         if status is not None:
-            sets.append("status=%s")
-            params.append(status)
+            self.update_task_status(task_id, status)
         if not sets:
             return
         params.append(task_id)
         cur = self._conn.cursor()
         cur.execute(f"update tasks set {', '.join(sets)} where task_id=%s", tuple(params))
+        # 定义字段（优先级等）变化后按最新定义重新加入投影
+        self.projection.forget(task_id)
+        cur.execute(
+            f"select task_id, task_type, task_desc, task_params, priority, status, created_at from ({TASK_STATE_SQL}) where task_id=%s limit 1",
+            (task_id,),
+        )
+        row = cur.fetchone()
+        if row:
+            self.projection.add(TaskRecord(*row))
 
     def delete_task(self, task_id: str) -> None:
         cur = self._conn.cursor()
         cur.execute("delete from tasks where task_id=%s", (task_id,))
+        self.projection.forget(task_id)
 
     # 选择与认领/完成
     def next_pending_task(self, task_type: Optional[str] = None):
-        cur = self._conn.cursor()
-        where = ["status=%s"]
-        params: List[object] = ["待处理"]
-        if task_type:
-            where.append("task_type=%s")
-            params.append(task_type)
-        where_sql = " and ".join(where)
-        cur.execute(
-            f"select task_id, task_type, task_desc, task_params, priority, status from tasks where {where_sql} order by priority desc limit 1",
-            tuple(params),
-        )
-        row = cur.fetchone()
-        return self._row_to_dict(cur, row) if row else None
+        # 投影增量刷新（最多每 TASK_REFRESH_INTERVAL 秒一次，待处理为空时立即刷新）
+        self.projection.refresh(self._conn, max_age=float(os.getenv('TASK_REFRESH_INTERVAL', '2')))
+        return self.projection.next_pending(task_type)
 
     def claim_task(self, task_id: str) -> bool:
-        cur = self._conn.cursor()
-        # 乐观锁式认领：仅当当前为待处理时更新为处理中，并记录开始时间
-        cur.execute("update tasks set status=%s, started_at=(case when started_at is null then now() else started_at end) where task_id=%s and status=%s", ("处理中", task_id, "待处理"))
+        # 在投影锁内判断“待处理”并置为处理中，再追加事件；无需回读确认
+        ts = server_now(self._conn)
+        if not self.projection.try_claim(task_id, self.worker, ts):
+            return False
         try:
-            # 再读一遍确认
-            t = self.get_task(task_id)
-            return bool(t and t.get("status") == "处理中")
+            append_event(self._conn, task_id, "处理中", self.worker, ts=ts)
         except Exception:
-            return True
+            # 事件未写入，撤销投影中的认领
+            self.projection.apply(task_id, "待处理", ts + timedelta(microseconds=1))
+            raise
+        return True
+
+    def append_events(self, rows: Sequence[Tuple[str, str, datetime, Optional[str], Optional[str]]]) -> int:
+        """批量追加状态事件，rows 元素为 (task_id, status, ts, worker, detail)，多行 VALUES 单条语句写入。"""
+        if not rows:
+            return 0
+        rejected = self._write_events(rows)
+        if rejected:
+            logger.warning("状态事件部分写入失败: %s/%s", len(rejected), len(rows))
+        return len(rows) - len(rejected)
+
+    def _write_events(
+        self, rows: Sequence[Tuple[str, str, datetime, Optional[str], Optional[str]]], server_ts: bool = False,
+    ) -> List[tuple]:
+        """
+        写入状态事件，返回数据库拒绝（未写入）的行；连接错误抛出异常。
+        server_ts=True 时忽略行内 ts，由服务器写入 now()（认领事件，裁决不受主机时钟偏差影响）。
+        """
+        if BulkWriter is None:
+            for task_id, st, ts, worker, detail in rows:
+                if server_ts:
+                    self._conn.cursor().execute(
+                        "insert into task_events (task_id, status, ts, worker, detail) values (%s, %s, now(), %s, %s)",
+                        (task_id, st, worker, detail),
+                    )
+                else:
+                    append_event(self._conn, task_id, st, worker, detail, ts=ts)
+            return []
+        if not server_ts:
+            writer = BulkWriter(self._conn, 'task_events', TASK_EVENT_COLUMNS, batch_size=len(rows), adaptive=False)
+            return writer.write(list(rows)).rejected_rows
+        writer = BulkWriter(
+            self._conn, 'task_events', TASK_EVENT_COLUMNS, batch_size=len(rows), adaptive=False,
+            template='(%s, %s, now(), %s, %s)',
+        )
+        by_id = {r[0]: r for r in rows}
+        report = writer.write([(task_id, st, worker, detail) for task_id, st, _, worker, detail in rows])
+        return [by_id[r[0]] for r in report.rejected_rows]
+
+    def claim_tasks(
+        self, n: int, task_type: Optional[str] = None, lease: Optional[int] = None, settle: float = 1.0,
+        task_types: Optional[Sequence[str]] = None,
+    ) -> List[TaskRecord]:
+        """
+        一次认领至多 n 个待处理任务：投影内按调度顺序（见 stocks.tasks.scheduler）选取并置为处理中，
+        所有权（“处理中”事件，含 worker）以一条语句写入。写入失败时撤销认领并抛出异常，被数据库拒绝的认领撤销后不返回。
+        lease（秒）用于多进程工作者：事件中记录租约，写入后按 events.claim_winners 裁决，只返回本进程获胜的任务。
+        """
+        self.projection.refresh(self._conn, max_age=float(os.getenv('TASK_REFRESH_INTERVAL', '2')))
+        ts = server_now(self._conn)
+        claimed = self.projection.claim_batch(max(1, int(n)), task_type, self.worker, ts, task_types=task_types)
+        return self._commit_claims(claimed, ts, lease, settle)
+
+    def claim_ids(self, task_ids: Sequence[str], lease: Optional[int] = None, settle: float = 1.0) -> List[TaskRecord]:
+        """按 task_id 认领指定任务（跳过不可认领或代码正在处理中的），写入与裁决同 claim_tasks。"""
+        self.projection.refresh(self._conn, max_age=float(os.getenv('TASK_REFRESH_INTERVAL', '2')))
+        ts = server_now(self._conn)
+        claimed = self.projection.claim_ids(task_ids, self.worker, ts)
+        return self._commit_claims(claimed, ts, lease, settle)
+
+    def _commit_claims(
+        self, claimed: List[Tuple[TaskRecord, Optional[datetime]]], ts: datetime, lease: Optional[int], settle: float,
+    ) -> List[TaskRecord]:
+        # 投影内已置为处理中的认领：一条语句写入“处理中”事件，带租约时按最早认领裁决
+        if not claimed:
+            return []
+        detail = lease_detail(lease) if lease else None
+        try:
+            rows = [(rec.task_id, "处理中", ts, self.worker, detail) for rec, _ in claimed]
+            rejected = {r[0] for r in self._write_events(rows, server_ts=bool(lease))}
+        except Exception:
+            for rec, _ in claimed:
+                self.projection.apply(rec.task_id, "待处理", ts + timedelta(microseconds=1))
+            raise
+        if rejected:
+            # 未持久化的认领不算数：撤销投影中的处理中状态
+            logger.warning("认领事件部分写入失败，撤销 %s 个认领", len(rejected))
+            for task_id in rejected:
+                self.projection.apply(task_id, "待处理", ts + timedelta(microseconds=1))
+            claimed = [(rec, since) for rec, since in claimed if rec.task_id not in rejected]
+            if not claimed:
+                return []
+        if not lease:
+            return [rec for rec, _ in claimed]
+        winners = claim_winners(self._conn, {rec.task_id: since or datetime(1970, 1, 1) for rec, since in claimed}, settle)
+        won = []
+        for rec, _ in claimed:
+            winner = winners.get(rec.task_id)
+            if winner is None:
+                # 看不到任何认领事件（WAL 未应用）：按未获胜处理，不执行；投影保持处理中，由后续 refresh 校正
+                logger.warning("认领裁决时未读到认领事件，放弃任务: %s", rec.task_id)
+                continue
+            worker, wts = winner
+            if worker == self.worker:
+                won.append(rec)
+            else:
+                self.projection.apply(rec.task_id, "处理中", wts, worker)
+        return won
 
     def complete_task(self, task_id: str, success: bool) -> None:
-        # 完成时同时写入结束时间
-        self.update_task_status(task_id, "成功" if success else "失败")
\ No newline at end of file
+        # 完成时追加结束事件（ended_at 取事件时间）
+        self.update_task_status(task_id, "成功" if success else "失败")
@@ -0,0 +1,745 @@
+"""
+任务状态事件流与投影。
+
+tasks 表只保存任务定义（类型、描述、参数、优先级、创建时间与初始状态），状态迁移不再 UPDATE tasks，
+而是向 task_events (task_id, status, ts, worker, detail) 追加一行：写入开销与表大小无关。
+当前状态的两种读取方式：
+  - SQL：TASK_STATE_SQL 以 `latest on ts partition by task_id` 取每个任务的最新事件，
+    与 tasks 左连接（无事件的任务沿用 tasks.status，兼容旧数据），供 TaskListView / QdbOrm 查询
+  - 内存：ActiveTaskProjection 只跟踪未结束的任务（待处理 / 处理中 / 重试中），增量读取新任务与新事件，
+    供队列工作线程选取与认领任务，无需每次查库
+多进程 / 多节点（见 stocks.tasks.worker）：
+  - 认领事件 detail 记录租约 {"lease": 秒}；QuestDB 没有条件更新，各进程可能同时认领同一任务，
+    等待 WAL 应用后按“最早的认领事件获胜”（ts, worker 排序）裁决，所有进程看到相同结果
+  - 工作进程定期写 worker_heartbeats；认领者心跳超过租约时长的“处理中”任务由任一存活进程退回待处理
+  - 认领时跳过代码正在处理中的任务（按代码在途互斥，见 stocks.tasks.coalesce）
+“重试中”事件 detail 中的 next_attempt_at 到期前不认领该任务（自动重试与退避，见 stocks.tasks.retry）。
+认领顺序由 FairScheduler 决定（按类型加权公平、优先级老化、按类型并发上限，见 stocks.tasks.scheduler）。
+tasks 按 created_at、task_events 按 ts 按天分区：task_state_sql(since) 只扫描近期分区，旧任务由 stocks.tasks.archive 归档。
+"""
+import heapq
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    from data_pipeline.bulk_import import wait_wal_applied
+except Exception:
+    wait_wal_applied = None
+
+from .coalesce import CoalesceKey, coalesce_key, parse_params, task_code
+from .retry import retry_detail
+from .scheduler import FairScheduler
+
+TERMINAL_STATUSES = ('成功', '失败', '已取消')
+ACTIVE_STATUSES = ('待处理', '处理中', '重试中')
+# 可认领：待处理，以及被回收（见 reaper）等待重试的任务
+CLAIMABLE_STATUSES = ('待处理', '重试中')
+
+TASK_COLUMNS = ('task_id', 'task_type', 'task_desc', 'task_params', 'priority', 'status', 'created_at', 'started_at', 'ended_at', 'worker', 'detail')
+
+_TASK_STATE_TEMPLATE = """
+select t.task_id task_id, t.task_type task_type, t.task_desc task_desc, t.task_params task_params,
+       t.priority priority, coalesce(e.status, t.status) status, t.created_at created_at,
+       coalesce(s.started_at, t.started_at) started_at,
+       case when e.status in ('成功', '失败', '已取消') then e.ts else t.ended_at end ended_at,
+       e.worker worker, e.detail detail
+from {tasks} t
+left join (select task_id, status, ts, worker, detail from task_events{events_where} latest on ts partition by task_id) e on t.task_id = e.task_id
+left join (select task_id, min(ts) started_at from task_events where status = '处理中'{events_and}) s on t.task_id = s.task_id
+"""
+
+# 每个任务的当前状态（子查询，外层可继续 where / order by）
+TASK_STATE_SQL = _TASK_STATE_TEMPLATE.format(tasks='tasks', events_where='', events_and='')
+
+
+def task_state_sql(since: Optional[datetime] = None) -> str:
+    """
+    TASK_STATE_SQL；指定 since 时只读取 created_at >= since 的任务。
+    tasks 按 created_at、task_events 按 ts 分区，任务的事件不早于其创建时间，
+    两表的时间条件都写在子查询内，QuestDB 只扫描 since 之后的分区。
+    """
+    if since is None:
+        return TASK_STATE_SQL
+    lit = f"'{since:%Y-%m-%dT%H:%M:%S.%f}Z'"
+    return _TASK_STATE_TEMPLATE.format(
+        tasks=f"(select * from tasks where created_at >= {lit})",
+        events_where=f" where ts >= {lit}",
+        events_and=f" and ts >= {lit}",
+    )
+
+
+def oldest_active_before(conn, ts: datetime) -> Optional[datetime]:
+    """created_at 早于 ts 的未结束任务（待处理 / 处理中 / 重试中）中最早的创建时间，没有时为 None。"""
+    cur = conn.cursor()
+    marks = ', '.join(['%s'] * len(ACTIVE_STATUSES))
+    cur.execute(
+        f"select min(created_at) from ({task_state_sql()}) where status in ({marks}) and created_at < %s",
+        (*ACTIVE_STATUSES, ts),
+    )
+    return (cur.fetchone() or [None])[0]
+
+
+def _day(ts: datetime) -> datetime:
+    return datetime(ts.year, ts.month, ts.day)
+
+
+def hot_window_start(days: Optional[float] = None, conn=None) -> Optional[datetime]:
+    """
+    热查询的时间下界：最近 days 天（默认 TASK_HOT_DAYS，默认 30；0 表示不限）。
+    传入 conn 时下界不晚于最早的未结束任务的创建当天（与 archive.archive_cutoff 相同），未结束任务总在窗口内。
+    """
+    if days is None:
+        try:
+            days = float(os.getenv('TASK_HOT_DAYS', '30'))
+        except ValueError:
+            days = 30.0
+    if not days or days <= 0:
+        return None
+    start = datetime.utcnow() - timedelta(days=days)
+    if conn is not None:
+        oldest = oldest_active_before(conn, start)
+        if oldest is not None:
+            start = _day(oldest)
+    return start
+
+# WAL 表异步应用，事件按 ts 增量读取时回看一段时间，避免漏掉晚到的事件
+_REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+def default_worker() -> str:
+    """事件中的 worker 标识：主机名:进程号。"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def append_event(conn, task_id: str, status: str, worker: Optional[str] = None, detail: Optional[str] = None, ts: Optional[datetime] = None) -> datetime:
+    """追加一条状态事件，返回事件时间（UTC，与 QuestDB now() 一致）。"""
+    ts = ts or server_now(conn)
+    cur = conn.cursor()
+    cur.execute(
+        "insert into task_events (task_id, status, ts, worker, detail) values (%s, %s, %s, %s, %s)",
+        (task_id, status, ts, worker, detail),
+    )
+    return ts
+
+
+_clock_lock = threading.Lock()
+_clock_offset = timedelta(0)
+_clock_synced = 0.0
+
+
+def server_now(conn=None) -> datetime:
+    """
+    QuestDB 服务器的当前 UTC 时间：本机时间加上与服务器的时钟偏差。
+    偏差每 TASK_CLOCK_SYNC_SECONDS 秒（默认 60）经 conn 执行 select now() 校准一次（取往返中点），
+    多主机写入的事件时间因此可比，认领裁决与租约判断不受各主机时钟偏差影响。无连接或校准失败时沿用上次偏差。
+    """
+    global _clock_offset, _clock_synced
+    if conn is not None and time.time() - _clock_synced > float(os.getenv('TASK_CLOCK_SYNC_SECONDS', '60')):
+        try:
+            t0 = datetime.utcnow()
+            cur = conn.cursor()
+            cur.execute("select now()")
+            srv = cur.fetchone()[0]
+            t1 = datetime.utcnow()
+            if srv.tzinfo is not None:
+                srv = srv.astimezone(timezone.utc).replace(tzinfo=None)
+            with _clock_lock:
+                _clock_offset = srv - (t0 + (t1 - t0) / 2)
+                _clock_synced = time.time()
+        except Exception:
+            pass
+    return datetime.utcnow() + _clock_offset
+
+
+def lease_detail(lease_seconds: int) -> str:
+    return json.dumps({'lease': int(lease_seconds)})
+
+
+def claim_winners(conn, claims: Dict[str, datetime], settle: float = 1.0) -> Dict[str, Tuple[str, datetime]]:
+    """
+    裁决并发认领：claims 为 task_id → 该任务进入待处理的时间。
+    等待 settle 秒与 task_events 的 WAL 应用后，取每个任务在该时间之后最早的“处理中”事件，
+    返回 task_id → (worker, ts)。认领事件的 ts 由服务器写入（insert 中的 now()，见 QdbOrm._commit_claims），
+    裁决不依赖各主机的时钟。
+    """
+    if not claims:
+        return {}
+    time.sleep(max(0.0, settle))
+    if wait_wal_applied is not None:
+        wait_wal_applied(conn, ['task_events'], timeout=max(5.0, settle * 10))
+    ids = list(claims)
+    since = min(claims.values())
+    marks = ', '.join(['%s'] * len(ids))
+    cur = conn.cursor()
+    cur.execute(
+        f"select task_id, worker, ts from task_events where status = '处理中' and ts >= %s and task_id in ({marks})",
+        (since, *ids),
+    )
+    winners: Dict[str, Tuple[str, datetime]] = {}
+    for task_id, worker, ts in cur.fetchall() or []:
+        if ts < claims[task_id]:
+            continue
+        best = winners.get(task_id)
+        if best is None or (ts, worker or '') < (best[1], best[0] or ''):
+            winners[task_id] = (worker, ts)
+    return winners
+
+
+def heartbeat(conn, worker: str, running: int = 0) -> None:
+    """写一行心跳；ts 取服务器时间（now()），与租约判断使用同一时钟。"""
+    cur = conn.cursor()
+    cur.execute(
+        "insert into worker_heartbeats (worker, host, pid, running, ts) values (%s, %s, %s, %s, now())",
+        (worker, socket.gethostname(), os.getpid(), int(running)),
+    )
+
+
+def expired_leases(conn, lease_seconds: float) -> List[Tuple[str, str]]:
+    """
+    租约已过期的任务 [(task_id, worker)]：当前为“处理中”、带租约，且认领者最近心跳早于租约时长。
+    截止时间在服务器上计算（now()），认领与心跳时间也由服务器写入，各主机时钟偏差不影响判断。
+    """
+    cur = conn.cursor()
+    cur.execute(
+        """
+        select e.task_id, e.worker from
+          (select task_id, status, ts, worker, detail from task_events latest on ts partition by task_id) e
+          left join (select worker, max(ts) hb from worker_heartbeats) h on e.worker = h.worker
+        where e.status = '处理中' and e.detail like '%%"lease"%%' and e.ts < dateadd('s', %s, now())
+          and (h.hb is null or h.hb < dateadd('s', %s, now()))
+        """,
+        (-int(lease_seconds), -int(lease_seconds)),
+    )
+    return [(r[0], r[1]) for r in cur.fetchall() or []]
+
+
+def attempt_counts(conn, task_ids: Sequence[str]) -> Dict[str, int]:
+    """各任务已被认领（持久化的“处理中”事件）的次数，跨进程与重启有效。"""
+    out: Dict[str, int] = {}
+    ids = list(task_ids)
+    cur = conn.cursor()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ', '.join(['%s'] * len(chunk))
+        cur.execute(
+            f"select task_id, count() from task_events where status = '处理中' and task_id in ({marks})",
+            tuple(chunk),
+        )
+        out.update({r[0]: int(r[1]) for r in cur.fetchall() or []})
+    return out
+
+
+def live_workers(conn, within_seconds: float = 120.0) -> List[Dict[str, Any]]:
+    """最近 within_seconds 秒内有心跳的工作进程。"""
+    cur = conn.cursor()
+    cur.execute(
+        "select worker, host, pid, running, ts from worker_heartbeats where ts > dateadd('s', %s, now()) latest on ts partition by worker",
+        (-int(within_seconds),),
+    )
+    cols = ('worker', 'host', 'pid', 'running', 'ts')
+    return [dict(zip(cols, r)) for r in cur.fetchall() or []]
+
+
+class TaskRecord(NamedTuple):
+    """紧凑的任务记录（字段同 TASK_COLUMNS）；get() 兼容原先的字典访问方式。"""
+    task_id: str
+    task_type: Optional[str]
+    task_desc: Optional[str]
+    task_params: Optional[str]
+    priority: Optional[int]
+    status: Optional[str]
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    ended_at: Optional[datetime] = None
+    worker: Optional[str] = None
+    # 最新事件的 detail（如重试次数与下次尝试时间）
+    detail: Optional[str] = None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self._fields else default
+
+
+def _state_where(status: Optional[str], task_type: Optional[str], statuses: Optional[Sequence[str]]) -> Tuple[List[str], List[Any]]:
+    where: List[str] = []
+    params: List[Any] = []
+    if status:
+        where.append("status = %s")
+        params.append(status)
+    if statuses:
+        where.append("status in (" + ', '.join(['%s'] * len(statuses)) + ")")
+        params.extend(statuses)
+    if task_type:
+        where.append("task_type = %s")
+        params.append(task_type)
+    return where, params
+
+
+def count_tasks(
+    conn,
+    status: Optional[str] = None,
+    task_type: Optional[str] = None,
+    statuses: Optional[Sequence[str]] = None,
+    since: Optional[datetime] = None,
+) -> int:
+    """按当前状态计数（COUNT 查询，不取回行）；since 限定只统计该时间之后创建的任务。"""
+    where, params = _state_where(status, task_type, statuses)
+    where_sql = (" where " + " and ".join(where)) if where else ""
+    cur = conn.cursor()
+    cur.execute(f"select count(*) from ({task_state_sql(since)}){where_sql}", tuple(params))
+    return int((cur.fetchone() or [0])[0] or 0)
+
+
+def iter_task_records(
+    conn,
+    status: Optional[str] = None,
+    task_type: Optional[str] = None,
+    statuses: Optional[Sequence[str]] = None,
+    chunk_size: int = 1000,
+    since: Optional[datetime] = None,
+) -> Iterator[TaskRecord]:
+    """
+    按 created_at 升序分块流式读取任务（键集分页：每块取 created_at > 上一块末尾的前 chunk_size 行），
+    内存只保留一块。块末尾与下一行 created_at 相同的任务会被 limit 截断，因此末尾时间点的任务单独补齐一次。
+    迭代期间状态发生变化的任务按读取时的状态过滤，不会因分页偏移而被跳过或重复。
+    since 限定只读取该时间之后创建的任务（只扫描对应分区）。
+    """
+    cols = ', '.join(TASK_COLUMNS)
+    source = task_state_sql(since)
+    where, params = _state_where(status, task_type, statuses)
+    base = " and ".join(where)
+    base_sql = f" and {base}" if base else ""
+    chunk_size = max(1, int(chunk_size))
+    cur = conn.cursor()
+    mark = datetime(1970, 1, 1)
+    while True:
+        cur.execute(
+            f"select {cols} from ({source}) where created_at > %s{base_sql} order by created_at limit %s",
+            (mark, *params, chunk_size),
+        )
+        rows = cur.fetchall() or []
+        if not rows:
+            return
+        if len(rows) < chunk_size:
+            for r in rows:
+                yield TaskRecord(*r)
+            return
+        last = rows[-1][6]
+        for r in rows:
+            if r[6] != last:
+                yield TaskRecord(*r)
+        cur.execute(
+            f"select {cols} from ({source}) where created_at = %s{base_sql}",
+            (last, *params),
+        )
+        for r in cur.fetchall() or []:
+            yield TaskRecord(*r)
+        mark = last
+
+
+class _Entry:
+    """
+    投影内的任务条目；ts 为最近一次状态变化时间，key / code 为合并键与代码（加入投影时解析一次参数），
+    attempt 为最新事件 detail 中记录的尝试次数（任意状态），not_before 为下次可认领时间（来自“重试中”事件）。
+    """
+    __slots__ = (
+        'task_id', 'task_type', 'task_desc', 'task_params', 'priority', 'status', 'created_at', 'started_at', 'worker', 'ts',
+        'key', 'code', 'attempt', 'not_before',
+    )
+
+    def __init__(self, rec: TaskRecord) -> None:
+        self.task_id = rec.task_id
+        self.task_type = rec.task_type
+        self.task_desc = rec.task_desc
+        self.task_params = rec.task_params
+        self.priority = rec.priority
+        self.status = rec.status
+        self.created_at = rec.created_at
+        self.started_at = rec.started_at
+        self.worker = rec.worker
+        self.ts = rec.started_at or rec.created_at
+        params = parse_params(rec.task_params)
+        self.key = coalesce_key(rec.task_type, params)
+        self.code = task_code(params)
+        self.attempt, not_before = retry_detail(rec.detail)
+        self.not_before = not_before if rec.status == '重试中' else None
+
+    def record(self) -> TaskRecord:
+        return TaskRecord(
+            self.task_id, self.task_type, self.task_desc, self.task_params, self.priority, self.status,
+            self.created_at, self.started_at, None, self.worker,
+        )
+
+
+class ActiveTaskProjection:
+    """
+    未结束任务的内存投影：task_id → _Entry（__slots__ 紧凑条目），对外返回 TaskRecord。
+    refresh(conn) 首次按块流式全量加载，之后增量合并新任务与新事件；本进程追加的事件经 apply() 立即生效。
+    线程安全；try_claim() 在锁内完成“待处理 → 处理中”的判断与更新。
+    可认领任务按类型各维护一个惰性堆，键为老化后的优先级；传入 scheduler 时认领按其在类型之间公平选择，
+    否则取各类型堆顶中排序最靠前者（即全局优先级顺序）。
+    """
+
+    def __init__(self, scheduler: Optional[FairScheduler] = None) -> None:
+        self.scheduler = scheduler
+        self._lock = threading.RLock()
+        self._tasks: Dict[str, _Entry] = {}
+        # 已结束任务只记录状态时间，用于忽略回看窗口内重复读到的旧事件
+        self._closed: Dict[str, datetime] = {}
+        # 按类型的可认领任务惰性堆 (排序键, created_at, task_id)：出堆时再校验状态
+        self._heaps: Dict[str, List[tuple]] = {}
+        # 退避中的重试任务 (next_attempt_at, task_id)：到期后移入类型堆
+        self._delayed: List[tuple] = []
+        self._task_mark: Optional[datetime] = None
+        self._event_mark: Optional[datetime] = None
+        self._loaded = False
+        self._refreshed_at = 0.0
+
+    # 加载
+    def refresh(self, conn, max_age: Optional[float] = None) -> None:
+        """从数据库合并新任务与新事件；max_age 秒内已刷新过且仍有待处理任务时跳过。"""
+        if max_age is not None and self._loaded and time.time() - self._refreshed_at < max_age and any(self._heaps.values()):
+            return
+        cur = conn.cursor()
+        with self._lock:
+            if not self._loaded:
+                self._load_all(conn)
+                self._refreshed_at = time.time()
+                return
+            task_since = self._task_mark - _REFRESH_OVERLAP if self._task_mark else datetime(1970, 1, 1)
+            event_since = self._event_mark - _REFRESH_OVERLAP if self._event_mark else datetime(1970, 1, 1)
+        cur.execute(
+            "select task_id, task_type, task_desc, task_params, priority, status, created_at from tasks where created_at >= %s",
+            (task_since,),
+        )
+        new_tasks = cur.fetchall() or []
+        cur.execute(
+            "select task_id, status, ts, worker, detail from task_events where ts >= %s order by ts",
+            (event_since,),
+        )
+        events = cur.fetchall() or []
+        with self._lock:
+            for row in new_tasks:
+                self._add_task(TaskRecord(*row))
+            for task_id, status, ts, worker, detail in events:
+                self.apply(task_id, status, ts, worker, detail)
+            # 已超出回看窗口的结束记录不会再被重复读到
+            horizon = event_since - _REFRESH_OVERLAP
+            self._closed = {k: v for k, v in self._closed.items() if v >= horizon}
+            self._refreshed_at = time.time()
+
+    def _load_all(self, conn) -> None:
+        cur = conn.cursor()
+        cur.execute("select max(created_at) from tasks")
+        self._task_mark = max(filter(None, [(cur.fetchone() or [None])[0], self._task_mark]), default=None)
+        cur.execute("select max(ts) from task_events")
+        self._event_mark = max(filter(None, [(cur.fetchone() or [None])[0], self._event_mark]), default=None)
+        for rec in iter_task_records(conn, statuses=ACTIVE_STATUSES):
+            # 加载前本进程已写入的任务/事件（可能尚未被 WAL 应用）以本地为准
+            if rec.task_id in self._tasks or rec.task_id in self._closed:
+                continue
+            entry = _Entry(rec)
+            self._tasks[rec.task_id] = entry
+            self._push(entry)
+        self._loaded = True
+
+    def _rank(self, entry: _Entry) -> float:
+        # 老化后优先级 priority + (now - created_at) / aging 越大越靠前；now 对所有任务相同，
+        # 故堆键取 created_at / aging - priority，不随时间变化
+        aging = self.scheduler.aging_seconds if self.scheduler else 0.0
+        rank = -float(entry.priority or 0)
+        if aging and entry.created_at:
+            rank += entry.created_at.replace(tzinfo=None).timestamp() / aging
+        return rank
+
+    def _push(self, entry: _Entry) -> None:
+        if entry.status in CLAIMABLE_STATUSES:
+            if entry.not_before:
+                if entry.not_before > datetime.utcnow():
+                    heapq.heappush(self._delayed, (entry.not_before, entry.task_id))
+                    return
+                entry.not_before = None
+            heap = self._heaps.setdefault(entry.task_type or '', [])
+            heapq.heappush(heap, (self._rank(entry), entry.created_at or datetime.min, entry.task_id))
+
+    def _promote_due(self) -> None:
+        now = datetime.utcnow()
+        while self._delayed and self._delayed[0][0] <= now:
+            not_before, task_id = heapq.heappop(self._delayed)
+            entry = self._tasks.get(task_id)
+            if entry and entry.status in CLAIMABLE_STATUSES and entry.not_before == not_before:
+                self._push(entry)
+
+    def _head(self, task_type: str) -> Optional[_Entry]:
+        heap = self._heaps.get(task_type)
+        while heap:
+            entry = self._tasks.get(heap[0][2])
+            if entry and entry.status in CLAIMABLE_STATUSES and (entry.task_type or '') == task_type and not entry.not_before:
+                return entry
+            heapq.heappop(heap)
+        return None
+
+    def _running(self) -> Tuple[set, Dict[str, int]]:
+        codes = set()
+        by_type: Dict[str, int] = {}
+        for e in self._tasks.values():
+            if e.status == '处理中':
+                if e.code:
+                    codes.add(e.code)
+                by_type[e.task_type or ''] = by_type.get(e.task_type or '', 0) + 1
+        return codes, by_type
+
+    def _select(self, types: Optional[Sequence[str]], running: Dict[str, int]) -> Optional[_Entry]:
+        """选出下一个要认领的任务并出堆：先按调度器（或全局优先级）选类型，再取该类型的堆顶。"""
+        heads = {}
+        for t in (types if types is not None else list(self._heaps)):
+            entry = self._head(t)
+            if entry is None:
+                continue
+            if self.scheduler and not self.scheduler.admits(t, running.get(t, 0)):
+                continue
+            heads[t] = entry
+        if not heads:
+            return None
+        if self.scheduler:
+            chosen = self.scheduler.choose(heads)
+        else:
+            chosen = min(heads, key=lambda t: self._heaps[t][0])
+        heapq.heappop(self._heaps[chosen])
+        return heads[chosen]
+
+    def _add_task(self, rec: TaskRecord) -> None:
+        if rec.task_id in self._tasks or rec.task_id in self._closed:
+            return
+        if rec.created_at and (self._task_mark is None or rec.created_at > self._task_mark):
+            self._task_mark = rec.created_at
+        if rec.status not in ACTIVE_STATUSES:
+            return
+        entry = _Entry(rec)
+        self._tasks[rec.task_id] = entry
+        self._push(entry)
+
+    # 更新
+    def apply(
+        self, task_id: str, status: str, ts: Optional[datetime] = None, worker: Optional[str] = None, detail: Optional[str] = None,
+    ) -> None:
+        """合并一条事件；早于当前状态时间的事件忽略。“重试中”事件的 detail 提供重试次数与下次尝试时间。"""
+        ts = ts or datetime.utcnow()
+        with self._lock:
+            if self._event_mark is None or ts > self._event_mark:
+                self._event_mark = ts
+            closed_at = self._closed.get(task_id)
+            if closed_at and ts <= closed_at:
+                return
+            entry = self._tasks.get(task_id)
+            if entry is None:
+                # 投影尚未见到任务定义（稍后 refresh 会补上）
+                if status in TERMINAL_STATUSES:
+                    self._closed[task_id] = ts
+                return
+            last = entry.ts
+            if last and (ts < last or (ts == last and status == entry.status)):
+                return
+            entry.status = status
+            entry.ts = ts
+            if worker:
+                entry.worker = worker
+            if status == '处理中' and not entry.started_at:
+                entry.started_at = ts
+            attempt, not_before = retry_detail(detail)
+            entry.attempt = max(entry.attempt, attempt)
+            entry.not_before = not_before if status == '重试中' else None
+            if status in TERMINAL_STATUSES:
+                self._tasks.pop(task_id, None)
+                self._closed[task_id] = ts
+            else:
+                self._push(entry)
+
+    def add(self, rec: TaskRecord) -> None:
+        """本进程新生成的任务直接加入投影。"""
+        with self._lock:
+            self._add_task(rec)
+
+    def forget(self, task_id: str) -> None:
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def try_claim(self, task_id: str, worker: Optional[str] = None, ts: Optional[datetime] = None) -> bool:
+        """仅当任务当前可认领（待处理 / 重试中且已过退避时间）时置为“处理中”并返回 True。"""
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if not entry or entry.status not in CLAIMABLE_STATUSES:
+                return False
+            if entry.not_before and entry.not_before > datetime.utcnow():
+                return False
+            self.apply(task_id, '处理中', ts, worker)
+            return True
+
+    def try_cancel(self, task_id: str, worker: Optional[str] = None, ts: Optional[datetime] = None) -> Optional[TaskRecord]:
+        """仅当任务当前可认领时置为“已取消”，返回取消前的任务；写库失败时用 restore() 撤销。"""
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if not entry or entry.status not in CLAIMABLE_STATUSES:
+                return None
+            rec = entry.record()
+            self.apply(task_id, '已取消', ts, worker)
+            return rec
+
+    def restore(self, rec: TaskRecord) -> None:
+        with self._lock:
+            self._closed.pop(rec.task_id, None)
+            self._add_task(rec)
+
+    def claim_batch(
+        self, n: int, task_type: Optional[str] = None, worker: Optional[str] = None, ts: Optional[datetime] = None,
+        task_types: Optional[Sequence[str]] = None,
+    ) -> List[Tuple[TaskRecord, Optional[datetime]]]:
+        """
+        一次认领至多 n 个可认领任务（锁内置为处理中），返回 [(任务, 进入可认领状态的时间)]。
+        task_type / task_types 限定类型；类型间的顺序与并发上限由 scheduler 决定（见 _select）。
+        代码正在处理中（含本批已认领）的任务跳过，留在队列中等该代码结束后再认领。
+        """
+        out: List[Tuple[TaskRecord, Optional[datetime]]] = []
+        types = [task_type] if task_type else (list(task_types) if task_types else None)
+        now = ts or datetime.utcnow()
+        with self._lock:
+            self._promote_due()
+            busy, running = self._running()
+            deferred: List[_Entry] = []
+            while len(out) < n:
+                entry = self._select(types, running)
+                if entry is None:
+                    break
+                if entry.code and entry.code in busy:
+                    deferred.append(entry)
+                    continue
+                since = entry.ts
+                if self.try_claim(entry.task_id, worker, ts):
+                    out.append((entry.record(), since))
+                    t = entry.task_type or ''
+                    running[t] = running.get(t, 0) + 1
+                    if entry.code:
+                        busy.add(entry.code)
+                    if self.scheduler:
+                        self.scheduler.charge(t, (now - since).total_seconds() if since else None)
+            for entry in deferred:
+                self._push(entry)
+        return out
+
+    def claim_ids(
+        self, task_ids: Sequence[str], worker: Optional[str] = None, ts: Optional[datetime] = None,
+    ) -> List[Tuple[TaskRecord, Optional[datetime]]]:
+        """
+        按 task_id 认领（调用方已知要执行哪些任务，如全量更新本次运行生成的任务），返回 [(任务, 进入可认领状态的时间)]。
+        不可认领、退避未到期或代码正在处理中的任务跳过，由调用方稍后再试。
+        """
+        out: List[Tuple[TaskRecord, Optional[datetime]]] = []
+        now = ts or datetime.utcnow()
+        with self._lock:
+            self._promote_due()
+            busy, _ = self._running()
+            for task_id in task_ids:
+                entry = self._tasks.get(task_id)
+                if entry is None or (entry.code and entry.code in busy):
+                    continue
+                since = entry.ts
+                if self.try_claim(task_id, worker, ts):
+                    out.append((entry.record(), since))
+                    if entry.code:
+                        busy.add(entry.code)
+                    if self.scheduler:
+                        self.scheduler.charge(entry.task_type or '', (now - since).total_seconds() if since else None)
+        return out
+
+    def claimable(self, task_id: str) -> bool:
+        """任务当前可认领（待处理 / 重试中且已过退避时间）。"""
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if not entry or entry.status not in CLAIMABLE_STATUSES:
+                return False
+            return not (entry.not_before and entry.not_before > datetime.utcnow())
+
+    def running_codes(self) -> set:
+        """正在处理中的任务代码。"""
+        with self._lock:
+            return self._running()[0]
+
+    def active_by_key(self, task_type: Optional[str] = None) -> Dict[CoalesceKey, List[TaskRecord]]:
+        """未结束任务按合并键 (任务类型, 代码, 复权方式) 分组。"""
+        with self._lock:
+            out: Dict[CoalesceKey, List[TaskRecord]] = {}
+            for e in self._tasks.values():
+                if e.key and (not task_type or e.task_type == task_type):
+                    out.setdefault(e.key, []).append(e.record())
+            return out
+
+    # 查询
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            return entry.record() if entry else None
+
+    def pending(self, task_type: Optional[str] = None, limit: Optional[int] = None) -> List[TaskRecord]:
+        """可认领任务（待处理 / 重试中），按优先级降序、创建时间升序。"""
+        with self._lock:
+            entries = [
+                e for e in self._tasks.values()
+                if e.status in CLAIMABLE_STATUSES and not e.not_before and (not task_type or e.task_type == task_type)
+            ]
+            entries.sort(key=lambda e: (-(e.priority or 0), e.created_at or datetime.min))
+            if limit:
+                entries = entries[:limit]
+            return [e.record() for e in entries]
+
+    def next_pending(self, task_type: Optional[str] = None) -> Optional[TaskRecord]:
+        with self._lock:
+            self._promote_due()
+            heads = [(self._heaps[t][0], e) for t in ([task_type] if task_type else list(self._heaps)) for e in [self._head(t)] if e]
+            return min(heads, key=lambda h: h[0])[1].record() if heads else None
+
+    def attempt(self, task_id: str) -> int:
+        """任务已记录的尝试次数（最近一次“重试中”事件的 attempt；未跟踪或未失败过时为 0）。"""
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            return entry.attempt if entry else 0
+
+    def queue_stats(self) -> Dict[str, Dict[str, Any]]:
+        """按类型：可认领数（含退避中的 delayed）、处理中数、最久排队秒数（从进入可认领状态起）。"""
+        now = datetime.utcnow()
+        with self._lock:
+            out: Dict[str, Dict[str, Any]] = {}
+            for e in self._tasks.values():
+                s = out.setdefault(e.task_type or '', {'pending': 0, 'delayed': 0, 'running': 0, 'oldest_wait': 0.0})
+                if e.status in CLAIMABLE_STATUSES:
+                    s['pending'] += 1
+                    if e.not_before:
+                        s['delayed'] += 1
+                    if e.ts:
+                        s['oldest_wait'] = max(s['oldest_wait'], round((now - e.ts).total_seconds(), 3))
+                elif e.status == '处理中':
+                    s['running'] += 1
+            return out
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            out: Dict[str, int] = {}
+            for e in self._tasks.values():
+                out[e.status] = out.get(e.status, 0) + 1
+            return out
+
+
+_default: Optional[ActiveTaskProjection] = None
+_default_lock = threading.Lock()
+
+
+def default_projection() -> ActiveTaskProjection:
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = ActiveTaskProjection(scheduler=FairScheduler.from_env())
+    return _default
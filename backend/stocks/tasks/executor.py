@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def default_concurrency() -> int:
+    """并发拉取线程数，环境变量 FETCH_CONCURRENCY，默认 4。"""
+    try:
+        return max(1, int(os.getenv('FETCH_CONCURRENCY', '4')))
+    except Exception:
+        return 4
+
+
+class FetchExecutor:
+    """
+    面向数据源任务的有界线程池：
+      - 每个工作线程在首次使用时从连接池（stocks.data.db_pool）取得一个 QuestDB 连接并一直持有，
+        shutdown() 时统一归还；连接池不可用时退回 qdb_connect()
+      - submit() 在在途任务达到上限（max_workers * 2）时阻塞，避免一次性堆积全部任务
+      - 与 views 中的 _update_ctrl / _queue_ctrl 协作：wait_ready() 在暂停时等待、停止时返回 False
+    数据源的全局限速与按源并发上限由 data_pipeline.source_limiter.source_call 负责。
+
+        ex = FetchExecutor(ctrl=_update_ctrl)
+        for item in items:
+            if not ex.wait_ready():
+                break
+            ex.submit(lambda conn, item=item: run_one(item, conn))
+        ex.shutdown()
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, ctrl: Optional[Dict[str, Any]] = None) -> None:
+        self.max_workers = max_workers or default_concurrency()
+        self.ctrl = ctrl
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='fetch')
+        self._slots = threading.BoundedSemaphore(self.max_workers * 2)
+        self._local = threading.local()
+        self._conns: List[Any] = []
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    # 控制
+    def stopped(self) -> bool:
+        return bool(self.ctrl and self.ctrl['stop_event'].is_set())
+
+    def wait_ready(self) -> bool:
+        """暂停时阻塞；停止时返回 False。"""
+        if not self.ctrl:
+            return True
+        while self.ctrl['state'].get('paused'):
+            if self.ctrl['stop_event'].is_set():
+                return False
+            time.sleep(0.2)
+        return not self.ctrl['stop_event'].is_set()
+
+    # 连接
+    def _thread_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and not getattr(conn, 'closed', 0):
+            return conn
+        conn = None
+        try:
+            from stocks.data.db_pool import get_conn
+            conn = get_conn()
+            conn.autocommit = True
+            pooled = True
+        except Exception as e:
+            logger.warning("连接池不可用，改用独立连接: %s", e)
+            try:
+                from data_pipeline.collector import qdb_connect
+                conn = qdb_connect()
+            except Exception:
+                conn = None
+            pooled = False
+        if conn is not None:
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append((conn, pooled))
+        return conn
+
+    # 提交
+    def submit(self, fn: Callable[[Any], Any]) -> Future:
+        """提交 fn(conn)，在途任务已满时阻塞等待空位。"""
+        self._slots.acquire()
+        try:
+            fut = self._pool.submit(self._run, fn)
+        except Exception:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _f: self._slots.release())
+        return fut
+
+    def call(self, fn: Callable[[Any], Any]) -> Future:
+        """在工作线程上执行 fn(conn)：不占在途名额、异常原样传给 Future（供 asyncio 流水线 wrap_future 使用）。"""
+        return self._pool.submit(lambda: fn(self._thread_conn()))
+
+    def _run(self, fn: Callable[[Any], Any]):
+        try:
+            result = fn(self._thread_conn())
+            with self._lock:
+                self.completed += 1
+            return result
+        except Exception as e:
+            logger.exception("并发任务执行异常: %s", e)
+            with self._lock:
+                self.failed += 1
+            return None
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn, pooled in conns:
+            try:
+                if pooled:
+                    from stocks.data.db_pool import put_conn
+                    put_conn(conn)
+                else:
+                    conn.close()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
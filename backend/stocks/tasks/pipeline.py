@@ -0,0 +1,384 @@
+"""
+日线下载的分阶段 asyncio 流水线：拉取 → 转换 → 写入。
+
+串行执行时网络、CPU、数据库轮流空闲；流水线把 DownloadDailyTask 拆成 (code, adjust) 单元，
+三个阶段各自并发、以有界队列相连：
+  - fetch：在线程池中调用数据源（仍经 source_call 全局限速）
+  - transform：在线程池中做列式转换（DownloadDailyTask.transform）
+  - write：在 FetchExecutor 的工作线程上写库（每线程持有一个连接），写完推送 ILP 缓冲
+长区间按窗口（DownloadDailyTask.chunks）依次拉取，每个窗口作为独立的队列项流经转换与写入；
+同一单元的下一个窗口要等上一个窗口写入成功后才拉取，某窗口失败即放弃后续窗口（同 DownloadDailyTask._sync_one），
+水位线不会越过缺口。
+队列满时上游阻塞（背压），因此在途数据量只取决于队列长度、并发数与窗口大小，与股票数量和历史长度无关。
+每个阶段记录队列深度、处理数、错误数、忙碌时间与吞吐，见 DailyPipeline.stats()。
+
+    pipeline = DailyPipeline(ctrl=_update_ctrl, on_task_done=lambda item, ok: ...)
+    results = pipeline.run(task_items)      # {task_id: 成功与否}
+
+运行方式由环境变量 DAILY_RUNNER 选择：threads（默认，FetchExecutor 按任务并发）或 pipeline。
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .download_daily import DailyUnit, DownloadDailyTask, QdbOrm
+from .executor import FetchExecutor, default_concurrency
+from .retry import task_outcome
+
+try:
+    from data_pipeline.collector import qdb_flush_writer
+except Exception:
+    qdb_flush_writer = None
+
+try:
+    from data_pipeline.source_isolation import SourceCancelledError
+except Exception:
+    SourceCancelledError = RuntimeError
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def _resolve(written: Optional[asyncio.Future], ok: bool) -> None:
+    # 通知拉取协程本窗口的写入结果（仅有后续窗口时存在）
+    if written is not None and not written.done():
+        written.set_result(ok)
+
+
+def daily_runner() -> str:
+    """日线批量更新的执行方式：threads / pipeline（环境变量 DAILY_RUNNER）。"""
+    mode = (os.getenv('DAILY_RUNNER') or 'threads').strip().lower()
+    return mode if mode in ('threads', 'pipeline') else 'threads'
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name) or default))
+    except Exception:
+        return default
+
+
+class StageStats:
+    """单个阶段的运行统计。"""
+
+    def __init__(self, name: str, workers: int, queue: Optional[asyncio.Queue] = None) -> None:
+        self.name = name
+        self.workers = workers
+        self.queue = queue
+        self.processed = 0
+        self.errors = 0
+        self.rows = 0
+        self.busy_seconds = 0.0
+        self.started = time.monotonic()
+
+    def record(self, elapsed: float, ok: bool = True, rows: int = 0) -> None:
+        self.busy_seconds += elapsed
+        self.rows += rows
+        if ok:
+            self.processed += 1
+        else:
+            self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        wall = max(1e-9, time.monotonic() - self.started)
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'queue_size': self.queue.maxsize if self.queue is not None else 0,
+            'processed': self.processed,
+            'errors': self.errors,
+            'rows': self.rows,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'units_per_sec': round(self.processed / wall, 2),
+            'rows_per_sec': round(self.rows / wall, 1),
+            # 忙碌时间 / (墙钟 × 并发数)，接近 1 表示该阶段是瓶颈
+            'utilization': round(self.busy_seconds / (wall * self.workers), 3),
+        }
+
+
+class _TaskState:
+    """一个任务在流水线中的进度（只在事件循环线程中修改）。"""
+
+    __slots__ = ('item', 'task', 'incremental', 'pending', 'saved', 'failures', 'latest', 'error')
+
+    def __init__(self, item: Dict[str, Any], task: DownloadDailyTask, incremental: bool, pending: int) -> None:
+        self.item = item
+        self.task = task
+        self.incremental = incremental
+        self.pending = pending
+        self.saved = 0
+        self.failures = 0
+        self.latest: Optional[date] = None
+        # 最近一次拉取 / 转换 / 写入异常，用于重试判断
+        self.error: Optional[BaseException] = None
+
+
+class DailyPipeline:
+    """
+    DailyPipeline(fetch_workers, transform_workers, write_workers, queue_size, ctrl, on_task_done, on_progress)
+
+    并发与队列长度（可用环境变量覆盖默认值）：
+      - fetch_workers: 拉取并发（PIPELINE_FETCH_WORKERS，默认同 FETCH_CONCURRENCY）
+      - transform_workers: 转换并发（PIPELINE_TRANSFORM_WORKERS，默认 2）
+      - write_workers: 写库并发/连接数（PIPELINE_WRITE_WORKERS，默认 2）
+      - queue_size: 每个阶段间队列长度（PIPELINE_QUEUE_SIZE，默认 16）
+    ctrl 为 views 中的 _update_ctrl 结构：暂停时停止拉取，停止时不再规划新任务也不再拉取新窗口，
+    已拉取的窗口照常写入；未拉取完的任务以 SourceCancelledError 结束（按重试策略置为重试中）。
+    """
+
+    def __init__(
+        self,
+        fetch_workers: Optional[int] = None,
+        transform_workers: Optional[int] = None,
+        write_workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        ctrl: Optional[Dict[str, Any]] = None,
+        on_task_done: Optional[Callable[[Dict[str, Any], bool], None]] = None,
+        on_progress: Optional[Callable[[DailyUnit, int], None]] = None,
+    ) -> None:
+        self.fetch_workers = fetch_workers or _env_int('PIPELINE_FETCH_WORKERS', default_concurrency())
+        self.transform_workers = transform_workers or _env_int('PIPELINE_TRANSFORM_WORKERS', 2)
+        self.write_workers = write_workers or _env_int('PIPELINE_WRITE_WORKERS', 2)
+        self.queue_size = queue_size or _env_int('PIPELINE_QUEUE_SIZE', 16)
+        self.ctrl = ctrl
+        self.on_task_done = on_task_done
+        self.on_progress = on_progress
+        self.results: Dict[str, bool] = {}
+        self._stages: Dict[str, StageStats] = {}
+
+    # 对外接口
+    def run(self, items: Iterable[Dict[str, Any]]) -> Dict[str, bool]:
+        """
+        执行一批已由调用方认领（处理中）的 download_daily 任务，阻塞至全部完成，返回 {task_id: 成功与否}。
+        items 可以是边迭代边认领的生成器，在线程池中取下一项，认领时的阻塞不会卡住各阶段。
+        """
+        asyncio.run(self._main(items))
+        return self.results
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [s.snapshot() for s in list(self._stages.values())]
+
+    # 控制
+    def _stopped(self) -> bool:
+        return bool(self.ctrl and self.ctrl['stop_event'].is_set())
+
+    async def _wait_ready(self) -> bool:
+        while self.ctrl and self.ctrl['state'].get('paused'):
+            if self._stopped():
+                return False
+            await asyncio.sleep(0.2)
+        return not self._stopped()
+
+    # 主流程
+    async def _main(self, items: Iterable[Dict[str, Any]]) -> None:
+        self._fetch_q: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._transform_q: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._write_q: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._stages = {
+            'plan': StageStats('plan', 1),
+            'fetch': StageStats('fetch', self.fetch_workers, self._fetch_q),
+            'transform': StageStats('transform', self.transform_workers, self._transform_q),
+            'write': StageStats('write', self.write_workers, self._write_q),
+        }
+        fetch_pool = ThreadPoolExecutor(self.fetch_workers, thread_name_prefix='pipe-fetch')
+        transform_pool = ThreadPoolExecutor(self.transform_workers, thread_name_prefix='pipe-xform')
+        self._db = FetchExecutor(max_workers=self.write_workers)
+        try:
+            fetchers = [asyncio.create_task(self._fetch_worker(fetch_pool)) for _ in range(self.fetch_workers)]
+            transformers = [asyncio.create_task(self._transform_worker(transform_pool)) for _ in range(self.transform_workers)]
+            writers = [asyncio.create_task(self._write_worker()) for _ in range(self.write_workers)]
+            try:
+                await self._produce(items)
+            finally:
+                # 逐级关闭：上游全部退出后再向下游投递结束标记
+                for workers, queue in ((fetchers, self._fetch_q), (transformers, self._transform_q), (writers, self._write_q)):
+                    for _ in workers:
+                        await queue.put(_DONE)
+                    await asyncio.gather(*workers)
+        finally:
+            fetch_pool.shutdown(wait=True)
+            transform_pool.shutdown(wait=True)
+            self._db.shutdown()
+            logger.info("日线流水线结束: tasks=%s, %s", len(self.results), self.stats())
+
+    async def _db_call(self, fn: Callable[[Any], Any]):
+        return await asyncio.wrap_future(self._db.call(fn))
+
+    # 规划：拆分单元（任务已由调用方认领）
+    def _plan(self, item: Dict[str, Any], conn) -> Optional[Tuple[_TaskState, List[DailyUnit]]]:
+        orm = QdbOrm(conn)
+        t = DownloadDailyTask(orm)
+        t.task_id = item.get('task_id')
+        t.task_type = item.get('task_type')
+        t.task_desc = item.get('task_desc')
+        t.params_str = item.get('task_params') or '{}'
+        t.priority = item.get('priority') or 0
+        t.on_progress = self.on_progress
+        t.stop_event = self.ctrl['stop_event'] if self.ctrl else None
+        plan = t.plan(conn)
+        if plan is None:
+            return None
+        units, incremental = plan
+        return _TaskState(item, t, incremental, len(units)), units
+
+    async def _produce(self, items: Iterable[Dict[str, Any]]) -> None:
+        stats = self._stages['plan']
+        loop = asyncio.get_running_loop()
+        it = iter(items)
+        while await self._wait_ready():
+            item = await loop.run_in_executor(None, next, it, _DONE)
+            if item is _DONE:
+                break
+            t0 = time.monotonic()
+            try:
+                planned = await self._db_call(lambda conn, item=item: self._plan(item, conn))
+            except Exception as e:
+                logger.exception("任务规划失败: task_id=%s, error=%s", item.get('task_id'), e)
+                planned, plan_error = None, e
+            else:
+                plan_error = None
+            stats.record(time.monotonic() - t0, ok=planned is not None)
+            if planned is None:
+                await self._finish_task(item, False, plan_error)
+                continue
+            state, units = planned
+            if not units:
+                await self._finish(state)
+                continue
+            for unit in units:
+                fetch_start, _ = state.task.window(unit)
+                if fetch_start > unit.end_date:
+                    # 已是最新，无需拉取
+                    await self._unit_done(state, 0, unit.watermark, True)
+                    continue
+                await self._fetch_q.put((state, unit))
+
+    # 阶段工作协程
+    async def _fetch_worker(self, pool: ThreadPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        stats = self._stages['fetch']
+        while True:
+            job = await self._fetch_q.get()
+            if job is _DONE:
+                return
+            state, unit = job
+            # 长区间按窗口顺序拉取，每个窗口独立进入转换/写入；有后续窗口时等本窗口写入成功再拉取下一个，
+            # 某窗口拉取 / 转换 / 写入失败则放弃后续窗口
+            chunks = state.task.chunks(unit)
+            state.pending += len(chunks) - 1
+            for i, chunk in enumerate(chunks):
+                if not await self._wait_ready():
+                    state.error = state.error or SourceCancelledError("更新已停止")
+                    for _ in chunks[i:]:
+                        await self._unit_done(state, 0, None, False)
+                    break
+                t0 = time.monotonic()
+                try:
+                    df = await loop.run_in_executor(pool, state.task.fetch, chunk)
+                except Exception as e:
+                    stats.record(time.monotonic() - t0, ok=False)
+                    logger.exception("akshare 拉取失败: code=%s, symbol=%s, adj=%s, error=%s", chunk.code, chunk.symbol, chunk.adj, e)
+                    state.error = e
+                    for _ in chunks[i:]:
+                        await self._unit_done(state, 0, None, False)
+                    break
+                stats.record(time.monotonic() - t0, rows=0 if df is None else len(df))
+                written = loop.create_future() if i < len(chunks) - 1 else None
+                await self._transform_q.put((state, chunk, df, written))
+                del df
+                if written is not None and not await written:
+                    for _ in chunks[i + 1:]:
+                        await self._unit_done(state, 0, None, False)
+                    break
+
+    async def _transform_worker(self, pool: ThreadPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        stats = self._stages['transform']
+        while True:
+            job = await self._transform_q.get()
+            if job is _DONE:
+                return
+            state, unit, df, written = job
+            t0 = time.monotonic()
+            try:
+                rows = await loop.run_in_executor(pool, state.task.transform, unit, df)
+            except Exception as e:
+                stats.record(time.monotonic() - t0, ok=False)
+                logger.exception("数据转换失败: code=%s, adj=%s, error=%s", unit.code, unit.adj, e)
+                state.error = e
+                _resolve(written, False)
+                await self._unit_done(state, 0, None, False)
+                continue
+            del df
+            stats.record(time.monotonic() - t0, rows=len(rows.values))
+            await self._write_q.put((state, unit, rows, written))
+
+    def _store(self, task: DownloadDailyTask, unit: DailyUnit, rows, conn):
+        saved, latest, ok = task.store(unit, rows, conn)
+        if qdb_flush_writer is not None and not qdb_flush_writer():
+            logger.error("ILP 缓冲推送失败: code=%s, adj=%s", unit.code, unit.adj)
+            return 0, latest, False
+        return saved, latest, ok
+
+    async def _write_worker(self) -> None:
+        stats = self._stages['write']
+        while True:
+            job = await self._write_q.get()
+            if job is _DONE:
+                return
+            state, unit, rows, written = job
+            t0 = time.monotonic()
+            try:
+                saved, latest, ok = await self._db_call(lambda conn: self._store(state.task, unit, rows, conn))
+            except Exception as e:
+                logger.exception("写入失败: code=%s, adj=%s, error=%s", unit.code, unit.adj, e)
+                saved, latest, ok = 0, None, False
+                state.error = e
+            stats.record(time.monotonic() - t0, ok=ok, rows=saved)
+            state.task.progress(unit, saved)
+            _resolve(written, ok)
+            await self._unit_done(state, saved, latest, ok)
+
+    # 完成记账
+    async def _unit_done(self, state: _TaskState, saved: int, latest: Optional[date], ok: bool) -> None:
+        state.saved += saved
+        state.failures += 0 if ok else 1
+        if latest:
+            state.latest = max(state.latest or latest, latest)
+        state.pending -= 1
+        if state.pending == 0:
+            await self._finish(state)
+
+    async def _finish(self, state: _TaskState) -> None:
+        ok = state.task.succeeded(state.incremental, state.saved, state.failures)
+        logger.info(
+            "任务完成：task_id=%s, total_saved=%s, latest_date=%s, %s",
+            state.task.task_id, state.saved, state.latest, state.task.write_report.summary(),
+        )
+        await self._finish_task(state.item, ok, state.error)
+
+    async def _finish_task(self, item: Dict[str, Any], ok: bool, error: Optional[BaseException] = None) -> None:
+        task_id = item.get('task_id')
+
+        def finish(conn):
+            # 失败时按重试策略置为“重试中”或“失败”（见 stocks.tasks.retry）
+            orm = QdbOrm(conn)
+            status, detail = task_outcome(item.get('task_type'), task_id, ok, error, orm.projection, conn=conn)
+            orm.update_task_status(task_id, status, detail)
+
+        try:
+            await self._db_call(finish)
+        except Exception as e:
+            logger.warning("更新任务状态失败: task_id=%s, error=%s", task_id, e)
+        self.results[task_id] = ok
+        if self.on_task_done is not None:
+            try:
+                self.on_task_done(item, ok)
+            except Exception:
+                pass
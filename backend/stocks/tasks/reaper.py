@@ -0,0 +1,195 @@
+"""
+卡死任务回收（reaper）。
+
+进程在任务“处理中”时退出，任务会一直停留在处理中，队列只认领待处理 / 重试中的任务，这些代码就被静默跳过。
+TaskReaper 定期查找本次开始时间（最近一次“处理中”事件，旧数据取 tasks.started_at）超过该类型超时的任务：
+  - 已认领次数（“处理中”事件数）未达该类型重试策略的最大尝试次数（见 stocks.tasks.retry，默认 TASK_MAX_ATTEMPTS=3）：
+    追加“重试中”事件，按策略退避后重新进入队列
+  - 达到上限：追加“失败”事件，不再重试
+事件 detail 记录 {"reaped": true, "attempt": n, "timeout": 秒, "next_attempt_at": ...}，UI 可据此显示回收原因。
+超时按任务类型配置：TASK_TIMEOUTS="download_daily=3600,inst_trading_tracker=900"，
+未配置的类型使用 TASK_TIMEOUT_SECONDS（默认 3600）。
+执行者仍有新鲜心跳（TASK_LEASE_SECONDS 内，见 worker_heartbeats）的任务不回收：长时间运行的健康任务
+（如 Web 更新线程中的全历史下载）由心跳续期，只有执行者停止心跳后才按超时回收。
+Web 服务进程（apps.ready，仅 runserver / WSGI 服务进程）与每个 qdb_worker 进程会运行 reaper；
+重复回收只会多追加一条相同状态的事件。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .events import attempt_counts, default_projection, server_now
+from .retry import retry_policy
+
+logger = logging.getLogger(__name__)
+
+
+def task_timeouts() -> Tuple[Dict[str, float], float]:
+    """返回 (按类型的超时秒数, 默认超时秒数)。"""
+    default = float(os.getenv('TASK_TIMEOUT_SECONDS', '3600'))
+    out: Dict[str, float] = {}
+    for part in (os.getenv('TASK_TIMEOUTS') or '').split(','):
+        name, _, value = part.partition('=')
+        if name.strip() and value.strip():
+            try:
+                out[name.strip()] = float(value)
+            except ValueError:
+                logger.warning("忽略无效的任务超时配置: %s", part)
+    return out, default
+
+
+def alive_seconds() -> float:
+    """心跳新鲜度：执行者在此时长内有心跳即视为仍在运行（同租约时长 TASK_LEASE_SECONDS）。"""
+    try:
+        return float(os.getenv('TASK_LEASE_SECONDS', '120'))
+    except ValueError:
+        return 120.0
+
+
+def stuck_tasks(
+    conn, timeouts: Dict[str, float], default_timeout: float, alive: Optional[float] = None,
+) -> List[Tuple[str, str, datetime, Optional[str]]]:
+    """超时的处理中任务 [(task_id, task_type, started, worker)]；执行者最近 alive 秒内有心跳的跳过。"""
+    # 心跳时间由服务器写入，按服务器时钟比较
+    now = server_now(conn)
+    cutoff = now - timedelta(seconds=min([default_timeout, *timeouts.values()]))
+    beat_cutoff = now - timedelta(seconds=alive_seconds() if alive is None else alive)
+    cur = conn.cursor()
+    cur.execute(
+        """
+        select t.task_id, t.task_type, coalesce(e.ts, t.started_at) started, e.worker
+        from tasks t
+        left join (select task_id, status, ts, worker from task_events latest on ts partition by task_id) e on t.task_id = e.task_id
+        left join (select worker, max(ts) hb from worker_heartbeats) h on e.worker = h.worker
+        where coalesce(e.status, t.status) = '处理中' and coalesce(e.ts, t.started_at) < %s
+          and (h.hb is null or h.hb < %s)
+        """,
+        (cutoff, beat_cutoff),
+    )
+    out = []
+    for task_id, task_type, started, worker in cur.fetchall() or []:
+        if started and started < now - timedelta(seconds=timeouts.get(task_type, default_timeout)):
+            out.append((task_id, task_type, started, worker))
+    return out
+
+
+class TaskReaper:
+    """TaskReaper(connect, interval).start()；run_once(conn) 执行一轮并返回本轮统计。"""
+
+    def __init__(self, connect: Callable[[], Any], interval: float = 60.0, worker: Optional[str] = None) -> None:
+        self.connect = connect
+        self.interval = float(interval)
+        self.worker = worker
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.recovered = 0
+        self.failed = 0
+        self.runs = 0
+        self.last_run: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_recovered: List[Dict[str, Any]] = []
+
+    def run_once(self, conn) -> Dict[str, int]:
+        timeouts, default_timeout = task_timeouts()
+        stuck = stuck_tasks(conn, timeouts, default_timeout)
+        done = {'recovered': 0, 'failed': 0}
+        if stuck:
+            from .download_daily import QdbOrm
+            attempts = attempt_counts(conn, [s[0] for s in stuck])
+            ts = server_now(conn)
+            rows = []
+            recovered = []
+            for task_id, task_type, started, owner in stuck:
+                n = max(1, attempts.get(task_id, 1))
+                policy = retry_policy(task_type)
+                status = "重试中" if n < policy.max_attempts else "失败"
+                info = {'reaped': True, 'attempt': n, 'timeout': timeouts.get(task_type, default_timeout), 'worker': owner}
+                if status == "重试中":
+                    info['next_attempt_at'] = (ts + timedelta(seconds=policy.delay(n))).isoformat()
+                detail = json.dumps(info, ensure_ascii=False)
+                rows.append((task_id, status, ts, self.worker, detail))
+                recovered.append({'task_id': task_id, 'task_type': task_type, 'status': status, 'attempt': n, 'started': started})
+                done['recovered' if status == "重试中" else 'failed'] += 1
+            orm = QdbOrm(conn)
+            orm.append_events(rows)
+            projection = default_projection()
+            for task_id, status, _, worker, detail in rows:
+                projection.apply(task_id, status, ts, worker, detail)
+            logger.warning("回收卡死任务: 重试 %s 个, 超过最大尝试次数置为失败 %s 个", done['recovered'], done['failed'])
+            with self._lock:
+                self.last_recovered = recovered[:20]
+        with self._lock:
+            self.recovered += done['recovered']
+            self.failed += done['failed']
+            self.runs += 1
+            self.last_run = time.time()
+        return done
+
+    def start(self) -> 'TaskReaper':
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='task-reaper', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            conn = None
+            try:
+                conn = self.connect()
+                if not conn:
+                    self.last_error = 'QuestDB 连接不可用'
+                    continue
+                self.run_once(conn)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.exception("任务回收异常: %s", e)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval': self.interval,
+                'runs': self.runs,
+                'recovered': self.recovered,
+                'failed': self.failed,
+                'last_run': self.last_run,
+                'last_error': self.last_error,
+                'last_recovered': list(self.last_recovered),
+            }
+
+
+_reaper: Optional[TaskReaper] = None
+_reaper_lock = threading.Lock()
+
+
+def start_reaper(connect: Callable[[], Any]) -> TaskReaper:
+    """启动（或返回已在运行的）本进程回收线程，间隔 TASK_REAP_SECONDS（默认 60）。"""
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = TaskReaper(connect, interval=float(os.getenv('TASK_REAP_SECONDS', '60')))
+        return _reaper.start()
+
+
+def reaper_stats() -> Optional[Dict[str, Any]]:
+    return _reaper.stats() if _reaper else None
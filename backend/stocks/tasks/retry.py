@@ -0,0 +1,167 @@
+"""
+任务失败后的自动重试：按任务类型的重试策略（最大尝试次数、指数退避 + 抖动、可重试的异常类型）。
+
+任务失败时（BaseTask.execute、队列工作线程 / 工作进程、流水线），由 failure_outcome() 决定结束状态：
+  - 失败原因属于可重试异常且尝试次数未达上限：追加“重试中”事件，
+    detail 记录 {"attempt": n, "next_attempt_at": ISO 时间, "delay": 秒, "error": "..."}
+  - 否则追加“失败”事件（detail 同样记录 attempt 与 error）
+ActiveTaskProjection 读取“重试中”事件的 next_attempt_at，到期前不认领该任务；
+第 n 次失败后的等待时间为 min(max_delay, base_delay * multiplier^(n-1))，再乘以 [1-jitter, 1+jitter] 内的随机系数，
+避免全市场更新中大量同时失败的任务在同一时刻重新请求数据源。
+策略配置（环境变量）：
+  - 默认：TASK_MAX_ATTEMPTS（默认 3）、TASK_RETRY_BASE_SECONDS（30）、TASK_RETRY_MAX_SECONDS（3600）、
+    TASK_RETRY_MULTIPLIER（2）、TASK_RETRY_JITTER（0.5）
+  - 按类型覆盖：TASK_RETRY_POLICIES="download_daily=attempts:5,base:60;inst_trading_tracker=attempts:3,base:300"
+  - 代码中可用 register_retry_policy(task_type, RetryPolicy(...)) 注册
+任务 run() 返回 False 时，以任务对象的 last_error（最近一次数据源 / 写入异常）判断是否可重试；没有异常的失败（参数无效、无数据）不重试。
+"""
+import json
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple, Type
+
+try:
+    import requests
+    _REQUEST_ERRORS: Tuple[Type[BaseException], ...] = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+except Exception:
+    _REQUEST_ERRORS = ()
+
+try:
+    from data_pipeline.source_isolation import SourceCancelledError, SourceTimeoutError
+    _ISOLATION_ERRORS: Tuple[Type[BaseException], ...] = (SourceTimeoutError, SourceCancelledError)
+except Exception:
+    _ISOLATION_ERRORS = ()
+
+# 默认可重试：网络 / 超时类异常（数据源临时不可用）
+TRANSIENT_ERRORS: Tuple[Type[BaseException], ...] = (
+    ConnectionError, TimeoutError, socket.timeout, *_REQUEST_ERRORS, *_ISOLATION_ERRORS,
+)
+
+
+class RetryPolicy:
+    """RetryPolicy(max_attempts, base_delay, max_delay, multiplier, jitter, retry_on)。"""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 30.0,
+        max_delay: float = 3600.0,
+        multiplier: float = 2.0,
+        jitter: float = 0.5,
+        retry_on: Tuple[Type[BaseException], ...] = TRANSIENT_ERRORS,
+    ) -> None:
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+        self.multiplier = max(1.0, float(multiplier))
+        self.jitter = min(1.0, max(0.0, float(jitter)))
+        self.retry_on = tuple(retry_on)
+
+    def retryable(self, error: Optional[BaseException]) -> bool:
+        return error is not None and isinstance(error, self.retry_on)
+
+    def delay(self, attempt: int) -> float:
+        """第 attempt 次失败后的等待秒数（含抖动）。"""
+        d = min(self.max_delay, self.base_delay * self.multiplier ** max(0, attempt - 1))
+        return d * random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+
+    def should_retry(self, attempt: int, error: Optional[BaseException]) -> bool:
+        return attempt < self.max_attempts and self.retryable(error)
+
+
+def _env_policy(**overrides: Any) -> RetryPolicy:
+    kwargs = {
+        'max_attempts': int(os.getenv('TASK_MAX_ATTEMPTS', '3')),
+        'base_delay': float(os.getenv('TASK_RETRY_BASE_SECONDS', '30')),
+        'max_delay': float(os.getenv('TASK_RETRY_MAX_SECONDS', '3600')),
+        'multiplier': float(os.getenv('TASK_RETRY_MULTIPLIER', '2')),
+        'jitter': float(os.getenv('TASK_RETRY_JITTER', '0.5')),
+    }
+    kwargs.update(overrides)
+    return RetryPolicy(**kwargs)
+
+
+_ENV_KEYS = {'attempts': 'max_attempts', 'base': 'base_delay', 'max': 'max_delay', 'multiplier': 'multiplier', 'jitter': 'jitter'}
+_registered: Dict[str, RetryPolicy] = {}
+
+
+def register_retry_policy(task_type: str, policy: RetryPolicy) -> None:
+    _registered[task_type] = policy
+
+
+def retry_policy(task_type: Optional[str]) -> RetryPolicy:
+    """任务类型的重试策略：代码注册 > TASK_RETRY_POLICIES > 默认环境变量。"""
+    if task_type in _registered:
+        return _registered[task_type]
+    for part in (os.getenv('TASK_RETRY_POLICIES') or '').split(';'):
+        name, _, spec = part.partition('=')
+        if name.strip() != task_type or not spec.strip():
+            continue
+        overrides: Dict[str, Any] = {}
+        for kv in spec.split(','):
+            k, _, v = kv.partition(':')
+            if k.strip() in _ENV_KEYS and v.strip():
+                try:
+                    overrides[_ENV_KEYS[k.strip()]] = float(v)
+                except ValueError:
+                    pass
+        return _env_policy(**overrides)
+    return _env_policy()
+
+
+def retry_detail(detail: Optional[str]) -> Tuple[int, Optional[datetime]]:
+    """从“重试中 / 失败”事件 detail 中取 (已尝试次数, 下次尝试时间)。"""
+    try:
+        data = json.loads(detail or '')
+    except Exception:
+        return 0, None
+    if not isinstance(data, dict):
+        return 0, None
+    try:
+        attempt = int(data.get('attempt') or 0)
+    except (TypeError, ValueError):
+        attempt = 0
+    at = data.get('next_attempt_at')
+    try:
+        return attempt, datetime.fromisoformat(at) if at else None
+    except (TypeError, ValueError):
+        return attempt, None
+
+
+def failure_outcome(
+    task_type: Optional[str], attempt: int, error: Optional[BaseException], now: Optional[datetime] = None,
+) -> Tuple[str, str]:
+    """第 attempt 次执行失败后的 (状态, 事件 detail)：可重试时为“重试中”，否则为“失败”。"""
+    policy = retry_policy(task_type)
+    info: Dict[str, Any] = {'attempt': int(attempt)}
+    if error is not None:
+        info['error'] = f"{type(error).__name__}: {error}"[:500]
+    if policy.should_retry(attempt, error):
+        delay = policy.delay(attempt)
+        info['delay'] = round(delay, 3)
+        info['next_attempt_at'] = ((now or datetime.utcnow()) + timedelta(seconds=delay)).isoformat()
+        return "重试中", json.dumps(info, ensure_ascii=False)
+    return "失败", json.dumps(info, ensure_ascii=False)
+
+
+def task_outcome(
+    task_type: Optional[str], task_id: Optional[str], ok: bool, error: Optional[BaseException] = None, projection: Any = None,
+    conn: Any = None,
+) -> Tuple[str, Optional[str]]:
+    """
+    任务执行结束后的 (状态, detail)：成功为 ("成功", None)。
+    失败时尝试次数取投影中已记录的次数 + 1；传入 conn 时还取持久化的“处理中”事件数（含本次认领）中的较大者，
+    重启后或在其他工作进程上执行时同样按 max_attempts 截止。
+    """
+    if ok:
+        return "成功", None
+    attempt = (projection.attempt(task_id) if projection is not None and task_id else 0) + 1
+    if conn is not None and task_id:
+        from .events import attempt_counts
+        try:
+            attempt = max(attempt, attempt_counts(conn, [task_id]).get(task_id, 0))
+        except Exception:
+            pass
+    return failure_outcome(task_type, attempt, error)
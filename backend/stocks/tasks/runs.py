@@ -0,0 +1,222 @@
+"""
+全量更新的运行记录与按代码断点续跑。
+
+全量更新原先只在内存（_update_ctrl）中记录进度，服务重启后进度丢失，下一次只能为全市场重新生成任务从头开始。
+现在每次全量更新是一个持久化的运行（run）：
+  - update_runs：运行状态事件（只追加，当前状态 = 每个 run_id 的最新一行），
+    记录类型、状态（运行中 / 已停止 / 已完成 / 部分完成 / 出错）、代码总数、参数（截止日期等）与所属进程
+  - update_run_codes：按代码的完成检查点 (run_id, code, task_id, 成功 / 失败)，由 CheckpointWriter 攒批写入；
+    成功在本地执行完成时立即记录，失败在任务最终结束（重试用尽）后记录
+运行只跟踪本次生成（或合并到）的任务 id，直到每个任务结束；全部代码成功才记为“已完成”，否则为“部分完成”。
+续跑（UpdateFullView resume）时沿用原运行的 run_id 与参数，只为没有“成功”检查点的代码生成任务；
+原运行进程遗留的“处理中”任务先退回待处理（release_stale_tasks），再与新任务合并（见 stocks.tasks.coalesce），
+否则合并会把新请求并入这些不再执行的任务。
+进程崩溃时最多丢失最近一批尚未写入的检查点（UPDATE_CHECKPOINT_BATCH，默认 50），这些代码续跑时重新执行。
+状态为“运行中”但不属于当前进程、且超过 UPDATE_RUN_STALE_SECONDS（默认 300）无检查点写入的运行视为已中断，可续跑。
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    from data_pipeline.bulk_writer import BulkWriter
+except Exception:
+    BulkWriter = None
+
+from .coalesce import parse_params, task_code
+from .events import default_worker, server_now
+
+logger = logging.getLogger(__name__)
+
+RUN_COLUMNS = ('run_id', 'kind', 'status', 'total_codes', 'params', 'worker', 'started_at', 'ts')
+CHECKPOINT_COLUMNS = ('run_id', 'code', 'task_id', 'status', 'ts')
+
+RUN_RUNNING = '运行中'
+RUN_STOPPED = '已停止'
+RUN_DONE = '已完成'
+RUN_PARTIAL = '部分完成'
+RUN_ERROR = '出错'
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+
+def record_run(
+    conn, run_id: str, kind: str, status: str, total_codes: int = 0, params: Optional[Dict[str, Any]] = None,
+    started_at: Optional[datetime] = None,
+) -> None:
+    """追加一条运行状态。"""
+    now = datetime.utcnow()
+    cur = conn.cursor()
+    cur.execute(
+        f"insert into update_runs ({', '.join(RUN_COLUMNS)}) values (%s, %s, %s, %s, %s, %s, %s, %s)",
+        (run_id, kind, status, int(total_codes or 0), json.dumps(params or {}, ensure_ascii=False),
+         default_worker(), started_at or now, now),
+    )
+
+
+def _row_to_run(row) -> Dict[str, Any]:
+    run = dict(zip(RUN_COLUMNS, row))
+    try:
+        run['params'] = json.loads(run.get('params') or '{}')
+    except Exception:
+        run['params'] = {}
+    return run
+
+
+def get_run(conn, run_id: str) -> Optional[Dict[str, Any]]:
+    cur = conn.cursor()
+    cur.execute(
+        f"select {', '.join(RUN_COLUMNS)} from update_runs where run_id = %s latest on ts partition by run_id",
+        (run_id,),
+    )
+    row = cur.fetchone()
+    return _row_to_run(row) if row else None
+
+
+def latest_run(conn, kind: str = 'full') -> Optional[Dict[str, Any]]:
+    """该类型最近开始的运行（当前状态）。"""
+    cur = conn.cursor()
+    cur.execute(
+        f"select {', '.join(RUN_COLUMNS)} from "
+        f"(select {', '.join(RUN_COLUMNS)} from update_runs where kind = %s latest on ts partition by run_id) "
+        f"order by started_at desc limit 1",
+        (kind,),
+    )
+    row = cur.fetchone()
+    return _row_to_run(row) if row else None
+
+
+def code_states(conn, run_id: str) -> Tuple[Dict[str, str], Optional[datetime]]:
+    """运行中各代码的最新检查点状态 {code: 成功 / 失败}，以及最近一次检查点时间。"""
+    cur = conn.cursor()
+    cur.execute(
+        "select code, status, ts from update_run_codes where run_id = %s latest on ts partition by code",
+        (run_id,),
+    )
+    states: Dict[str, str] = {}
+    last: Optional[datetime] = None
+    for code, st, ts in cur.fetchall() or []:
+        states[code] = st
+        if ts is not None and (last is None or ts > last):
+            last = ts
+    return states, last
+
+
+def completed_codes(conn, run_id: str) -> Set[str]:
+    states, _ = code_states(conn, run_id)
+    return {code for code, st in states.items() if st == '成功'}
+
+
+def release_stale_tasks(orm, worker: Optional[str], codes: Set[str], task_type: str = 'download_daily') -> int:
+    """
+    续跑前把原运行进程（worker）遗留的、属于 codes 的“处理中”任务退回待处理，返回退回的任务数。
+    原进程已退出，这些任务不会再结束；不退回时新任务会被合并进去而不再执行。
+    """
+    if not worker or not codes:
+        return 0
+    orm.projection.refresh(orm._conn)
+    ts = server_now(orm._conn)
+    detail = json.dumps({'released': True, 'worker': worker}, ensure_ascii=False)
+    rows = []
+    for recs in orm.projection.active_by_key(task_type).values():
+        for rec in recs:
+            if rec.status == '处理中' and rec.worker == worker and task_code(parse_params(rec.task_params)) in codes:
+                rows.append((rec.task_id, '待处理', ts, orm.worker, detail))
+    if rows:
+        orm.append_events(rows)
+        for task_id, status, _, w, d in rows:
+            orm.projection.apply(task_id, status, ts, w, d)
+        logger.warning("续跑前退回原运行遗留的处理中任务: worker=%s, tasks=%s", worker, len(rows))
+    return len(rows)
+
+
+def run_summary(conn, run: Dict[str, Any], active_run_id: Optional[str] = None) -> Dict[str, Any]:
+    """运行的持久化进度：总数 / 已完成 / 失败 / 剩余，以及是否已中断、可否续跑。"""
+    states, last = code_states(conn, run['run_id'])
+    completed = sum(1 for st in states.values() if st == '成功')
+    failed = sum(1 for st in states.values() if st != '成功')
+    total = int(run.get('total_codes') or 0)
+    interrupted = False
+    if run.get('status') == RUN_RUNNING and run['run_id'] != active_run_id:
+        if run.get('worker') == default_worker():
+            interrupted = True
+        else:
+            stale = float(os.getenv('UPDATE_RUN_STALE_SECONDS', '300'))
+            seen = max(filter(None, [last, run.get('ts')]), default=None)
+            interrupted = seen is None or (datetime.utcnow() - seen).total_seconds() > stale
+    status = run.get('status')
+    return {
+        'run_id': run['run_id'],
+        'kind': run.get('kind'),
+        'status': status,
+        'started_at': run.get('started_at'),
+        'updated_at': run.get('ts'),
+        'last_checkpoint_at': last,
+        'total_codes': total,
+        'completed': completed,
+        'failed': failed,
+        'remaining': max(0, total - completed),
+        'interrupted': interrupted,
+        # 可续跑：已结束（停止 / 出错 / 完成但有失败的代码）或已中断，且仍有未成功的代码
+        'resumable': (status != RUN_RUNNING or interrupted) and completed < total,
+    }
+
+
+class CheckpointWriter:
+    """
+    按代码的完成检查点：add() 可在任意线程调用，攒够 batch_size 条或距上次写入超过 interval 秒时
+    以一条多行 VALUES 语句写入 update_run_codes；close() 写入剩余检查点。使用独立连接，与执行线程互不影响。
+    """
+
+    def __init__(self, conn, run_id: str, batch_size: Optional[int] = None, interval: float = 5.0) -> None:
+        self.conn = conn
+        self.run_id = run_id
+        self.batch_size = max(1, batch_size or int(os.getenv('UPDATE_CHECKPOINT_BATCH', '50')))
+        self.interval = interval
+        self._rows: List[Tuple[str, str, Optional[str], str, datetime]] = []
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self.written = 0
+
+    def add(self, code: Optional[str], ok: bool, task_id: Optional[str] = None) -> None:
+        if not code:
+            return
+        with self._lock:
+            self._rows.append((self.run_id, code, task_id, '成功' if ok else '失败', datetime.utcnow()))
+            if len(self._rows) >= self.batch_size or time.monotonic() - self._flushed_at >= self.interval:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        rows, self._rows = self._rows, []
+        self._flushed_at = time.monotonic()
+        if not rows:
+            return
+        try:
+            if BulkWriter is not None:
+                writer = BulkWriter(self.conn, 'update_run_codes', CHECKPOINT_COLUMNS, batch_size=len(rows), adaptive=False)
+                self.written += writer.write(rows).written
+                return
+            cur = self.conn.cursor()
+            for row in rows:
+                cur.execute(
+                    f"insert into update_run_codes ({', '.join(CHECKPOINT_COLUMNS)}) values (%s, %s, %s, %s, %s)",
+                    row,
+                )
+            self.written += len(rows)
+        except Exception as e:
+            # 检查点丢失只会让这些代码在续跑时重新执行
+            logger.warning("写入更新检查点失败: run_id=%s, rows=%s, error=%s", self.run_id, len(rows), e)
+
+    def close(self) -> None:
+        self.flush()
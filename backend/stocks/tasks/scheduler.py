@@ -0,0 +1,101 @@
+"""
+任务队列的公平调度：按任务类型加权公平排队、优先级老化、按类型并发上限，以及各类型排队等待时间统计。
+
+原先认领总是取全局最高优先级：大量低优先级 download_daily 积压会让 inst_trading_tracker 等收盘后任务一直排在后面，
+一批高优先级任务又会饿死其他所有类型。ActiveTaskProjection 认领时经 FairScheduler 选择任务类型：
+  - 加权公平（start-time fair queueing）：每个类型有虚拟完成时间 F，选取 max(F, V) 最小的类型，
+    服务后 F += 1 / 权重；权重 TASK_WEIGHTS="inst_trading_tracker=4,download_daily=1"（未列出的类型为 1）
+  - 类型内按“老化后优先级”排序：priority + 已等待秒数 / TASK_AGING_SECONDS（默认 600，即每等 10 分钟升一级；0 关闭老化）
+  - 并发上限：TASK_TYPE_LIMITS="download_daily=8" 限制某类型同时处理中的任务数（按投影所见，含其他进程）
+  - 统计：每次认领记录该任务的排队时长（从进入可认领状态起），按类型汇总次数 / 平均 / 最大
+"""
+import os
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+
+def _parse_map(value: Optional[str]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (value or '').split(','):
+        name, _, v = part.partition('=')
+        if name.strip() and v.strip():
+            try:
+                out[name.strip()] = float(v)
+            except ValueError:
+                pass
+    return out
+
+
+class FairScheduler:
+    """FairScheduler(weights, limits, aging_seconds)；choose() / charge() 由投影在锁内调用。"""
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        limits: Optional[Dict[str, float]] = None,
+        aging_seconds: float = 600.0,
+    ) -> None:
+        self.weights = {k: v for k, v in (weights or {}).items() if v > 0}
+        self.limits = {k: int(v) for k, v in (limits or {}).items() if v > 0}
+        self.aging_seconds = max(0.0, float(aging_seconds))
+        self._finish: Dict[str, float] = {}
+        self._vclock = 0.0
+        self._lock = threading.Lock()
+        self._waits: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def from_env(cls) -> 'FairScheduler':
+        return cls(
+            weights=_parse_map(os.getenv('TASK_WEIGHTS')),
+            limits=_parse_map(os.getenv('TASK_TYPE_LIMITS')),
+            aging_seconds=float(os.getenv('TASK_AGING_SECONDS', '600')),
+        )
+
+    def weight(self, task_type: str) -> float:
+        return self.weights.get(task_type, 1.0)
+
+    def limit(self, task_type: str) -> Optional[int]:
+        return self.limits.get(task_type)
+
+    def admits(self, task_type: str, running: int) -> bool:
+        limit = self.limit(task_type)
+        return limit is None or running < limit
+
+    def choose(self, task_types: Iterable[str]) -> Optional[str]:
+        """在有可认领任务的类型中选出虚拟开始时间最小的类型（同值按权重高者优先）。"""
+        with self._lock:
+            best = None
+            for t in task_types:
+                key = (max(self._finish.get(t, 0.0), self._vclock), -self.weight(t), t)
+                if best is None or key < best:
+                    best = key
+            return best[2] if best else None
+
+    def charge(self, task_type: str, wait_seconds: Optional[float] = None) -> None:
+        """记一次服务：推进该类型的虚拟完成时间，并记录排队时长。"""
+        with self._lock:
+            start = max(self._finish.get(task_type, 0.0), self._vclock)
+            self._vclock = start
+            self._finish[task_type] = start + 1.0 / self.weight(task_type)
+            if wait_seconds is not None:
+                w = self._waits.setdefault(task_type, {'claimed': 0, 'wait_total': 0.0, 'wait_max': 0.0})
+                w['claimed'] += 1
+                w['wait_total'] += max(0.0, wait_seconds)
+                w['wait_max'] = max(w['wait_max'], wait_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = {
+                t: {
+                    'claimed': int(w['claimed']),
+                    'wait_avg': round(w['wait_total'] / w['claimed'], 3) if w['claimed'] else 0.0,
+                    'wait_max': round(w['wait_max'], 3),
+                }
+                for t, w in self._waits.items()
+            }
+            return {
+                'weights': dict(self.weights),
+                'limits': dict(self.limits),
+                'aging_seconds': self.aging_seconds,
+                'waits': waits,
+            }
@@ -0,0 +1,403 @@
+"""
+独立的任务工作进程（可多进程 / 多节点运行，共享同一个 tasks / task_events）。
+
+原先队列任务只在 Django Web 进程内的守护线程（views._queue_ctrl）里执行，只能单进程消费，
+Web 重启即中断在途任务。TaskWorker 作为独立进程运行（manage.py qdb_worker）：
+  - 认领：QdbOrm.claim_tasks(n, lease=...) 批量认领到本地缓冲，事件中记录 worker 与租约，
+    并发认领按“最早认领获胜”裁决（见 events.claim_winners）
+  - 心跳：每 heartbeat_interval 秒写一行 worker_heartbeats（含在途任务数），租约随心跳续期
+  - 回收：同一心跳线程每 reap_interval 秒检查租约过期（认领者心跳超过 lease_seconds）的任务，退回“待处理”；
+    并按任务类型超时回收卡死的处理中任务（见 reaper）
+  - 执行：FetchExecutor 线程池（每线程持有一个连接），任务类型经 TASK_RUNNERS 注册表分派；
+    缓冲中类型、复权方式、结束日期相同的任务合为一批（TASK_BATCH_SIZE，默认 8），
+    由任务类的 run_batch 在同一连接与写入缓冲上执行，结束状态仍逐个任务记录
+多次认领 / 重复执行时，日线写入由 stock_daily 的 dedup upsert keys 保证幂等。
+"""
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .coalesce import parse_params
+from .download_daily import DownloadDailyTask, QdbOrm
+from .DTBInstTradingTracker import DTBInstTradingTrackerTask
+from .events import default_worker, expired_leases, heartbeat, server_now
+from .executor import FetchExecutor, default_concurrency
+from .reaper import TaskReaper
+from .retry import task_outcome
+
+try:
+    from data_pipeline.collector import qdb_connect
+except Exception:
+    qdb_connect = None
+
+try:
+    from data_pipeline.source_isolation import cancel_all as cancel_source_calls
+except Exception:
+    cancel_source_calls = None
+
+logger = logging.getLogger(__name__)
+
+# 任务类型 → 任务类（构造参数为 orm，run(conn=...) 返回 bool）
+TASK_RUNNERS: Dict[str, Callable[[Any], Any]] = {
+    'download_daily': DownloadDailyTask,
+    'inst_trading_tracker': DTBInstTradingTrackerTask,
+}
+
+
+def register_task_type(task_type: str, factory: Callable[[Any], Any]) -> None:
+    """注册新的任务类型；factory(orm) 返回实现 run(conn=None) -> bool 的任务对象。"""
+    TASK_RUNNERS[task_type] = factory
+
+
+def run_task_item(item: Dict[str, Any], conn, on_done: Callable[..., None], on_progress=None, stop_event=None) -> bool:
+    """
+    按任务类型构造任务并在给定连接上执行，结束状态交给 on_done(task_id, status, detail)。
+    失败时按重试策略给出“重试中”（detail 含下次尝试时间）或“失败”（见 stocks.tasks.retry）。
+    """
+    task_id = item.get('task_id')
+    factory = TASK_RUNNERS.get(item.get('task_type') or '')
+    if factory is None:
+        logger.error("未注册的任务类型: %s (%s)", item.get('task_type'), task_id)
+        on_done(task_id, "失败", None)
+        return False
+    t = _build_task(item, conn, on_progress, stop_event)
+    try:
+        ok = bool(t.run(conn=conn))
+        error = None if ok else getattr(t, 'last_error', None)
+    except Exception as e:
+        logger.exception("任务执行异常: %s (%s)", task_id, e)
+        ok, error = False, e
+    on_done(task_id, *task_outcome(item.get('task_type'), task_id, ok, error, t.orm.projection, conn=conn))
+    return ok
+
+
+def default_lease_seconds() -> int:
+    try:
+        return max(1, int(os.getenv('TASK_LEASE_SECONDS', '120')))
+    except ValueError:
+        return 120
+
+
+class LeaseHeartbeat:
+    """
+    Web 进程内的更新线程（views 的全量 / 队列更新）以租约认领任务时使用：后台线程每 interval 秒
+    以本进程的 worker 标识写一行 worker_heartbeats，租约随心跳续期；进程退出后心跳停止，
+    任一工作进程按租约过期（events.expired_leases）把这些任务退回待处理。
+    """
+
+    def __init__(
+        self, worker: Optional[str] = None, lease_seconds: Optional[int] = None, running: Optional[Callable[[], int]] = None,
+    ) -> None:
+        self.worker = worker or default_worker()
+        self.interval = float(os.getenv('TASK_HEARTBEAT_SECONDS') or (lease_seconds or default_lease_seconds()) / 4)
+        self.running = running
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'LeaseHeartbeat':
+        self._thread = threading.Thread(target=self._loop, name='lease-heartbeat', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _loop(self) -> None:
+        if qdb_connect is None:
+            return
+        conn = None
+        while True:
+            try:
+                if conn is None or getattr(conn, 'closed', 0):
+                    conn = qdb_connect()
+                if conn is not None:
+                    heartbeat(conn, self.worker, self.running() if self.running else 0)
+            except Exception as e:
+                logger.warning("心跳写入失败: %s", e)
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+            if self._stop.wait(self.interval):
+                break
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def default_batch_size() -> int:
+    try:
+        return max(1, int(os.getenv('TASK_BATCH_SIZE', '8')))
+    except ValueError:
+        return 8
+
+
+def batch_key(item: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    """可合批执行的任务键 (任务类型, 复权方式, 结束日期)；任务类不支持 run_batch 时返回 None。"""
+    task_type = item.get('task_type') or ''
+    if not hasattr(TASK_RUNNERS.get(task_type), 'run_batch'):
+        return None
+    params = parse_params(item.get('task_params'))
+    return (task_type, str(params.get('adjust') or '').lower(), str(params.get('end_date') or '').replace('-', ''))
+
+
+def take_batch(buffer: List[Dict[str, Any]], size: int) -> List[Dict[str, Any]]:
+    """从缓冲头部取一个任务，并取出其后至多 size-1 个同键任务（保持原有顺序）。"""
+    first = buffer.pop(0)
+    key = batch_key(first) if size > 1 else None
+    if key is None:
+        return [first]
+    group = [first]
+    i = 0
+    while i < len(buffer) and len(group) < size:
+        if batch_key(buffer[i]) == key:
+            group.append(buffer.pop(i))
+        else:
+            i += 1
+    return group
+
+
+def _build_task(item: Dict[str, Any], conn, on_progress=None, stop_event=None):
+    orm = QdbOrm(conn)
+    t = TASK_RUNNERS[item.get('task_type') or ''](orm)
+    t.task_id = item.get('task_id')
+    t.task_type = item.get('task_type')
+    t.task_desc = item.get('task_desc')
+    t.params_str = item.get('task_params') or '{}'
+    t.priority = item.get('priority') or 0
+    if on_progress is not None and hasattr(t, 'on_progress'):
+        t.on_progress = on_progress
+    # 停止时数据源调用不再等待限流（见 data_pipeline.source_limiter.source_call）
+    t.stop_event = stop_event
+    return t
+
+
+def run_task_batch(
+    items: Sequence[Dict[str, Any]], conn, on_done: Callable[..., None], on_progress=None, stop_event=None,
+) -> Dict[str, bool]:
+    """
+    批量执行同键任务（见 take_batch）：共享一个任务对象、连接与写入缓冲，固定开销每批只付一次；
+    每个原始任务仍经 on_done(task_id, status, detail) 记录各自的结果（失败时按重试策略）。单个任务时退化为 run_task_item。
+    """
+    if len(items) == 1:
+        return {items[0].get('task_id'): run_task_item(items[0], conn, on_done, on_progress, stop_event)}
+    t = _build_task(items[0], conn, on_progress, stop_event)
+    batch_error: Optional[BaseException] = None
+    try:
+        results = t.run_batch(items, conn)
+    except Exception as e:
+        logger.exception("批量任务执行异常: %s 个任务 (%s)", len(items), e)
+        results, batch_error = {}, e
+    errors = getattr(t, 'errors', None) or {}
+    out = {}
+    for item in items:
+        task_id = item.get('task_id')
+        ok = bool(results.get(task_id))
+        out[task_id] = ok
+        error = None if ok else errors.get(task_id, batch_error)
+        on_done(task_id, *task_outcome(item.get('task_type'), task_id, ok, error, t.orm.projection, conn=conn))
+    return out
+
+
+class TaskWorker:
+    """
+    TaskWorker(...).run() 阻塞运行直到 stop() 或（exit_when_idle 时）队列为空。
+    参数（未指定时读环境变量）：
+      - concurrency: 执行线程数（FETCH_CONCURRENCY，默认 4）
+      - prefetch: 每次认领的任务数（QUEUE_PREFETCH，默认 concurrency * 2）
+      - lease_seconds: 租约时长（TASK_LEASE_SECONDS，默认 120）
+      - heartbeat_interval: 心跳间隔（TASK_HEARTBEAT_SECONDS，默认 lease_seconds / 4）
+      - reap_interval: 回收过期租约的间隔（TASK_REAP_SECONDS，默认 30）
+      - task_types: 只处理这些类型（默认全部已注册类型，未注册类型的任务不认领）
+      - batch_size: 合批执行的最大任务数（TASK_BATCH_SIZE，默认 8；1 表示逐个执行）
+    """
+
+    def __init__(
+        self,
+        worker_id: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        prefetch: Optional[int] = None,
+        lease_seconds: Optional[int] = None,
+        heartbeat_interval: Optional[float] = None,
+        reap_interval: Optional[float] = None,
+        task_types: Optional[Sequence[str]] = None,
+        batch_size: Optional[int] = None,
+        exit_when_idle: bool = False,
+        idle_sleep: float = 5.0,
+    ) -> None:
+        self.worker_id = worker_id or default_worker()
+        self.concurrency = concurrency or default_concurrency()
+        self.prefetch = prefetch or int(os.getenv('QUEUE_PREFETCH', str(self.concurrency * 2)))
+        self.lease_seconds = int(lease_seconds or default_lease_seconds())
+        self.heartbeat_interval = float(heartbeat_interval or os.getenv('TASK_HEARTBEAT_SECONDS', str(self.lease_seconds / 4)))
+        self.reap_interval = float(reap_interval or os.getenv('TASK_REAP_SECONDS', '30'))
+        self.task_types: List[str] = list(task_types or [])
+        self.batch_size = batch_size or default_batch_size()
+        self.exit_when_idle = exit_when_idle
+        self.idle_sleep = idle_sleep
+        # 与 FetchExecutor 协作的控制器（结构同 views._queue_ctrl）
+        self.ctrl = {'stop_event': threading.Event(), 'state': {'paused': False}}
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self._done_events: List[tuple] = []
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self.retried = 0
+        self.reaper = TaskReaper(qdb_connect, interval=self.reap_interval, worker=self.worker_id)
+
+    def stop(self) -> None:
+        self.ctrl['stop_event'].set()
+        if cancel_source_calls is not None:
+            # 隔离子进程中的数据源调用立即终止（未开启 SOURCE_ISOLATION 时无操作）
+            cancel_source_calls()
+
+    # 心跳与回收（独立连接）
+    def _heartbeat_loop(self) -> None:
+        conn = None
+        last_reap = 0.0
+        while True:
+            try:
+                if conn is None or getattr(conn, 'closed', 0):
+                    conn = qdb_connect()
+                if conn is not None:
+                    heartbeat(conn, self.worker_id, self._inflight)
+                    if time.time() - last_reap >= self.reap_interval:
+                        last_reap = time.time()
+                        self._reap(conn)
+                        self.reaper.run_once(conn)
+            except Exception as e:
+                logger.warning("心跳/回收失败: %s", e)
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+            if self.ctrl['stop_event'].wait(self.heartbeat_interval):
+                break
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _reap(self, conn) -> int:
+        expired = expired_leases(conn, self.lease_seconds)
+        if not expired:
+            return 0
+        orm = QdbOrm(conn)
+        orm.worker = self.worker_id
+        ts = server_now(conn)
+        orm.append_events([(task_id, "待处理", ts, self.worker_id, f'lease expired: {owner}') for task_id, owner in expired])
+        for task_id, _ in expired:
+            orm.projection.apply(task_id, "待处理", ts)
+        self.requeued += len(expired)
+        logger.warning("租约过期，退回待处理: %s 个任务", len(expired))
+        return len(expired)
+
+    # 结束事件汇总
+    def _on_done(self, task_id: str, status: str, detail: Optional[str] = None) -> None:
+        with self._lock:
+            self._done_events.append((task_id, status, server_now(), self.worker_id, detail))
+            self._inflight -= 1
+            if status == "成功":
+                self.completed += 1
+            elif status == "失败":
+                self.failed += 1
+            elif status == "重试中":
+                self.retried += 1
+
+    def _flush_done(self, orm: QdbOrm) -> None:
+        with self._lock:
+            rows, self._done_events = self._done_events, []
+        if not rows:
+            return
+        try:
+            orm.append_events(rows)
+            for task_id, status, ts, worker, detail in rows:
+                orm.projection.apply(task_id, status, ts, worker, detail)
+        except Exception as e:
+            logger.warning("结束状态写入失败，稍后重试: %s", e)
+            with self._lock:
+                self._done_events[:0] = rows
+
+    def _claim(self, orm: QdbOrm) -> List[Dict[str, Any]]:
+        # 一次认领所有可处理类型，类型之间的比例由投影的公平调度决定
+        types = self.task_types or list(TASK_RUNNERS)
+        return orm.claim_tasks(self.prefetch, lease=self.lease_seconds, task_types=types)
+
+    def run(self) -> Dict[str, int]:
+        if qdb_connect is None:
+            raise RuntimeError("data_pipeline 不可用")
+        conn = qdb_connect()
+        if not conn:
+            raise RuntimeError("QuestDB 连接不可用")
+        orm = QdbOrm(conn)
+        orm.worker = self.worker_id
+        hb = threading.Thread(target=self._heartbeat_loop, name='task-heartbeat', daemon=True)
+        hb.start()
+        executor = FetchExecutor(max_workers=self.concurrency, ctrl=self.ctrl)
+        buffer: List[Dict[str, Any]] = []
+        last_flush = time.time()
+        logger.info(
+            "任务工作进程启动: %s, 并发=%s, 预取=%s, 合批=%s, 租约=%ss",
+            self.worker_id, self.concurrency, self.prefetch, self.batch_size, self.lease_seconds,
+        )
+        try:
+            while executor.wait_ready():
+                if not buffer or time.time() - last_flush > 5:
+                    self._flush_done(orm)
+                    last_flush = time.time()
+                if not buffer:
+                    try:
+                        buffer = self._claim(orm)
+                    except Exception as e:
+                        logger.warning("认领任务失败: %s", e)
+                        buffer = []
+                    if not buffer:
+                        if self.exit_when_idle and self._inflight <= 0:
+                            break
+                        self.ctrl['stop_event'].wait(self.idle_sleep)
+                        continue
+                group = take_batch(buffer, self.batch_size)
+                with self._lock:
+                    self._inflight += len(group)
+                executor.submit(lambda wconn, group=group: run_task_batch(group, wconn, self._on_done, stop_event=self.ctrl['stop_event']))
+            # 停止时已认领但未执行的任务退回待处理
+            with self._lock:
+                self._done_events.extend((item.get('task_id'), "待处理", server_now(), self.worker_id, None) for item in buffer)
+        finally:
+            executor.shutdown()
+            self._flush_done(orm)
+            self.ctrl['stop_event'].set()
+            hb.join(timeout=5)
+            try:
+                conn.close()
+            except Exception:
+                pass
+        logger.info(
+            "任务工作进程退出: %s, 成功=%s, 失败=%s, 重试=%s, 回收=%s",
+            self.worker_id, self.completed, self.failed, self.retried, self.requeued,
+        )
+        return {
+            'completed': self.completed, 'failed': self.failed, 'retried': self.retried, 'requeued': self.requeued,
+            'reaped': self.reaper.recovered + self.reaper.failed,
+        }
+
+
+def run_worker_process(index: int, options: Dict[str, Any]) -> None:
+    """多进程入口（multiprocessing spawn 目标）：每个进程一个 TaskWorker，worker_id 带进程序号。"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s %(message)s')
+    opts = dict(options)
+    opts['worker_id'] = f"{opts.get('worker_id') or default_worker()}#{index}"
+    worker = TaskWorker(**opts)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.run()
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import StockBasicViewSet, StockFinanceViewSet, UserFollowViewSet, QuotePlaceholderView, DataStatusView, UpdateStatusView, UpdateRunView, UpdateFullView, UpdatePauseView, UpdateResumeView, UpdateStopView, TaskListView, QueueUpdateStartView, QueueUpdatePauseView, QueueUpdateResumeView, QueueUpdateStopView
+from .views import StockBasicViewSet, StockFinanceViewSet, UserFollowViewSet, QuotePlaceholderView, DataStatusView, UpdateStatusView, UpdateRunView, UpdateFullView, UpdatePauseView, UpdateResumeView, UpdateStopView, TaskListView, TaskBulkCreateView, QueueUpdateStartView, QueueUpdatePauseView, QueueUpdateResumeView, QueueUpdateStopView
 from .data.daily import DailyDataView
 from .data.basic import StocksSHView, StocksSZView, StocksBJView
 from .config_views import ScheduleConfigView
@@ -25,6 +25,7 @@ urlpatterns = [
     path('stocks/update/queue/resume', QueueUpdateResumeView.as_view()),
     path('stocks/update/queue/stop', QueueUpdateStopView.as_view()),
     path('stocks/tasks', TaskListView.as_view()),
+    path('stocks/tasks/bulk', TaskBulkCreateView.as_view()),
     path('configs/schedule', ScheduleConfigView.as_view()),
     
     path('stocks/data/daily', DailyDataView.as_view()),# 日线数据
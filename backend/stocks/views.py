@@ -77,6 +77,14 @@ class TaskListView(APIView):
         status_filter = request.query_params.get('status')
         param_contains = request.query_params.get('param_contains') or request.query_params.get('q')
 
+        # 时间窗口：默认只查最近 TASK_HOT_DAYS 天创建的任务（只扫描近期分区），更早创建的未结束任务所在日期也包含在内；
+        # days=0 查询全部
+        days = request.query_params.get('days')
+        try:
+            days = float(days) if days not in (None, '') else None
+        except Exception:
+            days = None
+
         # 分页参数，默认第1页、每页50条；允许使用limit作为page_size别名
         try:
             page = int(request.query_params.get('page') or 1)
@@ -113,11 +121,20 @@ class TaskListView(APIView):
             params.append('%' + param_contains.lower() + '%')
         where_sql = (" WHERE " + " AND ".join(where)) if where else ""
 
+        # 任务当前状态 = tasks 定义 + task_events 最新事件（见 stocks.tasks.events）
+        from .tasks.events import hot_window_start, task_state_sql
         cur = conn.cursor()
+        try:
+            since = hot_window_start(days, conn)
+        except Exception:
+            # 查询失败时不限时间窗口，未结束任务仍可见
+            conn.rollback()
+            since = None
+        source = f"({task_state_sql(since)})"
         # 统计总数
         total = 0
         try:
-            cur.execute(f"SELECT count(*) FROM tasks{where_sql}", params)
+            cur.execute(f"SELECT count(*) FROM {source}{where_sql}", params)
             total = int((cur.fetchone() or [0])[0] or 0)
         except Exception:
             total = 0
@@ -131,7 +148,7 @@ class TaskListView(APIView):
         cols = ['task_id','task_type','task_desc','task_params','priority','status','created_at','started_at','ended_at']
         try:
             cur.execute(
-                f"SELECT task_id, task_type, task_desc, task_params, priority, status, created_at, started_at, ended_at FROM tasks{where_sql} ORDER BY priority DESC LIMIT %s",
+                f"SELECT task_id, task_type, task_desc, task_params, priority, status, created_at, started_at, ended_at FROM {source}{where_sql} ORDER BY priority DESC LIMIT %s",
                 params + [fetch_limit]
             )
             rows = cur.fetchall() or []
@@ -169,10 +186,15 @@ class TaskListView(APIView):
 
 import threading
 import time
+from datetime import datetime, timedelta
+
+from .tasks.executor import FetchExecutor
+from .tasks.pipeline import DailyPipeline, daily_runner
 
 _update_ctrl = {
   'thread': None,
   'stop_event': threading.Event(),
+  'pipeline': None,
   'state': {
     'running': False,
     'paused': False,
@@ -180,8 +202,13 @@ _update_ctrl = {
     'updated_count': 0,
     'total_codes': 0,
     'current_code': None,
+    'current_chunk': None,
     'started_at': None,
     'ended_at': None,
+    # 持久化的运行记录与续跑信息（见 stocks.tasks.runs）
+    'run_id': None,
+    'resumed': False,
+    'skipped_codes': 0,
   }
 }
 
@@ -196,14 +223,155 @@ _queue_ctrl = {
     'updated_count': 0,
     'total_codes': 0,
     'current_code': None,
+    'current_chunk': None,
     'started_at': None,
     'ended_at': None,
   }
 }
 
-def _start_full_update_thread():
+_ctrl_lock = threading.Lock()
+
+
+def _task_code(item):
+  """从任务参数中取出代码（code 或 codes 的第一个），用于前端显示。"""
+  try:
+    import json
+    params = json.loads(item.get('task_params') or '{}')
+  except Exception:
+    params = {}
+  code = params.get('code')
+  if not code and isinstance(params.get('codes'), list) and params.get('codes'):
+    code = params.get('codes')[0]
+  return code
+
+
+def _claim_in_chunks(orm, task_ids, ctrl, lease, held, chunk=64):
+  """
+  按 chunk 分段以租约认领指定任务并逐个产出（与 qdb_worker 进程互斥，见 QdbOrm.claim_ids）。
+  已认领未产出的任务留在 held 中，停止后由调用方退回待处理。
+  """
+  for i in range(0, len(task_ids), chunk):
+    if ctrl['stop_event'].is_set():
+      return
+    try:
+      held[:] = orm.claim_ids(task_ids[i:i + chunk], lease=lease)
+    except Exception:
+      continue
+    while held:
+      yield held.pop(0)
+
+
+def _release_claims(orm, items):
+  """已认领但未执行的任务退回待处理。"""
+  for item in list(items):
+    try:
+      orm.update_task_status(item.get('task_id'), "待处理")
+    except Exception:
+      pass
+
+
+# 全量更新等待重试退避或其他进程处理中的任务时的轮询间隔（秒）
+_RUN_POLL_SECONDS = 5
+
+
+def _settle_run_tasks(orm, task_ids, settled, checkpoint):
+  """
+  一轮执行后核对全量更新的任务：已记录结果的跳过；已结束的按最终状态写入检查点（checkpoint(task_id, ok)）；
+  仍未结束的（待处理、退避中的重试、其他进程处理中）返回，留待下一轮认领或等待。
+  """
+  from .tasks.events import TERMINAL_STATUSES
+  left = []
+  for task_id in task_ids:
+    if task_id in settled:
+      continue
+    rec = orm.projection.get(task_id)
+    if rec is not None:
+      left.append(task_id)
+      continue
+    # 投影不再跟踪的任务已结束（成功 / 失败 / 已取消），以数据库状态为准
+    try:
+      rec = orm.get_task(task_id)
+    except Exception:
+      rec = None
+    if rec is not None and rec.status not in TERMINAL_STATUSES:
+      # 结束事件尚未应用（WAL），稍后再核对
+      left.append(task_id)
+      continue
+    checkpoint(task_id, rec is not None and rec.status == "成功")
+  return left
+
+
+def _run_download_task(item, conn, ctrl, on_done=None):
+  """
+  在执行器工作线程中运行一个已认领的 download_daily 任务，使用该线程持有的连接写入状态与数据。
+  传入 on_done(task_id, status, detail) 时由调用方汇总写入结束状态（批量追加事件），否则立即写入。
+  失败时按重试策略置为“重试中”或“失败”（见 stocks.tasks.retry）。
+  """
+  from .tasks import DownloadDailyTask, QdbOrm
+  from .tasks.retry import task_outcome
+  orm = QdbOrm(conn)
+  t = DownloadDailyTask(orm)
+  t.on_progress = lambda unit, saved: _report_chunk(ctrl, unit)
+  t.stop_event = ctrl['stop_event']
+  t.task_id = item.get('task_id')
+  t.task_type = item.get('task_type')
+  t.task_desc = item.get('task_desc')
+  t.params_str = item.get('task_params') or '{}'
+  t.priority = item.get('priority') or 0
+  try:
+    ok = bool(t.run(conn=conn))
+    error = None if ok else t.last_error
+  except Exception as e:
+    ok, error = False, e
+  status_, detail = task_outcome(t.task_type, t.task_id, ok, error, orm.projection, conn=conn)
+  try:
+    if on_done is not None:
+      on_done(t.task_id, status_, detail)
+    else:
+      orm.update_task_status(t.task_id, status_, detail)
+  except Exception:
+    pass
+  _count_done(ctrl)
+  return ok
+
+
+def _run_task_batch(items, conn, ctrl, on_done):
+  """
+  在一个工作线程内批量运行同键任务（共享连接与写入缓冲），每个任务仍单独记录结束状态。
+  按任务类型经 TASK_RUNNERS 分派，单个任务同样如此（见 stocks.tasks.worker.run_task_batch）。
+  """
+  from .tasks.worker import run_task_batch
+  try:
+    results = run_task_batch(
+      items, conn, on_done, on_progress=lambda unit, saved: _report_chunk(ctrl, unit), stop_event=ctrl['stop_event'],
+    )
+  except Exception:
+    results = {}
+  for _ in items:
+    _count_done(ctrl)
+  return results
+
+
+def _report_chunk(ctrl, unit):
+  """按窗口上报进度：当前代码与正在处理的日期窗口。"""
+  ctrl['state']['current_code'] = unit.code
+  ctrl['state']['current_chunk'] = f"{unit.adj or 'raw'}:{unit.start_date}-{unit.end_date}"
+
+
+def _count_done(ctrl):
+  with _ctrl_lock:
+    ctrl['state']['updated_count'] += 1
+
+
+def _start_full_update_thread(resume_run=None):
+  """
+  启动全量更新线程。每次全量更新是一个持久化的运行（update_runs），每个代码完成后写入检查点（update_run_codes）；
+  传入 resume_run（stocks.tasks.runs 的运行记录）时沿用其 run_id 与截止日期，只处理没有成功检查点的代码。
+  """
   if _update_ctrl['thread'] and _update_ctrl['state']['running']:
     return False
+  from .tasks.runs import new_run_id
+  run_id = resume_run['run_id'] if resume_run else new_run_id()
   _update_ctrl['stop_event'].clear()
   _update_ctrl['state'].update({
     'running': True,
@@ -212,34 +380,72 @@ def _start_full_update_thread():
     'updated_count': 0,
     'total_codes': 0,
     'current_code': None,
+    'current_chunk': None,
     'started_at': timezone.now(),
     'ended_at': None,
+    'run_id': run_id,
+    'resumed': bool(resume_run),
+    'skipped_codes': 0,
   })
+  _update_ctrl['state'].pop('error', None)
+  _update_ctrl['pipeline'] = None
   
   def worker():
+    from .tasks.runs import (
+      CheckpointWriter, RUN_DONE, RUN_ERROR, RUN_PARTIAL, RUN_RUNNING, RUN_STOPPED, completed_codes, record_run,
+      release_stale_tasks,
+    )
+    conn = None
+    checkpoints = None
+    beat = None
+    orm = None
+    held = []
+    run_started = False
+    run_status = RUN_ERROR
+    total_codes = 0
+    run_params = dict((resume_run or {}).get('params') or {})
+    run_started_at = (resume_run or {}).get('started_at') or datetime.utcnow()
     try:
       import sys
       project_root = Path(settings.BASE_DIR).parent
       if str(project_root) not in sys.path:
         sys.path.append(str(project_root))
-      from data_pipeline.collector import qdb_connect,  populate_stock_basic_if_empty, qdb_get_all_basic, sync_basic_to_django
+      from data_pipeline.collector import qdb_connect, populate_stock_basic_if_empty, qdb_get_all_basic, sync_basic_to_django, qdb_daily_watermarks
       conn = qdb_connect()
       
       if not conn:
         _update_ctrl['state']['error'] = 'QuestDB连接失败'
         raise RuntimeError('QuestDB连接失败')
-
       
       populate_stock_basic_if_empty(conn=conn)
       sync_basic_to_django(conn=conn)
       basics = qdb_get_all_basic(conn=conn)
-      _update_ctrl['state']['total_codes'] = len(basics)
+      total_codes = len(basics)
+      _update_ctrl['state']['total_codes'] = total_codes
+      # 续跑：已有成功检查点的代码不再生成任务，进度从已完成数继续
+      done_codes = completed_codes(conn, run_id) if resume_run else set()
+      end_date = run_params.get('end_date') or timezone.now().strftime("%Y%m%d")
+      run_params['end_date'] = end_date
+      record_run(conn, run_id, 'full', RUN_RUNNING, total_codes, run_params,
+                 started_at=run_started_at)
+      run_started = True
+      # 检查点使用独立连接，由各执行线程的完成回调攒批写入
+      checkpoints = CheckpointWriter(qdb_connect() or conn, run_id)
       from .tasks import DownloadDailyTask, QdbOrm
+      from .tasks.download_daily import default_lookback_days
       orm = QdbOrm(conn)
       task = DownloadDailyTask(orm)
+      # 一次查询全市场水位线，任务只覆盖 [水位线+1-回看天数, 今天]
+      watermarks = qdb_daily_watermarks(conn=conn)
+      lookback = default_lookback_days()
+      specs = []
+      skipped = 0
       for item in basics:
         code = item.get('code')
         market = item.get('market')
+        if code in done_codes:
+          skipped += 1
+          continue
         listing_date = item.get('listing_date')
         if not listing_date:
           start_date = '19841118'
@@ -254,49 +460,122 @@ def _start_full_update_thread():
             start_date = '19841118'
         if not code:
           continue
-        task.generate("download_daily", f"Download daily data for {code}", {"code": code, "start_date": start_date, "end_date": timezone.now().strftime("%Y%m%d"), "market": market ,"adjust": "all"}, priority=0)
-      dl_daily = orm.list_tasks(status="待处理", task_type="download_daily", limit=100000)
-      for item in dl_daily:
-        if _update_ctrl['stop_event'].is_set():
-          break
-        while _update_ctrl['state']['paused']:
-          if _update_ctrl['stop_event'].is_set():
-            break
-          time.sleep(0.2)
-        if _update_ctrl['stop_event'].is_set():
-          break
-        try:
-          import json
-          params = json.loads(item.get('task_params') or '{}')
-        except Exception:
-          params = {}
-        code = params.get('code')
-        _update_ctrl['state']['current_code'] = code
-        t = DownloadDailyTask(orm)
-        t.task_id = item.get('task_id')
-        t.task_type = item.get('task_type')
-        t.task_desc = item.get('task_desc')
-        t.params_str = item.get('task_params') or '{}'
-        t.priority = item.get('priority') or 0
+        full_start = start_date
+        # adjust=all 只下载不复权日线与复权因子（因子表每次全量拉取，很小），按不复权水位线收窄区间
+        mark = watermarks.get((code, ''))
+        if mark:
+          since = mark + timedelta(days=1 - lookback)
+          start_date = max(full_start, since.strftime("%Y%m%d"))
+        specs.append((f"Download daily data for {code}", {
+          "code": code, "start_date": start_date, "end_date": end_date, "market": market, "adjust": "all",
+          "incremental": True, "lookback_days": lookback, "full_start_date": full_start,
+        }))
+      _update_ctrl['state']['skipped_codes'] = skipped
+      with _ctrl_lock:
+        _update_ctrl['state']['updated_count'] += skipped
+
+      # 全市场任务一次批量写入（多行 VALUES），不再逐只 INSERT；
+      # 续跑时先退回原运行进程遗留的处理中任务，否则新请求会被合并进这些不再执行的任务
+      if resume_run:
+        release_stale_tasks(orm, resume_run.get('worker'), {params['code'] for _, params in specs})
+      task_ids = task.generate_many("download_daily", specs, priority=0)
+      # 只跟踪本次返回的任务（合并时多个代码可能对应同一任务）
+      id_codes = {}
+      for (_, params), task_id in zip(specs, task_ids):
+        id_codes.setdefault(task_id, []).append(params['code'])
+      succeeded = set()
+      settled = set()
+
+      def checkpoint(task_id, ok):
+        settled.add(task_id)
+        for code in id_codes.get(task_id, ()):
+          if ok:
+            succeeded.add(code)
+          checkpoints.add(code, ok, task_id)
+
+      def task_done(item, ok):
+        _count_done(_update_ctrl)
+        if ok:
+          checkpoint(item.get('task_id'), True)
+
+      def run_task(wconn, item):
+        ok = _run_download_task(item, wconn, _update_ctrl)
+        if ok:
+          checkpoint(item.get('task_id'), True)
+        return ok
+
+      # 与 qdb_worker 相同，以租约分段认领并由心跳续期：其他工作进程不会重复执行，
+      # Web 进程退出后租约过期，任务由工作进程回收
+      from .tasks.worker import LeaseHeartbeat, default_lease_seconds
+      lease = default_lease_seconds()
+      beat = LeaseHeartbeat(orm.worker, lease).start()
+      prefetch = max(1, int(os.getenv('QUEUE_PREFETCH', '64')))
+      pending = list(id_codes)
+      # 按轮执行：每轮认领仍可认领的任务；之后核对结束状态，重试中 / 其他进程处理中的任务等待后进入下一轮
+      while pending and not _update_ctrl['stop_event'].is_set():
+        claimed = [0]
+
+        def counted(items):
+          for item in items:
+            claimed[0] += 1
+            yield item
+
+        dl_daily = counted(_claim_in_chunks(orm, pending, _update_ctrl, lease, held, prefetch))
+        if daily_runner() == 'pipeline':
+          # 分阶段流水线：拉取/转换/写入跨股票重叠执行（见 stocks.tasks.pipeline）
+          pipeline = DailyPipeline(
+            ctrl=_update_ctrl,
+            on_task_done=task_done,
+            on_progress=lambda unit, saved: _report_chunk(_update_ctrl, unit),
+          )
+          _update_ctrl['pipeline'] = pipeline
+          pipeline.run(dl_daily)
+        else:
+          # 并发执行：有界线程池 + 数据源全局限速（见 FetchExecutor / source_limiter）
+          executor = FetchExecutor(ctrl=_update_ctrl)
+          try:
+            for item in dl_daily:
+              if not executor.wait_ready():
+                held.insert(0, item)
+                break
+              _update_ctrl['state']['current_code'] = _task_code(item)
+              executor.submit(lambda wconn, item=item: run_task(wconn, item))
+          finally:
+            executor.shutdown()
+        pending = _settle_run_tasks(orm, pending, settled, checkpoint)
+        if pending and not claimed[0]:
+          _update_ctrl['stop_event'].wait(_RUN_POLL_SECONDS)
+      if _update_ctrl['stop_event'].is_set():
+        run_status = RUN_STOPPED
+      else:
+        codes = {params['code'] for _, params in specs}
+        run_status = RUN_DONE if codes <= succeeded else RUN_PARTIAL
+    except Exception as e:
+      _update_ctrl['state'].setdefault('error', str(e))
+      raise
+    finally:
+      if orm is not None and held:
+        _release_claims(orm, held)
+      if beat is not None:
+        beat.stop()
+      if checkpoints is not None:
+        checkpoints.close()
+        if checkpoints.conn is not conn:
+          try:
+            checkpoints.conn.close()
+          except Exception:
+            pass
+      if run_started:
         try:
-          orm.update_task_status(t.task_id, "处理中")
+          record_run(conn, run_id, 'full', run_status, total_codes, run_params,
+                     started_at=run_started_at)
         except Exception:
           pass
+      if conn is not None:
         try:
-          ok = t.run(conn=conn)
-        except Exception:
-          ok = False
-        try:
-          orm.update_task_status(t.task_id, "成功" if ok else "失败")
+          conn.close()
         except Exception:
           pass
-        _update_ctrl['state']['updated_count'] += 1
-        time.sleep(0.01)
-      try:
-        conn.close()
-      except Exception:
-        pass
-    finally:
       _update_ctrl['state']['running'] = False
       _update_ctrl['state']['stopped'] = _update_ctrl['stop_event'].is_set()
       _update_ctrl['state']['ended_at'] = timezone.now()
@@ -319,79 +598,91 @@ def _start_queue_update_thread():
     'updated_count': 0,
     'total_codes': 0,
     'current_code': None,
+    'current_chunk': None,
     'started_at': timezone.now(),
     'ended_at': None,
   })
 
   def worker():
+    beat = None
     try:
       import sys
       project_root = Path(settings.BASE_DIR).parent
       if str(project_root) not in sys.path:
         sys.path.append(str(project_root))
       from data_pipeline.collector import qdb_connect
-      from .tasks import DownloadDailyTask, QdbOrm
+      from .tasks import QdbOrm
+      from .tasks.worker import TASK_RUNNERS, LeaseHeartbeat, default_batch_size, default_lease_seconds, take_batch
       conn = qdb_connect()
       orm = QdbOrm(conn)
-      # 预估待处理总数
-      pending = orm.list_tasks(status="待处理", limit=100000)
-      _queue_ctrl['state']['total_codes'] = len(pending)
-      # 按优先级逐个处理
+      # 以租约认领并由心跳续期（同 qdb_worker），与工作进程互斥
+      lease = default_lease_seconds()
+      beat = LeaseHeartbeat(orm.worker, lease).start()
+      # 待处理总数（COUNT 查询）
+      _queue_ctrl['state']['total_codes'] = orm.count_tasks(status="待处理") + orm.count_tasks(status="重试中")
+      # 按优先级批量认领到本地预取缓冲（一次写入 N 个“处理中”事件），交给并发执行器运行；
+      # 结束状态同样在本地汇总，每次补充缓冲时批量追加
+      prefetch = max(1, int(os.getenv('QUEUE_PREFETCH', '64')))
+      batch_size = default_batch_size()
+      executor = FetchExecutor(ctrl=_queue_ctrl)
+      buffer = []
+      done_events = []
+      done_lock = threading.Lock()
+
+      def on_done(task_id, status_, detail=None):
+        from .tasks.events import server_now
+        ts = server_now()
+        orm.projection.apply(task_id, status_, ts, orm.worker, detail)
+        with done_lock:
+          done_events.append((task_id, status_, ts, orm.worker, detail))
+
+      last_flush = [time.time()]
+
+      def flush_done():
+        last_flush[0] = time.time()
+        with done_lock:
+          rows = done_events[:]
+          del done_events[:]
+        if rows:
+          try:
+            orm.append_events(rows)
+          except Exception:
+            with done_lock:
+              done_events[:0] = rows
+
       idx = 0
-      while not _queue_ctrl['stop_event'].is_set():
-        while _queue_ctrl['state']['paused']:
-          if _queue_ctrl['stop_event'].is_set():
+      while executor.wait_ready():
+        if not buffer or time.time() - last_flush[0] > 5:
+          flush_done()
+        if not buffer:
+          try:
+            # 只认领已注册执行器的任务类型
+            buffer = orm.claim_tasks(prefetch, lease=lease, task_types=list(TASK_RUNNERS))
+          except Exception:
+            buffer = []
+            time.sleep(0.2)
+            continue
+          if not buffer:
             break
-          time.sleep(0.2)
-        if _queue_ctrl['stop_event'].is_set():
-          break
-        # 取下一个待处理任务
-        item = orm.next_pending_task()
-        if not item:
-          break
-        tid = item.get('task_id')
-        try:
-          claimed = orm.claim_task(tid)
-        except Exception:
-          claimed = True
-        if not claimed:
-          # 未成功认领，稍后重试
-          time.sleep(0.2)
-          continue
-        # 解析参数，填充当前代码便于前端显示
-        try:
-          import json
-          params = json.loads(item.get('task_params') or '{}')
-        except Exception:
-          params = {}
-        code = params.get('code')
-        if not code and isinstance(params.get('codes'), list) and params.get('codes'):
-          code = params.get('codes')[0]
-        _queue_ctrl['state']['current_code'] = code or item.get('task_type')
-        # 根据类型构造任务，目前支持 download_daily
-        t = DownloadDailyTask(orm)
-        t.task_id = item.get('task_id')
-        t.task_type = item.get('task_type')
-        t.task_desc = item.get('task_desc')
-        t.params_str = item.get('task_params') or '{}'
-        t.priority = item.get('priority') or 0
-        ok = False
-        try:
-          ok = t.run(conn=conn)
-        except Exception:
-          ok = False
-        try:
-          orm.update_task_status(t.task_id, "成功" if ok else "失败")
-        except Exception:
-          pass
-        _queue_ctrl['state']['updated_count'] += 1
-        idx += 1
-        time.sleep(0.01)
+        # 同类型、复权方式、结束日期的任务合为一批执行（TASK_BATCH_SIZE，见 stocks.tasks.worker.take_batch）
+        group = take_batch(buffer, batch_size)
+        # 填充当前代码便于前端显示
+        _queue_ctrl['state']['current_code'] = _task_code(group[0]) or group[0].get('task_type')
+        # 根据类型构造任务（TASK_RUNNERS 注册表）
+        executor.submit(lambda wconn, group=group: _run_task_batch(group, wconn, _queue_ctrl, on_done))
+        idx += len(group)
+      # 停止时已认领但未执行的任务退回待处理
+      for item in buffer:
+        on_done(item.get('task_id'), "待处理")
+      executor.shutdown()
+      flush_done()
       try:
         conn.close()
       except Exception:
         pass
     finally:
+      if beat is not None:
+        beat.stop()
       _queue_ctrl['state']['running'] = False
       _queue_ctrl['state']['stopped'] = _queue_ctrl['stop_event'].is_set()
       _queue_ctrl['state']['ended_at'] = timezone.now()
@@ -427,6 +718,8 @@ class UpdateStatusView(APIView):
         total_codes = 0
         updated_count = 0
         recent_updates = []
+        workers = []
+        run = None
 
         try:
             conn = psycopg2.connect(host=host, port=port, user=user, password=password, dbname=dbname, connect_timeout=2)
@@ -469,6 +762,21 @@ class UpdateStatusView(APIView):
                 ]
             except Exception:
                 pass
+            # 独立任务工作进程（manage.py qdb_worker）的最近心跳
+            try:
+                from .tasks.events import live_workers
+                workers = live_workers(conn)
+            except Exception:
+                pass
+            # 最近一次全量更新的持久化进度（服务重启后仍可见，可续跑）
+            try:
+                from .tasks.runs import latest_run, run_summary
+                last = latest_run(conn, 'full')
+                if last is not None:
+                    active = _update_ctrl['state']['run_id'] if _update_ctrl['state']['running'] else None
+                    run = run_summary(conn, last, active_run_id=active)
+            except Exception:
+                pass
             conn.close()
         except OperationalError as e:
             qdb_error = str(e)
@@ -477,6 +785,9 @@ class UpdateStatusView(APIView):
 
         # 控制器状态（正在运行时优先使用内存中的计数和进度）
         ctrl = _update_ctrl['state'].copy()
+        if _update_ctrl.get('pipeline') is not None:
+            # 流水线各阶段队列深度与吞吐
+            ctrl['pipeline'] = _update_ctrl['pipeline'].stats()
         if ctrl.get('running'):
             total_codes = ctrl.get('total_codes') or total_codes
             updated_count = ctrl.get('updated_count') or updated_count
@@ -484,6 +795,34 @@ class UpdateStatusView(APIView):
         # 队列控制器状态
         queue_ctrl = _queue_ctrl['state'].copy()
 
+        # 数据源限流与本地缓存统计
+        try:
+            from data_pipeline.source_limiter import source_stats
+            source = source_stats()
+        except Exception:
+            source = None
+        # 写后缓冲（spool）积压与回放状态
+        try:
+            from data_pipeline.spool import spool_stats
+            spool = spool_stats()
+        except Exception:
+            spool = None
+
+        # 卡死任务回收统计
+        try:
+            from .tasks.reaper import reaper_stats
+            reaper = reaper_stats()
+        except Exception:
+            reaper = None
+
+        # 任务调度：按类型的排队 / 处理中数量、最久排队时间与认领等待统计
+        try:
+            from .tasks.events import default_projection
+            projection = default_projection()
+            scheduler = dict(projection.scheduler.stats() if projection.scheduler else {}, queues=projection.queue_stats())
+        except Exception:
+            scheduler = None
+
         return Response({
             'stock_basic_count': stock_basic_count,
             'finance_count': finance_count,
@@ -494,6 +833,12 @@ class UpdateStatusView(APIView):
             'recent_updates': recent_updates,
             'controller': ctrl,
             'queue_controller': queue_ctrl,
+            'workers': workers,
+            'run': run,
+            'reaper': reaper,
+            'scheduler': scheduler,
+            'source': source,
+            'spool': spool,
             'questdb': {
                 'host': host,
                 'port': port,
@@ -504,6 +849,92 @@ class UpdateStatusView(APIView):
             }
         })
 
+class TaskBulkCreateView(APIView):
+    def post(self, request):
+        """
+        批量提交任务（一次写入）。请求体二选一：
+          - {"codes": [...], "task_type": "download_daily", "start_date", "end_date", "adjust", "market", "priority"}
+            每个代码生成一个任务，其余字段作为公共参数
+          - {"tasks": [{"task_type", "task_desc", "params"|"task_params", "priority"}, ...]}
+        与未结束的同键任务（类型、代码、复权方式相同）合并，返回 {'created': n, 'requested': m, 'task_ids': [...]}
+        """
+        import sys
+        data = request.data or {}
+        codes = data.get('codes')
+        tasks = data.get('tasks')
+        if not codes and not tasks:
+            return Response({'error': '需要 codes 或 tasks'}, status=status.HTTP_400_BAD_REQUEST)
+        if codes is not None and not isinstance(codes, list):
+            return Response({'error': 'codes 必须为列表'}, status=status.HTTP_400_BAD_REQUEST)
+        if tasks is not None and not isinstance(tasks, list):
+            return Response({'error': 'tasks 必须为列表'}, status=status.HTTP_400_BAD_REQUEST)
+
+        def parse_priority(value):
+            if value in (None, ''):
+                return 0
+            if isinstance(value, bool):
+                raise ValueError(value)
+            return int(value)
+
+        # 先校验整个请求体并组好批次，全部合法后再写入，避免部分任务已入队后才返回 400
+        batches = []
+        if codes:
+            try:
+                priority = parse_priority(data.get('priority'))
+            except (TypeError, ValueError):
+                return Response({'error': 'priority 必须为整数'}, status=status.HTTP_400_BAD_REQUEST)
+            task_type = data.get('task_type') or 'download_daily'
+            common = {k: data[k] for k in ('start_date', 'end_date', 'adjust', 'market', 'incremental') if data.get(k) not in (None, '')}
+            specs = [
+                (f"Download daily data for {c}", dict(common, code=str(c).strip()))
+                for c in codes if str(c or '').strip()
+            ]
+            batches.append((task_type, specs, priority))
+        if tasks:
+            # 按 (task_type, priority) 分组，每组一次写入
+            groups = {}
+            for i, t in enumerate(tasks):
+                if not isinstance(t, dict) or not t.get('task_type'):
+                    return Response({'error': f'tasks[{i}] 需包含 task_type'}, status=status.HTTP_400_BAD_REQUEST)
+                try:
+                    priority = parse_priority(t.get('priority'))
+                except (TypeError, ValueError):
+                    return Response({'error': f'tasks[{i}].priority 必须为整数'}, status=status.HTTP_400_BAD_REQUEST)
+                params = t.get('params', t.get('task_params'))
+                if params is not None and not isinstance(params, (dict, str)):
+                    return Response({'error': f'tasks[{i}].params 必须为对象或 JSON 字符串'}, status=status.HTTP_400_BAD_REQUEST)
+                groups.setdefault((t['task_type'], priority), []).append((t.get('task_desc') or '', params))
+            batches += [(task_type, specs, priority) for (task_type, priority), specs in groups.items()]
+
+        try:
+            project_root = Path(settings.BASE_DIR).parent
+            if str(project_root) not in sys.path:
+                sys.path.append(str(project_root))
+            from data_pipeline.collector import qdb_connect
+            from .tasks import DownloadDailyTask, QdbOrm
+            conn = qdb_connect()
+            if not conn:
+                return Response({'error': 'QuestDB连接失败'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return Response({'error': f'QuestDB连接失败: {str(e)}'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        try:
+            orm = QdbOrm(conn)
+            task = DownloadDailyTask(orm)
+            task_ids = []
+            for task_type, specs, priority in batches:
+                task_ids += task.generate_many(task_type, specs, priority=priority)
+        except Exception as e:
+            return Response({'error': f'批量提交失败: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        # 与已有同键任务合并的请求返回其并入任务的 id（见 stocks.tasks.coalesce）
+        unique_ids = list(dict.fromkeys(task_ids))
+        return Response({'created': len(unique_ids), 'requested': len(task_ids), 'task_ids': unique_ids}, status=status.HTTP_201_CREATED)
+
 class UpdateRunView(APIView):
     def post(self, request):
         """触发一次数据更新（占位）：在后台线程执行采集脚本的run_once。"""
@@ -530,7 +961,15 @@ class UpdateRunView(APIView):
 
 class UpdateFullView(APIView):
     def post(self, request):
-        """触发全量更新：可暂停/继续/停止。若QuestDB连接失败，返回错误。"""
+        """
+        触发全量更新：可暂停/继续/停止。若QuestDB连接失败，返回错误。
+        resume=true 续跑最近一次未完成的全量更新（或 resume=<run_id> 指定运行），只处理尚未成功的代码。
+        """
+        data = request.data or {}
+        resume = data.get('resume') or request.query_params.get('resume')
+        if isinstance(resume, str) and resume.strip().lower() in ('', '0', 'false', 'no'):
+            resume = None
+        resume_run = None
         # 在启动线程前快速检查QuestDB连接，失败则直接返回错误
         try:
             import sys
@@ -542,18 +981,31 @@ class UpdateFullView(APIView):
             if not test_conn:
                 return Response({'started': False, 'error': 'QuestDB连接失败'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
             try:
-                test_conn.close()
-            except Exception:
-                pass
+                if resume:
+                    from .tasks.runs import get_run, latest_run, run_summary
+                    if isinstance(resume, str) and resume.strip().lower() not in ('1', 'true', 'yes', 'latest'):
+                        resume_run = get_run(test_conn, resume.strip())
+                    else:
+                        resume_run = latest_run(test_conn, 'full')
+                    active = _update_ctrl['state']['run_id'] if _update_ctrl['state']['running'] else None
+                    if resume_run is None or not run_summary(test_conn, resume_run, active_run_id=active)['resumable']:
+                        return Response({'started': False, 'error': '没有可续跑的全量更新'}, status=status.HTTP_404_NOT_FOUND)
+            finally:
+                try:
+                    test_conn.close()
+                except Exception:
+                    pass
         except Exception as e:
             return Response({'started': False, 'error': f'QuestDB连接失败: {str(e)}'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-        started = _start_full_update_thread()
+        started = _start_full_update_thread(resume_run=resume_run)
         return Response({
             'started': started,
             'started_at': _update_ctrl['state']['started_at'],
             'total_codes': _update_ctrl['state']['total_codes'],
-            'note': '后台执行 akshare 全量更新（日线，可暂停/继续/停止）'
+            'run_id': _update_ctrl['state']['run_id'],
+            'resumed': _update_ctrl['state']['resumed'],
+            'note': '后台执行 akshare 全量更新（日线，可暂停/继续/停止/续跑）'
         })
 
 class UpdatePauseView(APIView):
@@ -570,591 +1022,23 @@ class UpdateResumeView(APIView):
             _update_ctrl['state']['paused'] = False
         return Response({'running': _update_ctrl['state']['running'], 'paused': _update_ctrl['state']['paused']})
 
-class UpdateStopView(APIView):
-    def post(self, request):
-        """停止全量更新（设置停止标记，线程将尽快退出）。"""
-        if _update_ctrl['state']['running']:
-            _update_ctrl['stop_event'].set()
-        return Response({'running': _update_ctrl['state']['running'], 'stopped': _update_ctrl['state']['stopped']})
-
-# 队列更新 API：从任务列表取任务执行
-class QueueUpdateStartView(APIView):
-    def post(self, request):
-        # 启动前检查 QuestDB
-        try:
-            import sys
-            project_root = Path(settings.BASE_DIR).parent
-            if str(project_root) not in sys.path:
-                sys.path.append(str(project_root))
-            from data_pipeline.collector import qdb_connect
-            test_conn = qdb_connect()
-            if not test_conn:
-                return Response({'started': False, 'error': 'QuestDB连接失败'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-            try:
-                test_conn.close()
-            except Exception:
-                pass
-        except Exception as e:
-            return Response({'started': False, 'error': f'QuestDB连接失败: {str(e)}'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-        started = _start_queue_update_thread()
-        return Response({
-            'started': started,
-            'started_at': _queue_ctrl['state']['started_at'],
-            'total_codes': _queue_ctrl['state']['total_codes'],
-            'note': '后台执行 任务队列更新（仅消费待处理任务，可暂停/继续/停止）'
-        })
-
-class QueueUpdatePauseView(APIView):
-    def post(self, request):
-        if _queue_ctrl['state']['running'] and not _queue_ctrl['state']['paused']:
-            _queue_ctrl['state']['paused'] = True
-        return Response({'running': _queue_ctrl['state']['running'], 'paused': _queue_ctrl['state']['paused']})
-
-class QueueUpdateResumeView(APIView):
-    def post(self, request):
-        if _queue_ctrl['state']['running'] and _queue_ctrl['state']['paused']:
-            _queue_ctrl['state']['paused'] = False
-        return Response({'running': _queue_ctrl['state']['running'], 'paused': _queue_ctrl['state']['paused']})
-
-class QueueUpdateStopView(APIView):
-    def post(self, request):
-        if _queue_ctrl['state']['running']:
-            _queue_ctrl['stop_event'].set()
-        return Response({'running': _queue_ctrl['state']['running'], 'stopped': _queue_ctrl['state']['stopped']})
-
-class QuotePlaceholderView(APIView):
-    def get(self, request):
-        code = request.query_params.get('code', 'TEST')
-        return Response({
-            'code': code,
-            'quotes': [
-                {'timestamp': '2024-01-01 09:30', 'open_price': 10.0, 'close_price': 10.5, 'high_price': 10.6, 'low_price': 9.9, 'volume': 1000},
-                {'timestamp': '2024-01-01 09:31', 'open_price': 10.5, 'close_price': 10.4, 'high_price': 10.7, 'low_price': 10.3, 'volume': 800},
-            ]
-        })
-
-class DataStatusView(APIView):
-    def get(self, request):
-        # 读取筛选参数
-        market = request.query_params.get('market')
-        finance_start = request.query_params.get('finance_start')
-        finance_end = request.query_params.get('finance_end')
-
-        import os
-        import psycopg2
-        from psycopg2 import OperationalError
-        from django.db.models import Count, Max
-
-        host = os.getenv('QDB_HOST', 'localhost')
-        port = int(os.getenv('QDB_PORT', '8812'))
-        user = os.getenv('QDB_USER', 'admin')
-        password = os.getenv('QDB_PASS', 'quest')
-        dbname = os.getenv('QDB_DB', 'qdb')
-
-        overview = {}
-        markets = []
-        listing_range = {}
-        trends = []
-
-        # 本地函数：根据market构造代码前缀过滤
-        def market_prefixes(m):
-            m = (m or '').upper()
-            if m == 'SH':
-                return ['600', '601', '603', '605', '688']
-            if m == 'SZ':
-                return ['000', '001', '002', '300', '301']
-            if m == 'BJ':
-                return ['430', '83', '87']
-            return []
-
-        # 本地函数：根据代码推断市场
-        def infer_market(code):
-            s = str(code or '').strip()
-            if s.startswith(('600', '601', '603', '605', '688')):
-                return 'SH'
-            if s.startswith(('000', '001', '002', '300', '301')):
-                return 'SZ'
-            if s.startswith(('430', '83', '87')):
-                return 'BJ'
-            return 'SZ'
-
-        try:
-            conn = psycopg2.connect(host=host, port=port, user=user, password=password, dbname=dbname, connect_timeout=2)
-            conn.autocommit = True
-            cur = conn.cursor()
-            # 基础股票筛选
-            where = []
-            params = []
-            # market过滤转化为code前缀过滤
-            if market:
-                prefs = market_prefixes(market)
-                if prefs:
-                    ors = []
-                    for p in prefs:
-                        params.append(p + '%')
-                        ors.append(f"code like ${len(params)}")
-                    where.append('(' + ' or '.join(ors) + ')')
-            where_sql = (' where ' + ' and '.join(where)) if where else ''
-
-            # 总览
-            try:
-                cur.execute('select count(*) from stock_basic' + where_sql, tuple(params))
-                stock_basic_count = int((cur.fetchone() or [0])[0])
-            except Exception:
-                stock_basic_count = 0
-            overview = {
-                'stock_basic_count': stock_basic_count,
-                'finance_count': 0,
-                'follow_count': 0,
-                'latest_finance_date': None,
-            }
-
-            # 市场分布（通过code推断，不再使用industry或market列）
-            try:
-                cur.execute('select code from stock_basic' + where_sql, tuple(params))
-                rows = cur.fetchall() or []
-                cnts = {'SH': 0, 'SZ': 0, 'BJ': 0}
-                for r in rows:
-                    mkt = infer_market(r[0])
-                    if mkt in cnts:
-                        cnts[mkt] += 1
-                markets = [{'market': k, 'count': v} for k, v in cnts.items() if v > 0]
-            except Exception:
-                markets = []
-
-            # 上市日期范围（基于过滤条件）
-            try:
-                cur.execute('select min(listing_date), max(listing_date) from stock_basic' + where_sql, tuple(params))
-                r = cur.fetchone() or [None, None]
-                listing_range = {'min': r[0], 'max': r[1]}
-            except Exception:
-                listing_range = {'min': None, 'max': None}
-
-            conn.close()
-        except Exception:
-            pass
+def _cancel_source_calls(other_ctrl):
+  """停止时终止正在隔离子进程中执行的数据源调用（另一个更新线程仍在运行时不取消，避免误伤）。"""
+  if other_ctrl['state']['running']:
+    return 0
+  try:
+    from data_pipeline.source_isolation import cancel_all
+    return cancel_all()
+  except Exception:
+    return 0
 
-        return Response({
-            'overview': overview,
-            'markets': markets,
-            'listing_range': listing_range,
-            'backup': {
-                'db_path': 'QuestDB',
-                'size_bytes': None,
-                'last_modified': None,
-                'health_score': 100,
-            },
-            'trends': trends,
-        })
-
-
-import threading
-import time
-
-_update_ctrl = {
-  'thread': None,
-  'stop_event': threading.Event(),
-  'state': {
-    'running': False,
-    'paused': False,
-    'stopped': False,
-    'updated_count': 0,
-    'total_codes': 0,
-    'current_code': None,
-    'started_at': None,
-    'ended_at': None,
-  }
-}
-
-# 队列更新独立控制器
-_queue_ctrl = {
-  'thread': None,
-  'stop_event': threading.Event(),
-  'state': {
-    'running': False,
-    'paused': False,
-    'stopped': False,
-    'updated_count': 0,
-    'total_codes': 0,
-    'current_code': None,
-    'started_at': None,
-    'ended_at': None,
-  }
-}
-
-def _start_full_update_thread():
-  if _update_ctrl['thread'] and _update_ctrl['state']['running']:
-    return False
-  _update_ctrl['stop_event'].clear()
-  _update_ctrl['state'].update({
-    'running': True,
-    'paused': False,
-    'stopped': False,
-    'updated_count': 0,
-    'total_codes': 0,
-    'current_code': None,
-    'started_at': timezone.now(),
-    'ended_at': None,
-  })
-  
-  def worker():
-    try:
-      import sys
-      project_root = Path(settings.BASE_DIR).parent
-      if str(project_root) not in sys.path:
-        sys.path.append(str(project_root))
-      from data_pipeline.collector import qdb_connect, populate_stock_basic_if_empty, qdb_get_all_basic, sync_basic_to_django
-      conn = qdb_connect()
-      
-      if not conn:
-        _update_ctrl['state']['error'] = 'QuestDB连接失败'
-        raise RuntimeError('QuestDB连接失败')
-      
-      populate_stock_basic_if_empty(conn=conn)
-      sync_basic_to_django(conn=conn)
-      basics = qdb_get_all_basic(conn=conn)
-      _update_ctrl['state']['total_codes'] = len(basics)
-      from .tasks import DownloadDailyTask, QdbOrm
-      orm = QdbOrm(conn)
-      task = DownloadDailyTask(orm)
-      for item in basics:
-        code = item.get('code')
-        market = item.get('market')
-        listing_date = item.get('listing_date')
-        if not listing_date:
-          start_date = '19841118'
-        else:
-          try:
-            if hasattr(listing_date, 'strftime'):
-              start_date = listing_date.strftime("%Y%m%d")
-            else:
-              s = str(listing_date)
-              start_date = s.replace('-', '')
-          except Exception:
-            start_date = '19841118'
-        if not code:
-          continue
-        task.generate("download_daily", f"Download daily data for {code}", {"code": code, "start_date": start_date, "end_date": timezone.now().strftime("%Y%m%d"), "market": market ,"adjust": "all"}, priority=0)
-      dl_daily = orm.list_tasks(status="待处理", task_type="download_daily", limit=100000)
-      for item in dl_daily:
-        if _update_ctrl['stop_event'].is_set():
-          break
-        while _update_ctrl['state']['paused']:
-          if _update_ctrl['stop_event'].is_set():
-            break
-          time.sleep(0.2)
-        if _update_ctrl['stop_event'].is_set():
-          break
-        try:
-          import json
-          params = json.loads(item.get('task_params') or '{}')
-        except Exception:
-          params = {}
-        code = params.get('code')
-        _update_ctrl['state']['current_code'] = code
-        t = DownloadDailyTask(orm)
-        t.task_id = item.get('task_id')
-        t.task_type = item.get('task_type')
-        t.task_desc = item.get('task_desc')
-        t.params_str = item.get('task_params') or '{}'
-        t.priority = item.get('priority') or 0
-        try:
-          orm.update_task_status(t.task_id, "处理中")
-        except Exception:
-          pass
-        try:
-          ok = t.run(conn=conn)
-        except Exception:
-          ok = False
-        try:
-          orm.update_task_status(t.task_id, "成功" if ok else "失败")
-        except Exception:
-          pass
-        _update_ctrl['state']['updated_count'] += 1
-        time.sleep(0.01)
-      try:
-        conn.close()
-      except Exception:
-        pass
-    finally:
-      _update_ctrl['state']['running'] = False
-      _update_ctrl['state']['stopped'] = _update_ctrl['stop_event'].is_set()
-      _update_ctrl['state']['ended_at'] = timezone.now()
-      _update_ctrl['thread'] = None
-  t = threading.Thread(target=worker, daemon=True)
-  _update_ctrl['thread'] = t
-  t.start()
-  return True
-
-# 队列更新：从任务列表中取任务并执行
-
-def _start_queue_update_thread():
-  if _queue_ctrl['thread'] and _queue_ctrl['state']['running']:
-    return False
-  _queue_ctrl['stop_event'].clear()
-  _queue_ctrl['state'].update({
-    'running': True,
-    'paused': False,
-    'stopped': False,
-    'updated_count': 0,
-    'total_codes': 0,
-    'current_code': None,
-    'started_at': timezone.now(),
-    'ended_at': None,
-  })
-
-  def worker():
-    try:
-      import sys
-      project_root = Path(settings.BASE_DIR).parent
-      if str(project_root) not in sys.path:
-        sys.path.append(str(project_root))
-      from data_pipeline.collector import qdb_connect
-      from .tasks import DownloadDailyTask, QdbOrm
-      conn = qdb_connect()
-      orm = QdbOrm(conn)
-      # 预估待处理总数
-      pending = orm.list_tasks(status="待处理", limit=100000)
-      _queue_ctrl['state']['total_codes'] = len(pending)
-      # 按优先级逐个处理
-      idx = 0
-      while not _queue_ctrl['stop_event'].is_set():
-        while _queue_ctrl['state']['paused']:
-          if _queue_ctrl['stop_event'].is_set():
-            break
-          time.sleep(0.2)
-        if _queue_ctrl['stop_event'].is_set():
-          break
-        # 取下一个待处理任务
-        item = orm.next_pending_task()
-        if not item:
-          break
-        tid = item.get('task_id')
-        try:
-          claimed = orm.claim_task(tid)
-        except Exception:
-          claimed = True
-        if not claimed:
-          # 未成功认领，稍后重试
-          time.sleep(0.2)
-          continue
-        # 解析参数，填充当前代码便于前端显示
-        try:
-          import json
-          params = json.loads(item.get('task_params') or '{}')
-        except Exception:
-          params = {}
-        code = params.get('code')
-        if not code and isinstance(params.get('codes'), list) and params.get('codes'):
-          code = params.get('codes')[0]
-        _queue_ctrl['state']['current_code'] = code or item.get('task_type')
-        # 根据类型构造任务，目前支持 download_daily
-        t = DownloadDailyTask(orm)
-        t.task_id = item.get('task_id')
-        t.task_type = item.get('task_type')
-        t.task_desc = item.get('task_desc')
-        t.params_str = item.get('task_params') or '{}'
-        t.priority = item.get('priority') or 0
-        ok = False
-        try:
-          ok = t.run(conn=conn)
-        except Exception:
-          ok = False
-        try:
-          orm.update_task_status(t.task_id, "成功" if ok else "失败")
-        except Exception:
-          pass
-        _queue_ctrl['state']['updated_count'] += 1
-        idx += 1
-        time.sleep(0.01)
-      try:
-        conn.close()
-      except Exception:
-        pass
-    finally:
-      _queue_ctrl['state']['running'] = False
-      _queue_ctrl['state']['stopped'] = _queue_ctrl['stop_event'].is_set()
-      _queue_ctrl['state']['ended_at'] = timezone.now()
-      _queue_ctrl['thread'] = None
-
-  t = threading.Thread(target=worker, daemon=True)
-  _queue_ctrl['thread'] = t
-  t.start()
-  return True
-
-
-class UpdateStatusView(APIView):
-    def get(self, request):
-        """返回数据更新相关状态（QuestDB），不依赖SQLite。"""
-        import os
-        import psycopg2
-        from psycopg2 import OperationalError
-        from datetime import datetime
-
-        # QuestDB 连接参数
-        host = os.getenv('QDB_HOST', 'localhost')
-        port = int(os.getenv('QDB_PORT', '8812'))
-        user = os.getenv('QDB_USER', 'admin')
-        password = os.getenv('QDB_PASS', 'quest')
-        dbname = os.getenv('QDB_DB', 'qdb')
-
-        qdb_ok = False
-        qdb_error = None
-        stock_basic_count = 0
-        finance_count = 0
-        latest_finance_date = None
-        latest_follow_time = None
-        total_codes = 0
-        updated_count = 0
-        recent_updates = []
-
-        try:
-            conn = psycopg2.connect(host=host, port=port, user=user, password=password, dbname=dbname, connect_timeout=2)
-            conn.autocommit = True
-            cur = conn.cursor()
-            qdb_ok = True
-            # 统计基础股票数量
-            try:
-                cur.execute('select count(*) from stock_basic')
-                r = cur.fetchone()
-                stock_basic_count = int((r and r[0]) or 0)
-                total_codes = stock_basic_count
-            except Exception:
-                pass
-            # 已更新股票数量（按日线存在的distinct代码数）
-            try:
-                cur.execute('select count(distinct code) from stock_daily')
-                r = cur.fetchone()
-                updated_count = int((r and r[0]) or 0)
-            except Exception:
-                pass
-            # 最近更新（按最大交易日倒序，取前8）
-            try:
-                cur.execute("""
-                  select d.code, b.name, max(d.trade_date) as last_date
-                  from stock_daily d
-                  left join stock_basic b on d.code=b.code
-                  group by d.code, b.name
-                  order by last_date desc
-                  limit 8
-                """)
-                rows = cur.fetchall() or []
-                recent_updates = [
-                    {
-                        'code': r[0],
-                        'name': r[1],
-                        'last_updated_date': r[2],
-                        'last_run_time': None,
-                    } for r in rows
-                ]
-            except Exception:
-                pass
-            conn.close()
-        except OperationalError as e:
-            qdb_error = str(e)
-        except Exception as e:
-            qdb_error = str(e)
-
-        # 控制器状态（正在运行时优先使用内存中的计数和进度）
-        ctrl = _update_ctrl['state'].copy()
-        if ctrl.get('running'):
-            total_codes = ctrl.get('total_codes') or total_codes
-            updated_count = ctrl.get('updated_count') or updated_count
-
-        # 队列控制器状态
-        queue_ctrl = _queue_ctrl['state'].copy()
-
-        return Response({
-            'stock_basic_count': stock_basic_count,
-            'finance_count': finance_count,
-            'latest_finance_date': latest_finance_date,
-            'latest_follow_time': latest_follow_time,
-            'total_codes': total_codes,
-            'updated_count': updated_count,
-            'recent_updates': recent_updates,
-            'controller': ctrl,
-            'queue_controller': queue_ctrl,
-            'questdb': {
-                'host': host,
-                'port': port,
-                'user': user,
-                'dbname': dbname,
-                'connected': qdb_ok,
-                'error': qdb_error,
-            }
-        })
-
-class UpdateRunView(APIView):
-    def post(self, request):
-        """触发一次数据更新（占位）：在后台线程执行采集脚本的run_once。"""
-        import threading
-        import time
-        import sys
-        from datetime import datetime
-
-        def task():
-            try:
-                project_root = Path(settings.BASE_DIR).parent
-                if str(project_root) not in sys.path:
-                    sys.path.append(str(project_root))
-                from data_pipeline.collector import run_once
-            except Exception:
-                pass
-
-        threading.Thread(target=task, daemon=True).start()
-        return Response({
-            'started': True,
-            'started_at': timezone.now(),
-            'note': '后台执行 data_pipeline.collector.run_once(TEST)（占位）'
-        })
-
-class UpdateFullView(APIView):
-    def post(self, request):
-        """触发全量更新：可暂停/继续/停止。若QuestDB连接失败，返回错误。"""
-        # 在启动线程前快速检查QuestDB连接，失败则直接返回错误
-        try:
-            import sys
-            project_root = Path(settings.BASE_DIR).parent
-            if str(project_root) not in sys.path:
-                sys.path.append(str(project_root))
-            from data_pipeline.collector import qdb_connect
-            test_conn = qdb_connect()
-            if not test_conn:
-                return Response({'started': False, 'error': 'QuestDB连接失败'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-            try:
-                test_conn.close()
-            except Exception:
-                pass
-        except Exception as e:
-            return Response({'started': False, 'error': f'QuestDB连接失败: {str(e)}'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-
-        started = _start_full_update_thread()
-        return Response({
-            'started': started,
-            'started_at': _update_ctrl['state']['started_at'],
-            'total_codes': _update_ctrl['state']['total_codes'],
-            'note': '后台执行 akshare 全量更新（日线，可暂停/继续/停止）'
-        })
-
-class UpdatePauseView(APIView):
-    def post(self, request):
-        """暂停当前全量更新。"""
-        if _update_ctrl['state']['running'] and not _update_ctrl['state']['paused']:
-            _update_ctrl['state']['paused'] = True
-        return Response({'running': _update_ctrl['state']['running'], 'paused': _update_ctrl['state']['paused']})
-
-class UpdateResumeView(APIView):
-    def post(self, request):
-        """继续当前全量更新。"""
-        if _update_ctrl['state']['running'] and _update_ctrl['state']['paused']:
-            _update_ctrl['state']['paused'] = False
-        return Response({'running': _update_ctrl['state']['running'], 'paused': _update_ctrl['state']['paused']})
 
 class UpdateStopView(APIView):
     def post(self, request):
-        """停止全量更新（设置停止标记，线程将尽快退出）。"""
+        """停止全量更新（设置停止标记，线程将尽快退出；开启 SOURCE_ISOLATION 时同时终止进行中的数据源调用）。"""
         if _update_ctrl['state']['running']:
             _update_ctrl['stop_event'].set()
+            _cancel_source_calls(_queue_ctrl)
         return Response({'running': _update_ctrl['state']['running'], 'stopped': _update_ctrl['state']['stopped']})
 
 # 队列更新 API：从任务列表取任务执行
@@ -1200,6 +1084,7 @@ class QueueUpdateStopView(APIView):
     def post(self, request):
         if _queue_ctrl['state']['running']:
             _queue_ctrl['stop_event'].set()
+            _cancel_source_calls(_update_ctrl)
         return Response({'running': _queue_ctrl['state']['running'], 'stopped': _queue_ctrl['state']['stopped']})
 
 class QuotePlaceholderView(APIView):
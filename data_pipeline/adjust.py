@@ -0,0 +1,97 @@
+"""
+复权因子：入库行转换与本地复权计算（向量化）。
+
+adjust="all" 原先对每只股票拉取三次完整日线（不复权 / 前复权 / 后复权）并各存一份。
+现在只存不复权日线 + 后复权因子表 adj_factor（每个除权日一行），前/后复权价格按需计算：
+  - 后复权：price × hfq_factor(asof 交易日)
+  - 前复权：price × hfq_factor(asof 交易日) / 最新 hfq_factor
+前复权的基准随每次除权整体变化，但后复权因子的历史值不变，
+因此分红送转后只需重新拉取因子表（几十行），无需重拉整段日线。
+成交量等非价格字段不做调整（与 ak.stock_zh_a_daily 的 qfq/hfq 输出一致）。
+"""
+from datetime import date
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+
+
+# 因子下载在任务中作为一个特殊的 adjust 单元（ak.stock_zh_a_daily 的 adjust 参数取值）
+FACTOR_ADJUST = 'hfq-factor'
+
+# adj_factor 的插入列顺序
+FACTOR_INSERT_COLUMNS = ('code', 'ex_date', 'hfq_factor')
+
+PRICE_FIELDS = ('open', 'close', 'high', 'low')
+
+_MIN_EX_DATE = pd.Timestamp('1970-01-01') if pd is not None else None
+
+
+class FactorRows(NamedTuple):
+    """因子转换结果：values 为插入元组列表，latest_date 为最近除权日。"""
+    values: List[tuple]
+    latest_date: Optional[date]
+
+
+def normalize_factor_frame(df):
+    """ak.stock_zh_a_daily(adjust='hfq-factor') → DataFrame[ex_date(datetime64), hfq_factor(float64)]，按日期升序去重。"""
+    if df is None or getattr(df, 'empty', True):
+        return None
+    if 'date' not in df.columns or 'hfq_factor' not in df.columns:
+        return None
+    out = pd.DataFrame({
+        'ex_date': pd.to_datetime(df['date'], errors='coerce', format='mixed'),
+        'hfq_factor': pd.to_numeric(df['hfq_factor'], errors='coerce').astype('float64'),
+    })
+    out = out[out['ex_date'].notna() & out['hfq_factor'].notna() & (out['hfq_factor'] > 0)]
+    # 因子表首行为基准日（如 1900-01-01），QuestDB 指定时间戳不能早于 1970-01-01
+    out = out.assign(ex_date=out['ex_date'].clip(lower=_MIN_EX_DATE))
+    return out.drop_duplicates('ex_date', keep='last').sort_values('ex_date', kind='stable').reset_index(drop=True)
+
+
+def factor_rows(code: str, df) -> FactorRows:
+    """将因子 DataFrame 转换为 adj_factor 插入元组，顺序见 FACTOR_INSERT_COLUMNS。"""
+    frame = normalize_factor_frame(df)
+    if frame is None or frame.empty:
+        return FactorRows([], None)
+    ex_dates = frame['ex_date'].dt.date.to_numpy(dtype=object)
+    factors = frame['hfq_factor'].to_numpy(dtype=object)
+    values = list(zip([code] * len(frame), ex_dates, factors))
+    return FactorRows(values, ex_dates[-1])
+
+
+def factor_frame(rows) -> Optional['pd.DataFrame']:
+    """从数据库读取的 (ex_date, hfq_factor) 行构造因子 DataFrame。"""
+    if not rows:
+        return None
+    df = pd.DataFrame(list(rows), columns=['date', 'hfq_factor'])
+    return normalize_factor_frame(df)
+
+
+def apply_adjust(bars, factors, adj: str):
+    """
+    对不复权日线按因子复权，返回新 DataFrame（不修改入参）。
+      - bars: 至少包含 trade_date 与 open/close/high/low 列（trade_date 可为 date/datetime/字符串）
+      - factors: normalize_factor_frame 的结果
+      - adj: 'qfq' / 'hfq'；其它值原样返回
+    首个除权日之前的交易日使用首个因子（因子表首行通常即上市基准日，值为 1）。
+    """
+    if adj not in ('qfq', 'hfq') or bars is None or len(bars) == 0 or factors is None or factors.empty:
+        return bars
+    out = bars.copy()
+    keys = pd.to_datetime(out['trade_date'], errors='coerce', format='mixed')
+    fac = factors['hfq_factor'].to_numpy(dtype='float64')
+    ex = factors['ex_date'].to_numpy(dtype='datetime64[ns]')
+    # 向后 asof：每个交易日取不晚于它的最近除权日因子
+    idx = np.searchsorted(ex, keys.to_numpy(dtype='datetime64[ns]'), side='right') - 1
+    f = fac[np.clip(idx, 0, len(fac) - 1)]
+    if adj == 'qfq':
+        f = f / fac[-1]
+    for name in PRICE_FIELDS:
+        if name in out.columns:
+            out[name] = pd.to_numeric(out[name], errors='coerce').astype('float64') * f
+    return out
@@ -0,0 +1,110 @@
+"""
+ILP 写入器基准与本地替身服务器。
+
+用法（无需 QuestDB）：
+    python data_pipeline/bench_ilp.py [--rows 200000] [--protocol tcp|http] [--flush-rows 10000]
+
+IlpStubServer 在本机随机端口上模拟 QuestDB 的 ILP 入口（TCP 行流 / HTTP POST /write），
+只统计收到的行数与字节数，可用于本地联调：
+    server = IlpStubServer('tcp').start()
+    os.environ.update(QDB_WRITER='ilp', QDB_ILP_HOST='127.0.0.1', QDB_ILP_PORT=str(server.port))
+"""
+import argparse
+import os
+import socketserver
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ilp_writer import IlpWriter  # noqa: E402
+
+
+class IlpStubServer:
+    """最简 ILP 替身服务器：统计行数/字节数，不解析内容。"""
+
+    def __init__(self, protocol: str = 'tcp', host: str = '127.0.0.1', port: int = 0) -> None:
+        self.protocol = protocol
+        self.lines = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        if protocol == 'tcp':
+            class Handler(socketserver.StreamRequestHandler):
+                def handle(self):
+                    while True:
+                        chunk = self.rfile.read1(1 << 16)
+                        if not chunk:
+                            break
+                        stub._count(chunk.count(b'\n'), len(chunk))
+        else:
+            class Handler(BaseHTTPRequestHandler):
+                def do_POST(self):
+                    n = int(self.headers.get('Content-Length') or 0)
+                    body = self.rfile.read(n)
+                    stub._count(body.count(b'\n'), len(body))
+                    self.send_response(204)
+                    self.end_headers()
+
+                def log_message(self, *args):
+                    pass
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+
+    def _count(self, lines: int, nbytes: int) -> None:
+        with self._lock:
+            self.lines += lines
+            self.bytes += nbytes
+
+    def start(self) -> 'IlpStubServer':
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait_for(self, lines: int, timeout: float = 30.0) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.lines >= lines:
+                return True
+            time.sleep(0.01)
+        return False
+
+
+def synthetic_values(rows: int):
+    d0 = date(1991, 1, 2)
+    return [
+        ('000001', d0 + timedelta(days=i), 'qfq', 10.0 + i * 1e-3, 10.1, 10.2, 9.9, 100000 + i, 1.0e7, 0.01, 1.2e9)
+        for i in range(rows)
+    ]
+
+
+def main():
+    ap = argparse.ArgumentParser(description='ILP 写入器基准（替身服务器）')
+    ap.add_argument('--rows', type=int, default=200000)
+    ap.add_argument('--protocol', choices=['tcp', 'http'], default='tcp')
+    ap.add_argument('--flush-rows', type=int, default=10000)
+    args = ap.parse_args()
+
+    server = IlpStubServer(args.protocol).start()
+    values = synthetic_values(args.rows)
+    writer = IlpWriter('127.0.0.1', server.port, protocol=args.protocol, auto_flush_rows=args.flush_rows)
+    t0 = time.perf_counter()
+    writer.insert_daily(values)
+    writer.close()
+    ok = server.wait_for(args.rows)
+    dt = time.perf_counter() - t0
+    server.stop()
+    print(f"protocol={args.protocol} rows={args.rows} received={server.lines} complete={ok}")
+    print(f"elapsed {dt * 1000:.1f} ms, {args.rows / dt:,.0f} rows/s, {server.bytes / dt / 1e6:.1f} MB/s, flushes={writer.flushes}")
+
+
+if __name__ == '__main__':
+    main()
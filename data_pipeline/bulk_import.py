@@ -0,0 +1,259 @@
+"""
+历史数据批量导入：CSV / Parquet 导出包 → QuestDB（HTTP /imp 或服务端 COPY）。
+
+新环境冷启动不必经 akshare 限速逐只重拉，可直接导入预先导出的 stock_daily / stock_basic /
+inst_trading_tracker 数据包：
+  1. prepare_file：并行读取源文件、按表结构校验列、统一类型（代码补零、日期 ISO 化、数值转换），
+     丢弃主键列缺失的行，按 chunk_rows 切成规范化 CSV
+  2. import_http：逐个 CSV 以 multipart POST 到 /imp（附带列类型 schema，atomicity=skipRow）
+     import_copy：文件位于服务端 cairo.sql.copy.root 时改用 COPY，轮询 sys.text_import_log 等待完成
+  3. wait_wal_applied：等待 WAL 表全部应用，导入完成即对查询可见
+命令行入口见 backend/stocks/management/commands/qdb_import.py。
+"""
+import http.client
+import json
+import os
+import time
+import uuid
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+
+try:
+    from data_pipeline.daily_frame import DAILY_COLUMNS
+except Exception:
+    from daily_frame import DAILY_COLUMNS
+
+
+# 表结构：列名 → QuestDB 类型（与 collector.qdb_ensure_tables 一致）
+TABLE_SCHEMAS: Dict[str, Dict[str, str]] = {
+    'stock_daily': {
+        'code': 'SYMBOL', 'trade_date': 'TIMESTAMP', 'adjust_type': 'SYMBOL',
+        'open': 'DOUBLE', 'close': 'DOUBLE', 'high': 'DOUBLE', 'low': 'DOUBLE', 'volume': 'LONG',
+        'amount': 'DOUBLE', 'turnover': 'DOUBLE', 'outstanding_share': 'DOUBLE',
+    },
+    'stock_basic': {
+        'code': 'SYMBOL', 'name': 'STRING', 'company_name': 'STRING', 'market': 'SYMBOL', 'listing_date': 'DATE',
+    },
+    'inst_trading_tracker': {
+        'ingest_date': 'DATE', 'code': 'SYMBOL', 'name': 'STRING',
+        'buy_amount': 'DOUBLE', 'buy_times': 'INT', 'sell_amount': 'DOUBLE', 'sell_times': 'INT',
+        'net_amount': 'DOUBLE', 'query_type': 'INT',
+    },
+}
+
+# 必须非空的列（缺失的行丢弃）
+REQUIRED_COLUMNS = {
+    'stock_daily': ('code', 'trade_date'),
+    'stock_basic': ('code',),
+    'inst_trading_tracker': ('ingest_date', 'code'),
+}
+
+# 指定时间戳列（COPY 需要）
+TIMESTAMP_COLUMNS = {'stock_daily': 'trade_date'}
+
+# 常见别名 → 表列名（含 akshare 中文列名）
+_ALIASES = dict(DAILY_COLUMNS, date='trade_date', 日期='trade_date', adjust='adjust_type', symbol='code', 代码='code', 名称='name')
+
+_DATE_FORMAT = 'yyyy-MM-dd'
+
+
+class PreparedFile(NamedTuple):
+    source: str
+    table: str
+    rows: int
+    dropped: int
+    outputs: List[str]
+    errors: List[str]
+
+
+class ImportResult(NamedTuple):
+    path: str
+    table: str
+    imported: int
+    rejected: int
+    elapsed: float
+    error: Optional[str] = None
+
+
+def infer_table(path: str) -> Optional[str]:
+    """按文件名前缀推断目标表，如 stock_daily_2020.parquet → stock_daily。"""
+    name = os.path.basename(path).lower()
+    for table in sorted(TABLE_SCHEMAS, key=len, reverse=True):
+        if name.startswith(table):
+            return table
+    return None
+
+
+def discover(paths: Sequence[str]) -> List[str]:
+    """展开目录，返回支持的文件（.csv / .csv.gz / .parquet），按文件名排序。"""
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            for dirpath, _, files in os.walk(p):
+                out.extend(os.path.join(dirpath, f) for f in files)
+        else:
+            out.append(p)
+    return sorted(f for f in out if f.lower().endswith(('.csv', '.csv.gz', '.parquet')))
+
+
+def _read(path: str):
+    if path.lower().endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, dtype={'code': str, '代码': str, 'symbol': str}, low_memory=False)
+
+
+def normalize_frame(df, table: str):
+    """
+    按表结构规范化 DataFrame，返回 (frame, dropped, errors)。
+    缺少必需列时 frame 为 None；多余列忽略，缺少的可选列填空。
+    """
+    schema = TABLE_SCHEMAS[table]
+    df = df.rename(columns={c: _ALIASES.get(c, c) for c in df.columns})
+    missing = [c for c in REQUIRED_COLUMNS[table] if c not in df.columns]
+    if missing:
+        return None, len(df), [f'缺少必需列: {missing}']
+    errors = []
+    out = pd.DataFrame(index=df.index)
+    for col, typ in schema.items():
+        if col not in df.columns:
+            out[col] = None
+            continue
+        s = df[col]
+        if col == 'code':
+            s = s.astype(str).str.strip().str.replace(r'^(sh|sz|bj)', '', regex=True).str.zfill(6)
+            out[col] = s.where(s.str.fullmatch(r'\d{6}'))
+        elif typ in ('TIMESTAMP', 'DATE'):
+            out[col] = pd.to_datetime(s, errors='coerce', format='mixed').dt.strftime('%Y-%m-%d')
+        elif typ == 'DOUBLE':
+            out[col] = pd.to_numeric(s, errors='coerce')
+        elif typ in ('LONG', 'INT'):
+            out[col] = pd.to_numeric(s, errors='coerce').round().astype('Int64')
+        else:
+            out[col] = s.astype('string').str.strip().replace('', pd.NA)
+    if 'adjust_type' in out.columns:
+        out['adjust_type'] = out['adjust_type'].where(out['adjust_type'].isin(['qfq', 'hfq']))
+    mask = out[list(REQUIRED_COLUMNS[table])].notna().all(axis=1)
+    dropped = int((~mask).sum())
+    if dropped:
+        errors.append(f'{dropped} 行主键列缺失或无法解析，已丢弃')
+    return out[mask], dropped, errors
+
+
+def prepare_file(path: str, table: str, out_dir: str, chunk_rows: int = 1_000_000) -> PreparedFile:
+    """读取并规范化单个源文件，写出若干规范化 CSV（供进程池并行调用）。"""
+    try:
+        df = _read(path)
+    except Exception as e:
+        return PreparedFile(path, table, 0, 0, [], [f'读取失败: {e}'])
+    frame, dropped, errors = normalize_frame(df, table)
+    del df
+    if frame is None:
+        return PreparedFile(path, table, 0, dropped, [], errors)
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.basename(path).split('.')[0]
+    outputs = []
+    for i in range(0, len(frame), max(1, chunk_rows)):
+        out = os.path.join(out_dir, f'{table}-{stem}-{i // max(1, chunk_rows):04d}-{uuid.uuid4().hex[:8]}.csv')
+        frame.iloc[i:i + chunk_rows].to_csv(out, index=False)
+        outputs.append(out)
+    return PreparedFile(path, table, len(frame), dropped, outputs, errors)
+
+
+def _import_schema(table: str) -> str:
+    cols = []
+    for col, typ in TABLE_SCHEMAS[table].items():
+        c = {'name': col, 'type': typ}
+        if typ in ('TIMESTAMP', 'DATE'):
+            c['pattern'] = _DATE_FORMAT
+        cols.append(c)
+    return json.dumps(cols)
+
+
+def import_http(path: str, table: str, host: str = 'localhost', port: int = 9000, timeout: float = 600.0) -> ImportResult:
+    """以 HTTP /imp 导入一个规范化 CSV。坏行跳过（atomicity=skipRow）并计入 rejected。"""
+    t0 = time.perf_counter()
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as f:
+        data = f.read()
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="schema"\r\n\r\n{_import_schema(table)}\r\n'.encode('utf-8'),
+        f'--{boundary}\r\nContent-Disposition: form-data; name="data"; filename="{table}.csv"\r\n'
+        f'Content-Type: text/csv\r\n\r\n'.encode('utf-8'),
+        data,
+        f'\r\n--{boundary}--\r\n'.encode('utf-8'),
+    ]
+    body = b''.join(parts)
+    query = f'/imp?name={table}&fmt=json&overwrite=false&atomicity=skipRow&forceHeader=true'
+    ts = TIMESTAMP_COLUMNS.get(table)
+    if ts:
+        query += f'&timestamp={ts}&partitionBy=YEAR'
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request('POST', query, body=body, headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        resp = conn.getresponse()
+        text = resp.read().decode('utf-8', 'replace')
+    except Exception as e:
+        return ImportResult(path, table, 0, 0, time.perf_counter() - t0, f'HTTP 导入失败: {e}')
+    finally:
+        conn.close()
+    if resp.status != 200:
+        return ImportResult(path, table, 0, 0, time.perf_counter() - t0, f'HTTP {resp.status}: {text[:500]}')
+    try:
+        res = json.loads(text)
+    except Exception:
+        return ImportResult(path, table, 0, 0, time.perf_counter() - t0, f'无法解析响应: {text[:500]}')
+    if res.get('status') not in (None, 'OK'):
+        return ImportResult(path, table, 0, 0, time.perf_counter() - t0, str(res.get('status')))
+    return ImportResult(path, table, int(res.get('rowsImported') or 0), int(res.get('rowsRejected') or 0), time.perf_counter() - t0)
+
+
+def import_copy(conn, relpath: str, table: str, poll: float = 1.0, timeout: float = 3600.0) -> ImportResult:
+    """
+    服务端 COPY 导入（文件须位于服务端 cairo.sql.copy.root 下，relpath 为相对路径）。
+    COPY 为异步执行，轮询 sys.text_import_log 直到完成。
+    """
+    t0 = time.perf_counter()
+    cur = conn.cursor()
+    ts = TIMESTAMP_COLUMNS.get(table)
+    opts = "HEADER true DELIMITER ',' ON ERROR SKIP_ROW"
+    if ts:
+        opts += f" TIMESTAMP '{ts}' FORMAT '{_DATE_FORMAT}'"
+    relpath = relpath.replace("'", "''")
+    cur.execute(f"copy {table} from '{relpath}' with {opts}")
+    row = cur.fetchone()
+    import_id = row[0] if row else None
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        cur.execute(
+            "select status, rows_handled, rows_imported, errors from sys.text_import_log "
+            "where id = %s order by ts desc limit 1",
+            (import_id,),
+        )
+        r = cur.fetchone()
+        if r and r[0] in ('finished', 'failed', 'cancelled'):
+            handled, imported = int(r[1] or 0), int(r[2] or 0)
+            err = None if r[0] == 'finished' else f'COPY {r[0]}: errors={r[3]}'
+            return ImportResult(relpath, table, imported, max(0, handled - imported), time.perf_counter() - t0, err)
+        time.sleep(poll)
+    return ImportResult(relpath, table, 0, 0, time.perf_counter() - t0, 'COPY 超时')
+
+
+def wait_wal_applied(conn, tables: Sequence[str], timeout: float = 600.0, poll: float = 0.5) -> bool:
+    """等待 WAL 表的已提交事务全部应用（writerTxn >= sequencerTxn），之后导入的数据对查询可见。"""
+    cur = conn.cursor()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            cur.execute('select name, writerTxn, sequencerTxn from wal_tables()')
+            rows = {r[0]: (r[1], r[2]) for r in cur.fetchall() or []}
+        except Exception:
+            return True
+        pending = [t for t in tables if t in rows and (rows[t][0] or 0) < (rows[t][1] or 0)]
+        if not pending:
+            return True
+        time.sleep(poll)
+    return False
@@ -0,0 +1,226 @@
+"""
+PG wire 批量写入层：多行 VALUES 语句 + 自适应批大小 + 批内错误隔离。
+
+psycopg2 的 `executemany` 会逐行发送 INSERT，且原先各插入函数在任一行出错时整批返回 0。
+BulkWriter 将行打包为 `insert into t (...) values (...),(...),...` 单条语句（同 execute_values），
+并且：
+  - 按实测往返耗时自适应调整批大小（目标耗时附近翻倍/减半，按表记忆调优结果）
+  - 某批失败时二分定位坏行，只拒绝坏行，其余照常写入
+  - 连接级错误（连接断开/不可用）不做二分，直接抛出 BulkWriteConnectionError，由调用方处理
+  - 返回 WriteReport：写入行数、拒绝行数、总耗时与每批统计
+
+QuestDB 的 PG wire 不支持 `COPY ... FROM STDIN`，因此这里使用多行 VALUES；
+大批量离线导入请走 ILP（见 ilp_writer）或服务端 COPY。
+"""
+import logging
+import os
+import threading
+import time
+from typing import List, NamedTuple, Optional, Sequence
+
+try:
+    import psycopg2
+    from psycopg2 import extras as pg_extras
+except Exception:
+    psycopg2 = None
+    pg_extras = None
+
+logger = logging.getLogger(__name__)
+
+
+class BulkWriteConnectionError(Exception):
+    """
+    数据库连接不可用或在写入过程中断开。
+    report 为断开前已完成部分的统计，remaining 为尚未确认写入的行（从出错批次起）。
+    """
+
+    def __init__(self, message: str, report: Optional['WriteReport'] = None, remaining: Sequence[tuple] = ()) -> None:
+        super().__init__(message)
+        self.report = report
+        self.remaining = remaining
+
+
+class BatchStat(NamedTuple):
+    rows: int
+    written: int
+    rejected: int
+    elapsed: float
+
+
+class WriteReport:
+    """
+    一次 write() 的结果汇总。spooled 为数据库不可用时转存到本地 spool、待回放的行数（见 spool）。
+    rejected_rows 为全部未写入的行（调用方据此隔离坏行或撤销），rejected_samples 只保留前 20 行用于日志。
+    """
+
+    __slots__ = ('table', 'written', 'rejected', 'spooled', 'elapsed', 'batches', 'rejected_samples', 'rejected_rows', 'errors')
+
+    def __init__(self, table: str) -> None:
+        self.table = table
+        self.written = 0
+        self.rejected = 0
+        self.spooled = 0
+        self.elapsed = 0.0
+        self.batches: List[BatchStat] = []
+        self.rejected_samples: List[tuple] = []
+        self.rejected_rows: List[tuple] = []
+        self.errors: List[str] = []
+
+    def merge(self, other: 'WriteReport') -> 'WriteReport':
+        self.written += other.written
+        self.rejected += other.rejected
+        self.spooled += other.spooled
+        self.elapsed += other.elapsed
+        self.batches.extend(other.batches)
+        self.rejected_samples.extend(other.rejected_samples[: max(0, 20 - len(self.rejected_samples))])
+        self.rejected_rows.extend(other.rejected_rows)
+        self.errors.extend(other.errors[: max(0, 20 - len(self.errors))])
+        return self
+
+    def summary(self) -> str:
+        per_batch = ', '.join(f"{b.rows}r/{b.elapsed * 1000:.0f}ms" for b in self.batches[:10])
+        more = ' ...' if len(self.batches) > 10 else ''
+        spooled = f" spooled={self.spooled}" if self.spooled else ''
+        return (
+            f"{self.table}: written={self.written} rejected={self.rejected}{spooled} "
+            f"elapsed={self.elapsed * 1000:.0f}ms batches=[{per_batch}{more}]"
+        )
+
+    def __repr__(self) -> str:
+        return f"<WriteReport {self.summary()}>"
+
+
+# 按表记忆自适应后的批大小，跨调用复用
+_tuned_batch = {}
+_tuned_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except Exception:
+        return default
+
+
+def _is_connection_error(conn, exc: Exception) -> bool:
+    if getattr(conn, 'closed', 0):
+        return True
+    if psycopg2 is None:
+        return False
+    if isinstance(exc, psycopg2.InterfaceError):
+        return True
+    if isinstance(exc, psycopg2.OperationalError):
+        # 服务端返回的错误带 SQLSTATE；连接丢失时 pgcode 为空或属于 08 类
+        code = getattr(exc, 'pgcode', None)
+        return not code or str(code).startswith('08')
+    return False
+
+
+class BulkWriter:
+    """
+    BulkWriter(conn, table, columns).write(values) -> WriteReport
+
+    批大小参数（可用环境变量覆盖默认值）：
+      - batch_size: 初始批大小（QDB_BATCH_SIZE，默认 1000）
+      - min_batch / max_batch: 自适应范围（QDB_BATCH_MIN=100 / QDB_BATCH_MAX=20000）
+      - target_latency: 单批目标耗时秒（QDB_BATCH_TARGET_MS=250）
+    template 为行模板，默认每列一个 %s；可含服务端表达式（如 "(%s, %s, now(), %s, %s)"），values 只含占位符对应的值。
+    """
+
+    def __init__(
+        self,
+        conn,
+        table: str,
+        columns: Sequence[str],
+        batch_size: Optional[int] = None,
+        min_batch: Optional[int] = None,
+        max_batch: Optional[int] = None,
+        target_latency: Optional[float] = None,
+        adaptive: bool = True,
+        template: Optional[str] = None,
+    ) -> None:
+        self.conn = conn
+        self.table = table
+        self.columns = tuple(columns)
+        self.min_batch = max(1, min_batch or _env_int('QDB_BATCH_MIN', 100))
+        self.max_batch = max(self.min_batch, max_batch or _env_int('QDB_BATCH_MAX', 20000))
+        self.target_latency = target_latency or _env_int('QDB_BATCH_TARGET_MS', 250) / 1000.0
+        self.adaptive = adaptive
+        initial = batch_size or _tuned_batch.get(table) or _env_int('QDB_BATCH_SIZE', 1000)
+        self.batch_size = min(self.max_batch, max(self.min_batch, int(initial)))
+        cols = ', '.join(self.columns)
+        self._sql = f"insert into {table} ({cols}) values %s"
+        self._template = template or '(' + ','.join(['%s'] * len(self.columns)) + ')'
+
+    def write(self, values: Sequence[tuple]) -> WriteReport:
+        report = WriteReport(self.table)
+        if not values:
+            return report
+        cur = self.conn.cursor()
+        i = 0
+        n = len(values)
+        while i < n:
+            batch = values[i:i + self.batch_size]
+            t0 = time.perf_counter()
+            try:
+                written, rejected = self._write_batch(cur, batch, report)
+            except BulkWriteConnectionError as e:
+                report.elapsed += time.perf_counter() - t0
+                raise BulkWriteConnectionError(str(e), report=report, remaining=values[i:]) from e.__cause__
+            dt = time.perf_counter() - t0
+            report.batches.append(BatchStat(len(batch), written, rejected, dt))
+            report.written += written
+            report.rejected += rejected
+            report.elapsed += dt
+            logger.debug("bulk %s batch rows=%s written=%s rejected=%s %.1fms", self.table, len(batch), written, rejected, dt * 1000)
+            i += len(batch)
+            if self.adaptive and not rejected:
+                self._tune(len(batch), dt)
+        if report.rejected:
+            logger.warning("bulk %s 拒绝 %s 行, 样例=%s, 错误=%s", self.table, report.rejected, report.rejected_samples[:3], report.errors[:3])
+        return report
+
+    # 内部实现
+    def _execute(self, cur, batch) -> None:
+        if pg_extras is not None:
+            pg_extras.execute_values(cur, self._sql, batch, template=self._template, page_size=len(batch))
+            return
+        args = b','.join(cur.mogrify(self._template, row) for row in batch)
+        cur.execute(self._sql.replace('%s', '').encode() + args)
+
+    def _rollback(self) -> None:
+        if not getattr(self.conn, 'autocommit', True):
+            try:
+                self.conn.rollback()
+            except Exception:
+                pass
+
+    def _write_batch(self, cur, batch, report: WriteReport):
+        """写入一批，失败时二分隔离坏行。返回 (written, rejected)。"""
+        try:
+            self._execute(cur, batch)
+            return len(batch), 0
+        except Exception as e:
+            self._rollback()
+            if _is_connection_error(self.conn, e):
+                raise BulkWriteConnectionError(str(e)) from e
+            if len(batch) == 1:
+                report.rejected_rows.append(batch[0])
+                if len(report.rejected_samples) < 20:
+                    report.rejected_samples.append(batch[0])
+                if len(report.errors) < 20:
+                    report.errors.append(str(e).strip())
+                return 0, 1
+        mid = len(batch) // 2
+        w1, r1 = self._write_batch(cur, batch[:mid], report)
+        w2, r2 = self._write_batch(cur, batch[mid:], report)
+        return w1 + w2, r1 + r2
+
+    def _tune(self, rows: int, elapsed: float) -> None:
+        # 仅当本批装满时才据此放大，避免尾批误判
+        if elapsed < self.target_latency * 0.5 and rows >= self.batch_size:
+            self.batch_size = min(self.max_batch, self.batch_size * 2)
+        elif elapsed > self.target_latency * 1.5:
+            self.batch_size = max(self.min_batch, self.batch_size // 2)
+        with _tuned_lock:
+            _tuned_batch[self.table] = self.batch_size
@@ -12,6 +12,23 @@ try:
 except Exception:
     psycopg2 = None
 
+# 日线列式转换（作为包导入或在 data_pipeline 目录下直接运行脚本两种方式均可）
+try:
+    from data_pipeline.daily_frame import daily_rows, DAILY_INSERT_COLUMNS
+    from data_pipeline.adjust import FACTOR_ADJUST, FACTOR_INSERT_COLUMNS, factor_frame, factor_rows
+    from data_pipeline.ilp_writer import IlpWriter
+    from data_pipeline.bulk_writer import BulkWriter, BulkWriteConnectionError, WriteReport
+    from data_pipeline.source_limiter import source_call
+    from data_pipeline.spool import default_spool, start_replayer
+except Exception:
+    from daily_frame import daily_rows, DAILY_INSERT_COLUMNS
+    from adjust import FACTOR_ADJUST, FACTOR_INSERT_COLUMNS, factor_frame, factor_rows
+    from ilp_writer import IlpWriter
+    from bulk_writer import BulkWriter, BulkWriteConnectionError, WriteReport
+    from source_limiter import source_call
+    from spool import default_spool, start_replayer
+import threading
+
 
 def qdb_connect():
     """连接 QuestDB（PG wire），从环境变量读取连接信息。"""
@@ -31,7 +48,250 @@ def qdb_connect():
         return None
 
 
+# 写入后端选择：QDB_WRITER=pg（默认，PG wire）或 ilp（InfluxDB Line Protocol）
+_ilp_local = threading.local()
+
+
+def qdb_writer_mode():
+    mode = (os.getenv('QDB_WRITER') or 'pg').strip().lower()
+    return 'ilp' if mode == 'ilp' else 'pg'
+
+
+def qdb_ilp_writer():
+    """当前线程的 ILP 写入器（按需创建；写入器非线程安全，故每线程一个）。"""
+    w = getattr(_ilp_local, 'writer', None)
+    if w is None:
+        w = IlpWriter.from_env()
+        _ilp_local.writer = w
+    return w
+
+
+def qdb_flush_writer():
+    """ILP 模式下将当前线程缓冲的行推送到 QuestDB；失败返回 False。PG 模式无操作。"""
+    if qdb_writer_mode() != 'ilp':
+        return True
+    w = getattr(_ilp_local, 'writer', None)
+    if w is None:
+        return True
+    try:
+        w.flush()
+        return True
+    except Exception as e:
+        print(f"qdb_flush_writer failed: {e}")
+        return False
+
+
+# 各表插入列（元组顺序须与之一致）
+STOCK_BASIC_COLUMNS = ('code', 'name', 'company_name', 'market', 'listing_date')
+INST_TRADING_COLUMNS = (
+    'ingest_date', 'code', 'name', 'buy_amount', 'buy_times', 'sell_amount', 'sell_times', 'net_amount', 'query_type',
+)
+_ILP_INSERTERS = {
+    'stock_daily': 'insert_daily',
+    'adj_factor': 'insert_adj_factor',
+    'stock_basic': 'insert_basic',
+    'inst_trading_tracker': 'insert_inst_trading',
+}
+
+
+def _spool_rows(report, columns, values):
+    """把未能写入的行转存到 spool 并确保后台回放线程在运行；spool 不可用时计为 rejected。"""
+    n = default_spool().append(report.table, columns, values)
+    report.spooled += n
+    report.rejected += len(values) - n
+    if not n:
+        report.rejected_rows.extend(values)
+    if n:
+        start_replayer(qdb_connect)
+
+
+def qdb_write_rows(table, columns, values, conn=None, flush=False):
+    """
+    所有插入函数共用的写入入口，返回 WriteReport（written/rejected/elapsed/每批统计）。
+      - PG 模式：BulkWriter 多行 VALUES，自适应批大小，失败批二分隔离坏行
+      - ILP 模式：写入当前线程的 ILP 缓冲；flush=True 时立即推送
+    PG 模式下连接不可用或写入中途断开时，未写入的行转存到本地 spool（计入 spooled）并启动后台回放；
+    spool 不可用时计入 rejected。数据库拒绝的坏行另存到 spool 的坏行目录。
+    """
+    report = WriteReport(table)
+    if not values:
+        return report
+    if qdb_writer_mode() == 'ilp':
+        t0 = time.perf_counter()
+        try:
+            n = getattr(qdb_ilp_writer(), _ILP_INSERTERS[table])(values)
+            if flush:
+                qdb_ilp_writer().flush()
+            report.written = n
+        except Exception as e:
+            report.rejected = len(values)
+            report.rejected_rows = list(values)
+            report.errors.append(str(e))
+        report.elapsed = time.perf_counter() - t0
+        return report
+    conn_local = conn or qdb_connect()
+    if not conn_local:
+        report.errors.append('QuestDB 连接不可用')
+        _spool_rows(report, columns, values)
+        return report
+    try:
+        report.merge(BulkWriter(conn_local, table, columns).write(values))
+        if report.rejected:
+            default_spool().reject(table, columns, report.rejected_rows)
+    except BulkWriteConnectionError as e:
+        # 连接中途断开：断开前的批次已写入，其余转存 spool 待回放
+        if e.report is not None:
+            report.merge(e.report)
+        report.errors.append(str(e))
+        _spool_rows(report, columns, e.remaining)
+    except Exception as e:
+        report.rejected = len(values)
+        report.rejected_rows = list(values)
+        report.errors.append(str(e))
+    finally:
+        if conn is None:
+            try:
+                conn_local.close()
+            except Exception:
+                pass
+    return report
+
+
 # 修改：允许复用连接
+# stock_daily：以 trade_date 为指定时间戳的 WAL 表，按 (trade_date, code, adjust_type) 去重写入（UPSERT），
+# 重复下载 / 任务重试 / 增量回看窗口重叠时后写覆盖先写，读取时不会出现重复行
+STOCK_DAILY_DEDUP_KEYS = ('trade_date', 'code', 'adjust_type')
+STOCK_DAILY_DDL = """
+  create table if not exists {table} (
+    code symbol,
+    trade_date timestamp,
+    adjust_type symbol,
+    open double,
+    close double,
+    high double,
+    low double,
+    volume long,
+    amount double,
+    turnover double,
+    outstanding_share double
+  ) timestamp(trade_date) partition by YEAR WAL
+  dedup upsert keys(""" + ', '.join(STOCK_DAILY_DEDUP_KEYS) + """);
+"""
+
+
+def _table_meta(cur, table):
+    """读取 tables() 中某表的元数据（列名统一小写）；表不存在返回 None。"""
+    cur.execute('select * from tables()')
+    cols = [d[0].lower() for d in (cur.description or [])]
+    for row in cur.fetchall() or []:
+        meta = dict(zip(cols, row))
+        if (meta.get('table_name') or meta.get('name')) == table:
+            return meta
+    return None
+
+
+def qdb_migrate_stock_daily(conn):
+    """
+    将旧版 stock_daily（无指定时间戳 / 非 WAL / 未开启去重）迁移为去重表：
+      - 已是 WAL 且有指定时间戳、仅缺去重：直接 ALTER TABLE ... DEDUP ENABLE
+      - 否则新建 stock_daily_dedup，insert ... select 复制（写入时即按键去重），
+        旧表改名为 stock_daily_legacy 保留，新表改名为 stock_daily
+    返回是否执行了迁移。
+    """
+    cur = conn.cursor()
+    meta = _table_meta(cur, 'stock_daily')
+    if not meta:
+        return False
+    has_ts = bool(meta.get('designatedtimestamp'))
+    is_wal = str(meta.get('walenabled')).lower() in ('true', 't', '1')
+    has_dedup = str(meta.get('dedup')).lower() in ('true', 't', '1')
+    if has_ts and is_wal and has_dedup:
+        return False
+    keys = ', '.join(STOCK_DAILY_DEDUP_KEYS)
+    if has_ts and is_wal:
+        cur.execute(f'alter table stock_daily dedup enable upsert keys({keys})')
+        print('stock_daily: 已开启去重')
+        return True
+    if _table_meta(cur, 'stock_daily_legacy'):
+        print('stock_daily: 存在未清理的 stock_daily_legacy，跳过迁移')
+        return False
+    print('stock_daily: 迁移为 WAL 去重表 ...')
+    cur.execute('drop table if exists stock_daily_dedup')
+    cur.execute(STOCK_DAILY_DDL.format(table='stock_daily_dedup'))
+    cols = ', '.join(c for c in DAILY_INSERT_COLUMNS if c != 'trade_date')
+    cur.execute(
+        f"insert into stock_daily_dedup (trade_date, {cols}) "
+        f"select cast(trade_date as timestamp), {cols} from stock_daily where trade_date is not null"
+    )
+    cur.execute('rename table stock_daily to stock_daily_legacy')
+    cur.execute('rename table stock_daily_dedup to stock_daily')
+    print('stock_daily: 迁移完成，旧表保留为 stock_daily_legacy（确认无误后可 drop）')
+    return True
+
+
+# tasks：以 created_at 为指定时间戳、按天分区的 WAL 表；已结束的旧任务由 stocks.tasks.archive 归档后整分区删除，
+# 热查询（任务列表、计数、投影增量刷新）只涉及最近的分区
+TASKS_DDL = """
+  create table if not exists {table} (
+    task_id symbol,
+    task_type string,
+    task_desc string,
+    task_params string,
+    priority int,
+    status symbol,
+    created_at timestamp,
+    started_at timestamp,
+    ended_at timestamp
+  ) timestamp(created_at) partition by DAY WAL;
+"""
+TASK_TABLE_COLUMNS = ('task_id', 'task_type', 'task_desc', 'task_params', 'priority', 'status', 'created_at', 'started_at', 'ended_at')
+
+# 归档的已结束任务（含最终状态、结束时间与最后事件 detail），按 (created_at, task_id) 去重，重复归档幂等
+TASKS_ARCHIVE_DDL = """
+  create table if not exists tasks_archive (
+    task_id symbol,
+    task_type string,
+    task_desc string,
+    task_params string,
+    priority int,
+    status symbol,
+    created_at timestamp,
+    started_at timestamp,
+    ended_at timestamp,
+    worker symbol,
+    detail string
+  ) timestamp(created_at) partition by MONTH WAL
+  dedup upsert keys(created_at, task_id);
+"""
+
+
+def qdb_migrate_tasks(conn):
+    """
+    将旧版 tasks（无指定时间戳、不分区）迁移为按 created_at 分区的 WAL 表：
+    新建 tasks_partitioned，insert ... select 复制（created_at 为空的行取 started_at / ended_at / 当前时间），
+    旧表改名为 tasks_legacy 保留，新表改名为 tasks。返回是否执行了迁移。
+    """
+    cur = conn.cursor()
+    meta = _table_meta(cur, 'tasks')
+    if not meta or meta.get('designatedtimestamp'):
+        return False
+    if _table_meta(cur, 'tasks_legacy'):
+        print('tasks: 存在未清理的 tasks_legacy，跳过迁移')
+        return False
+    print('tasks: 迁移为按 created_at 分区的 WAL 表 ...')
+    cur.execute('drop table if exists tasks_partitioned')
+    cur.execute(TASKS_DDL.format(table='tasks_partitioned'))
+    cols = ', '.join(c for c in TASK_TABLE_COLUMNS if c != 'created_at')
+    cur.execute(
+        f"insert into tasks_partitioned (created_at, {cols}) "
+        f"select coalesce(created_at, started_at, ended_at, now()), {cols} from tasks"
+    )
+    cur.execute('rename table tasks to tasks_legacy')
+    cur.execute('rename table tasks_partitioned to tasks')
+    print('tasks: 迁移完成，旧表保留为 tasks_legacy（确认无误后可 drop）')
+    return True
+
+
 def qdb_ensure_tables(conn=None):
     conn = conn or qdb_connect()
     if not conn:
@@ -48,34 +308,72 @@ def qdb_ensure_tables(conn=None):
           );
         """)
 
+        cur.execute(STOCK_DAILY_DDL.format(table='stock_daily'))
+        try:
+            qdb_migrate_stock_daily(conn)
+        except Exception as e:
+            print(f"stock_daily migration failed: {e}")
+
+        cur.execute(TASKS_DDL.format(table='tasks'))
+        try:
+            qdb_migrate_tasks(conn)
+        except Exception as e:
+            print(f"tasks migration failed: {e}")
+        cur.execute(TASKS_ARCHIVE_DDL)
+
+        # 任务状态事件流（只追加）：当前状态 = 每个 task_id 的最新事件（LATEST ON），见 stocks.tasks.events
         cur.execute("""
-          create table if not exists stock_daily (
-            code symbol,
-            trade_date date,
-            adjust_type symbol,
-            open double,
-            close double,
-            high double,
-            low double,
-            volume long,
-            amount double,
-            turnover double,
-            outstanding_share double
-          );
+          create table if not exists task_events (
+            task_id symbol,
+            status symbol,
+            ts timestamp,
+            worker symbol,
+            detail string
+          ) timestamp(ts) partition by DAY WAL;
+        """)
+
+        # 任务工作进程心跳：租约有效 = 认领者最近心跳未超过租约时长，见 stocks.tasks.worker
+        cur.execute("""
+          create table if not exists worker_heartbeats (
+            worker symbol,
+            host symbol,
+            pid int,
+            running int,
+            ts timestamp
+          ) timestamp(ts) partition by DAY WAL;
         """)
-        
+
+        # 全量更新运行记录（只追加，当前状态 = 每个 run_id 的最新一行）与按代码的完成检查点，见 stocks.tasks.runs
         cur.execute("""
-          create table if not exists tasks (
-            task_id symbol,
-            task_type string,
-            task_desc string,
-            task_params string,
-            priority int,
+          create table if not exists update_runs (
+            run_id symbol,
+            kind symbol,
             status symbol,
-            created_at timestamp,
+            total_codes int,
+            params string,
+            worker symbol,
             started_at timestamp,
-            ended_at timestamp
-          );
+            ts timestamp
+          ) timestamp(ts) partition by MONTH WAL;
+        """)
+        cur.execute("""
+          create table if not exists update_run_codes (
+            run_id symbol,
+            code symbol,
+            task_id symbol,
+            status symbol,
+            ts timestamp
+          ) timestamp(ts) partition by DAY WAL;
+        """)
+
+        # 后复权因子（每个除权日一行），前/后复权价格由不复权日线按需计算，见 adjust.apply_adjust
+        cur.execute("""
+          create table if not exists adj_factor (
+            code symbol,
+            ex_date timestamp,
+            hfq_factor double
+          ) timestamp(ex_date) partition by YEAR WAL
+          dedup upsert keys(ex_date, code);
         """)
 
         cur.execute(    
@@ -126,44 +424,20 @@ def qdb_insert_basic(rows, conn=None):
     """批量插入基础股票到 QuestDB。rows 为 [{'code','name','company_name','market','listing_date'}]"""
     if not rows:
         return 0
-    conn_local = conn or qdb_connect()
-    if not conn_local:
-        return 0
-    try:
-        cur = conn_local.cursor()
-        values = []
-        for r in rows:
-            code = r.get('code')
-            name = r.get('name') or (code or '')
-            company_name = r.get('company_name') or name
-            market = r.get('market') or ''
-            ld = r.get('listing_date')
-            if isinstance(ld, datetime):
-                ld = ld.date()
-            values.append((code, name, company_name, market, ld))
-        try:
-            cur.executemany(
-                "insert into stock_basic (code, name, company_name, market, listing_date) values (%s,%s,%s,%s,%s)",
-                values
-            )
-        except Exception as e:
-            print(f"qdb_insert_basic executemany failed: {e}")
-            if conn is None:
-                try:
-                    conn_local.close()
-                except Exception:
-                    pass
-            return 0
-        if conn is None:
-            conn_local.close()
-        return len(values)
-    except Exception:
-        try:
-            if conn is None:
-                conn_local.close()
-        except Exception:
-            pass
-        return 0
+    values = []
+    for r in rows:
+        code = r.get('code')
+        name = r.get('name') or (code or '')
+        company_name = r.get('company_name') or name
+        market = r.get('market') or ''
+        ld = r.get('listing_date')
+        if isinstance(ld, datetime):
+            ld = ld.date()
+        values.append((code, name, company_name, market, ld))
+    report = qdb_write_rows('stock_basic', STOCK_BASIC_COLUMNS, values, conn=conn, flush=True)
+    if report.rejected:
+        print(f"qdb_insert_basic: {report.summary()}; errors={report.errors[:3]}")
+    return report.written + report.spooled
 
 
 # 一次读取全部基础股票（code, market, name）
@@ -191,93 +465,122 @@ def qdb_insert_daily(code, df, adj, conn=None):
     """将单个股票某复权类型的日线数据写入 QuestDB。"""
     if df is None or getattr(df, 'empty', True):
         return 0
+    return qdb_insert_daily_rows(daily_rows(code, df, adj).values, conn=conn)
+
+
+def qdb_insert_daily_rows(values, conn=None):
+    """写入已转换好的日线元组（见 daily_frame.daily_rows），返回写入（含转存 spool）的行数。
+    ILP 模式下行进入当前线程的写入缓冲，由自动 flush 或 qdb_flush_writer() 推送。"""
+    if not values:
+        return 0
+    report = qdb_write_rows('stock_daily', DAILY_INSERT_COLUMNS, values, conn=conn)
+    if report.rejected:
+        print(f"qdb_insert_daily: {report.summary()}; errors={report.errors[:3]}")
+    return report.written + report.spooled
+
+
+def qdb_insert_factors(values, conn=None):
+    """写入 adj_factor 元组（见 adjust.factor_rows），返回写入（含转存 spool）的行数。"""
+    report = qdb_write_rows('adj_factor', FACTOR_INSERT_COLUMNS, values, conn=conn)
+    return report.written + report.spooled
+
+
+def qdb_get_factors(code, conn=None):
+    """读取某代码的后复权因子表，返回 DataFrame[ex_date, hfq_factor]；无因子返回 None。"""
     conn_local = conn or qdb_connect()
     if not conn_local:
-        return 0
+        return None
     try:
         cur = conn_local.cursor()
-
-        cols = {
-            '日期': 'date', 
-            '开盘': 'open', 
-            '收盘': 'close', 
-            '最高': 'high', 
-            '最低': 'low',
-            '成交量': 'volume', 
-            '成交额': 'amount', 
-            '换手率': 'turnover',
-            '流通股本': 'outstanding_share'
-        }
-        df = df.rename(columns=cols)
-        values = []
-        for _, r in df.iterrows():
-            d = r.get('date')
-            if not d:
-                continue
-            try:
-                trade_date = d if isinstance(d, datetime) else datetime.strptime(str(d), '%Y-%m-%d')
-            except Exception:
-                continue
-            adj_norm = adj if (adj and str(adj).strip()) else None
-            values.append((
-                code,
-                trade_date.date(),
-                adj_norm,
-                _num(r.get('open')),
-                _num(r.get('close')),
-                _num(r.get('high')),
-                _num(r.get('low')),
-                _int(r.get('volume')),
-                _num(r.get('amount')),
-                _num(r.get('turnover')),
-                _num(r.get('outstanding_share')),
-            ))
-        if values:
-            try:
-                cur.executemany(
-                    """
-                    insert into stock_daily (
-                      code, trade_date, adjust_type, open, close, high, low, volume, amount, turnover, outstanding_share
-                    ) values (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                    """,
-                    values
-                )
-            except Exception as e:
-                try:
-                    bad = values[0] if values else None
-                    print(f"qdb_insert_daily executemany failed: {e}; sample={bad}")
-                except Exception:
-                    pass
-                if conn is None:
-                    try:
-                        conn_local.close()
-                    except Exception:
-                        pass
-                return 0
+        cur.execute('select ex_date, hfq_factor from adj_factor where code=%s order by ex_date', (code,))
+        return factor_frame(cur.fetchall())
+    except Exception as e:
+        print(f"qdb_get_factors failed: {e}")
+        return None
+    finally:
         if conn is None:
-            conn_local.close()
-        return len(values)
-    except Exception:
-        try:
-            if conn is None:
+            try:
                 conn_local.close()
-        except Exception:
-            pass
-        return 0
+            except Exception:
+                pass
 
 
-def _num(x):
+def _as_date(v):
+    if v is None:
+        return None
+    if isinstance(v, datetime):
+        return v.date()
+    if hasattr(v, 'year'):
+        return v
     try:
-        return float(x) if x not in (None, '') else None
+        return datetime.strptime(str(v)[:10], '%Y-%m-%d').date()
     except Exception:
         return None
 
 
-def _int(x):
+def qdb_daily_watermarks(codes=None, conn=None):
+    """
+    各代码、各复权类型已入库的最大交易日（增量下载的水位线）。
+    返回 {(code, adjust_type): date}，不复权（NULL）以 '' 作为 adjust_type。
+    codes 为空时返回全市场（一次 group by 查询）。
+    """
+    conn_local = conn or qdb_connect()
+    if not conn_local:
+        return {}
     try:
-        return int(x) if x not in (None, '') else None
-    except Exception:
-        return None
+        cur = conn_local.cursor()
+        sql = 'select code, adjust_type, max(trade_date) from stock_daily'
+        params = ()
+        if codes:
+            codes = list(codes)
+            sql += ' where code in (' + ','.join(['%s'] * len(codes)) + ')'
+            params = tuple(codes)
+        cur.execute(sql + ' group by code, adjust_type', params)
+        rows = cur.fetchall() or []
+        out = {}
+        for code, adj, d in rows:
+            d = _as_date(d)
+            if code and d:
+                out[(code, adj or '')] = d
+        return out
+    except Exception as e:
+        print(f"qdb_daily_watermarks failed: {e}")
+        return {}
+    finally:
+        if conn is None:
+            try:
+                conn_local.close()
+            except Exception:
+                pass
+
+
+def qdb_daily_since(code, adj, since, conn=None):
+    """读取某代码某复权类型自 since 起已入库的行，返回 {trade_date: (close, volume)}，用于回看窗口比对。"""
+    conn_local = conn or qdb_connect()
+    if not conn_local:
+        return {}
+    try:
+        cur = conn_local.cursor()
+        if adj:
+            cur.execute(
+                'select trade_date, close, volume from stock_daily where code=%s and adjust_type=%s and trade_date >= %s',
+                (code, adj, since),
+            )
+        else:
+            cur.execute(
+                'select trade_date, close, volume from stock_daily where code=%s and adjust_type is null and trade_date >= %s',
+                (code, since),
+            )
+        return {_as_date(r[0]): (r[1], r[2]) for r in (cur.fetchall() or [])}
+    except Exception as e:
+        print(f"qdb_daily_since failed: {e}")
+        return {}
+    finally:
+        if conn is None:
+            try:
+                conn_local.close()
+            except Exception:
+                pass
 
 
 def ensure_tables():
@@ -420,30 +723,28 @@ def write_daily_to_db(code: str, market='', conn=None):
             return 'bj' + c
         return 'sz' + c
     symbol = make_symbol(code, market)
-    for adj in ['', 'qfq', 'hfq']:
+    # 只存不复权日线 + 后复权因子，前/后复权按需计算
+    for adj in ['', FACTOR_ADJUST]:
         if not ak:
             df = None
         else:
             try:
-                df = ak.stock_zh_a_daily(symbol=symbol, start_date='19900101', end_date=datetime.now().strftime('%Y%m%d'), adjust=adj)
+                df = source_call('akshare', ak.stock_zh_a_daily, symbol=symbol, start_date='19900101', end_date=datetime.now().strftime('%Y%m%d'), adjust=adj)
             except Exception:
                 df = None
         try:
-            saved = qdb_insert_daily(code, df, adj, conn=conn)#把akshare读出来的数据保存到数据库中
+            if adj == FACTOR_ADJUST:
+                qdb_insert_factors(factor_rows(code, df).values, conn=conn)
+                continue
+            rows = daily_rows(code, df, adj)
+            saved = qdb_insert_daily_rows(rows.values, conn=conn)#把akshare读出来的数据保存到数据库中
             total_saved += saved
-            if df is not None and not df.empty:
-                df2 = df.rename(columns={'日期': 'date'})
-                for _, r in df2.iterrows():
-                    d = r.get('date')
-                    if not d:
-                        continue
-                    try:
-                        trade_date = d if isinstance(d, datetime) else datetime.strptime(str(d), '%Y-%m-%d')
-                        latest_date = max(latest_date or trade_date.date(), trade_date.date())
-                    except Exception:
-                        pass
+            if rows.latest_date:
+                latest_date = max(latest_date or rows.latest_date, rows.latest_date)
         except Exception:
             pass
+    if not qdb_flush_writer():
+        total_saved = 0
     return {'code': code, 'saved': total_saved, 'latest_date': latest_date}
 
 
@@ -0,0 +1,119 @@
+"""
+日线 DataFrame → 入库行 的列式转换（向量化）。
+
+Akshare 返回的日线数据原先在 `_insert_daily` / `qdb_insert_daily` 中逐行 `iterrows()`
+并对每个单元格调用 `_num/_int/strptime`，全量更新时大部分 CPU 都耗在这里。
+本模块统一用 pandas/NumPy 的列操作完成：列名重命名、日期解析、数值类型收窄、
+NULL 处理与插入批次构建，并在同一次遍历中给出 latest_date。
+"""
+from datetime import date
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+
+
+# 中文列名 → 统一英文列名（ak.stock_zh_a_daily 已是英文列名，重命名对其无副作用）
+DAILY_COLUMNS = {
+    '日期': 'date',
+    '开盘': 'open',
+    '收盘': 'close',
+    '最高': 'high',
+    '最低': 'low',
+    '成交量': 'volume',
+    '成交额': 'amount',
+    '换手率': 'turnover',
+    '流通股本': 'outstanding_share',
+}
+
+# stock_daily 的插入列顺序（与 DailyRows.values 中的元组一一对应）
+DAILY_INSERT_COLUMNS = (
+    'code', 'trade_date', 'adjust_type', 'open', 'close', 'high', 'low',
+    'volume', 'amount', 'turnover', 'outstanding_share',
+)
+
+_FLOAT_FIELDS = ('open', 'close', 'high', 'low', 'amount', 'turnover', 'outstanding_share')
+
+
+class DailyRows(NamedTuple):
+    """一次转换的结果：values 为可直接 executemany 的元组列表，latest_date 为最大交易日。"""
+    values: List[tuple]
+    latest_date: Optional[date]
+
+
+def normalize_adjust(adj) -> Optional[str]:
+    """复权类型归一化：空串/空白视为 NULL（不复权）。"""
+    return adj if (adj and str(adj).strip()) else None
+
+
+def normalize_daily_frame(df):
+    """
+    重命名并做列式类型转换，返回只含有效交易日的新 DataFrame：
+      - date: datetime64（无法解析的行被丢弃）
+      - open/close/...: float64（无法解析的值为 NaN）
+      - volume: Int64（可空整数，小数部分截断，与原 _int 行为一致）
+    """
+    if df is None or getattr(df, 'empty', True):
+        return None
+    df = df.rename(columns=DAILY_COLUMNS)
+    if 'date' not in df.columns:
+        return None
+    out = pd.DataFrame(index=df.index)
+    out['date'] = pd.to_datetime(df['date'], errors='coerce', format='mixed')
+    for name in _FLOAT_FIELDS:
+        if name in df.columns:
+            out[name] = pd.to_numeric(df[name], errors='coerce').astype('float64')
+        else:
+            out[name] = np.nan
+    if 'volume' in df.columns:
+        vol = pd.to_numeric(df['volume'], errors='coerce').astype('float64')
+        out['volume'] = np.trunc(vol).astype('Int64')
+    else:
+        out['volume'] = pd.array([pd.NA] * len(out), dtype='Int64')
+    return out[out['date'].notna()]
+
+
+def _to_object(col) -> np.ndarray:
+    """将一列转换为 Python 原生对象数组，缺失值统一为 None（psycopg2 写入 NULL）。"""
+    mask = col.isna().to_numpy()
+    if col.dtype == 'Int64':
+        arr = col.to_numpy(dtype='int64', na_value=0).astype(object)
+    else:
+        arr = col.to_numpy(dtype=object)
+    if mask.any():
+        arr[mask] = None
+    return arr
+
+
+def daily_rows(code: str, df, adj) -> DailyRows:
+    """
+    将 Akshare 日线 DataFrame 一次性转换为 stock_daily 插入元组，顺序见 DAILY_INSERT_COLUMNS。
+    同时返回本批次的最大交易日（无有效行时为 None）。
+    """
+    frame = normalize_daily_frame(df)
+    if frame is None or frame.empty:
+        return DailyRows([], None)
+    n = len(frame)
+    dates = frame['date']
+    trade_dates = dates.dt.date.to_numpy(dtype=object)
+    adj_norm = normalize_adjust(adj)
+    columns = [
+        np.full(n, code, dtype=object),
+        trade_dates,
+        np.full(n, adj_norm, dtype=object),
+        _to_object(frame['open']),
+        _to_object(frame['close']),
+        _to_object(frame['high']),
+        _to_object(frame['low']),
+        _to_object(frame['volume']),
+        _to_object(frame['amount']),
+        _to_object(frame['turnover']),
+        _to_object(frame['outstanding_share']),
+    ]
+    values = list(zip(*columns))
+    latest = dates.max()
+    return DailyRows(values, latest.date() if not pd.isna(latest) else None)
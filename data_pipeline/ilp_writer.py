@@ -0,0 +1,272 @@
+"""
+QuestDB InfluxDB Line Protocol（ILP）写入器。
+
+PG wire 的 `executemany` 会被 psycopg2 拆成逐行语句，写入吞吐受往返延迟限制。
+ILP 将多行编码为文本行批量推送（TCP 9009 或 HTTP 9000 /write），由 QuestDB 服务端解析入库。
+
+    writer = IlpWriter.from_env()
+    writer.insert_daily(values)      # 与 PG 路径相同的元组（见 daily_frame.DAILY_INSERT_COLUMNS）
+    writer.flush()
+
+特性：
+  - 行缓冲，按行数 / 字节数自动 flush
+  - 连接断开时重连并重发当前缓冲（至少一次语义）
+  - HTTP 传输下 4xx 视为数据错误直接抛出，不重试
+写入器不是线程安全的，多线程场景请每个线程各持有一个实例。
+"""
+import http.client
+import math
+import os
+import socket
+import time
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional
+
+
+class IlpError(Exception):
+    """ILP 写入失败（重试耗尽或服务端拒绝）。"""
+
+
+@lru_cache(maxsize=8192)
+def _escape_name(s: str) -> str:
+    # 表名/列名/符号值高度重复，缓存转义结果
+    return s.replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ').replace('=', '\\=').replace('\n', '\\n')
+
+
+def _escape_str(s: str) -> str:
+    return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_DAY_MICROS = 86400 * 1_000_000
+
+
+def _micros(v) -> int:
+    """datetime/date → 自 1970-01-01 起的微秒数（naive 时间按 UTC 处理）。"""
+    if isinstance(v, datetime):
+        if v.tzinfo:
+            return int(v.timestamp() * 1_000_000)
+        return ((v.toordinal() - _EPOCH_ORDINAL) * 86400 + v.hour * 3600 + v.minute * 60 + v.second) * 1_000_000 + v.microsecond
+    return (v.toordinal() - _EPOCH_ORDINAL) * _DAY_MICROS
+
+
+def _field(v) -> Optional[str]:
+    """编码单个字段值；None/NaN 返回 None（该字段省略，入库为 NULL）。"""
+    if v is None:
+        return None
+    t = type(v)
+    if t is float:
+        return None if v != v else repr(v)
+    if t is int:
+        return f'{v}i'
+    if isinstance(v, bool):
+        return 't' if v else 'f'
+    if isinstance(v, int):
+        return f'{v}i'
+    if isinstance(v, float):
+        return None if math.isnan(v) else repr(v)
+    if isinstance(v, (datetime, date)):
+        # 以 ILP 时间戳字段（微秒，后缀 t）写入，QuestDB 可落到 timestamp/date 列
+        return f'{_micros(v)}t'
+    return '"' + _escape_str(str(v)) + '"'
+
+
+def encode_line(table: str, symbols: Dict[str, Any], columns: Dict[str, Any], at: Optional[Any] = None) -> str:
+    """编码一行 ILP：table,sym=v col=v ts。symbols/columns 中值为 None 的项省略。"""
+    parts = [_escape_name(table)]
+    for k, v in symbols.items():
+        if v is None or v == '':
+            continue
+        parts.append(f'{_escape_name(k)}={_escape_name(str(v))}')
+    head = ','.join(parts)
+    fields = []
+    for k, v in columns.items():
+        ev = _field(v)
+        if ev is not None:
+            fields.append(f'{_escape_name(k)}={ev}')
+    line = head + ' ' + ','.join(fields)
+    if at is not None:
+        line += ' ' + str(_micros(at) * 1000)
+    return line + '\n'
+
+
+class IlpWriter:
+    """缓冲式 ILP 写入器，支持 TCP / HTTP 两种传输。"""
+
+    def __init__(
+        self,
+        host: str = 'localhost',
+        port: Optional[int] = None,
+        protocol: str = 'tcp',
+        auto_flush_rows: int = 10000,
+        auto_flush_bytes: int = 1 << 20,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        timeout: float = 10.0,
+    ) -> None:
+        self.protocol = (protocol or 'tcp').lower()
+        if self.protocol not in ('tcp', 'http'):
+            raise ValueError(f'不支持的 ILP 传输协议: {protocol}')
+        self.host = host
+        self.port = int(port or (9009 if self.protocol == 'tcp' else 9000))
+        self.auto_flush_rows = max(1, int(auto_flush_rows))
+        self.auto_flush_bytes = max(1, int(auto_flush_bytes))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_backoff = float(retry_backoff)
+        self.timeout = float(timeout)
+        self._buf = []
+        self._buf_bytes = 0
+        self._sock: Optional[socket.socket] = None
+        self._http: Optional[http.client.HTTPConnection] = None
+        # 统计
+        self.rows_sent = 0
+        self.bytes_sent = 0
+        self.flushes = 0
+        self.reconnects = 0
+
+    @classmethod
+    def from_env(cls) -> 'IlpWriter':
+        """从环境变量构造：QDB_ILP_PROTOCOL/QDB_ILP_HOST/QDB_ILP_PORT/QDB_ILP_AUTO_FLUSH_ROWS/QDB_ILP_AUTO_FLUSH_BYTES。"""
+        port = os.getenv('QDB_ILP_PORT')
+        return cls(
+            host=os.getenv('QDB_ILP_HOST') or os.getenv('QDB_HOST', 'localhost'),
+            port=int(port) if port else None,
+            protocol=os.getenv('QDB_ILP_PROTOCOL', 'tcp'),
+            auto_flush_rows=int(os.getenv('QDB_ILP_AUTO_FLUSH_ROWS', '10000')),
+            auto_flush_bytes=int(os.getenv('QDB_ILP_AUTO_FLUSH_BYTES', str(1 << 20))),
+        )
+
+    # 缓冲
+    @property
+    def pending_rows(self) -> int:
+        return len(self._buf)
+
+    def row(self, table: str, symbols: Dict[str, Any], columns: Dict[str, Any], at: Optional[Any] = None) -> None:
+        line = encode_line(table, symbols, columns, at)
+        self._buf.append(line)
+        self._buf_bytes += len(line)
+        if len(self._buf) >= self.auto_flush_rows or self._buf_bytes >= self.auto_flush_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buf:
+            return
+        payload = ''.join(self._buf).encode('utf-8')
+        attempt = 0
+        while True:
+            try:
+                self._send(payload)
+                break
+            except IlpError:
+                raise
+            except Exception as e:
+                self._disconnect()
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise IlpError(f'ILP 发送失败（已重试 {self.max_retries} 次）: {e}') from e
+                self.reconnects += 1
+                time.sleep(self.retry_backoff * attempt)
+        self.rows_sent += len(self._buf)
+        self.bytes_sent += len(payload)
+        self.flushes += 1
+        self._buf = []
+        self._buf_bytes = 0
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 传输
+    def _send(self, payload: bytes) -> None:
+        if self.protocol == 'tcp':
+            if self._sock is None:
+                self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._sock.sendall(payload)
+            return
+        if self._http is None:
+            self._http = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self._http.request('POST', '/write?precision=n', body=payload, headers={'Content-Type': 'text/plain; charset=utf-8'})
+        resp = self._http.getresponse()
+        body = resp.read()
+        if 200 <= resp.status < 300:
+            return
+        if 400 <= resp.status < 500:
+            # 数据/语法错误，重发无意义
+            raise IlpError(f'ILP HTTP {resp.status}: {body[:500].decode("utf-8", "replace")}')
+        raise ConnectionError(f'ILP HTTP {resp.status}')
+
+    def _disconnect(self) -> None:
+        for attr in ('_sock', '_http'):
+            h = getattr(self, attr)
+            if h is not None:
+                try:
+                    h.close()
+                except Exception:
+                    pass
+                setattr(self, attr, None)
+
+    # 表级写入（接收与 PG 路径相同的元组，返回缓冲的行数）
+    def insert_daily(self, values: Iterable[tuple]) -> int:
+        """
+        stock_daily：(code, trade_date, adjust_type, open, close, high, low, volume, amount, turnover, outstanding_share)
+        trade_date 作为指定时间戳写入（行尾时间戳），配合表的 dedup upsert keys 实现幂等写入。
+        """
+        n = 0
+        for (code, trade_date, adj, o, c, h, lo, vol, amt, turn, share) in values:
+            self.row(
+                'stock_daily',
+                {'code': code, 'adjust_type': adj},
+                {
+                    'open': o, 'close': c, 'high': h, 'low': lo,
+                    'volume': vol, 'amount': amt, 'turnover': turn, 'outstanding_share': share,
+                },
+                at=trade_date,
+            )
+            n += 1
+        return n
+
+    def insert_adj_factor(self, values: Iterable[tuple]) -> int:
+        """adj_factor：(code, ex_date, hfq_factor)，ex_date 作为指定时间戳写入。"""
+        n = 0
+        for (code, ex_date, factor) in values:
+            self.row('adj_factor', {'code': code}, {'hfq_factor': factor}, at=ex_date)
+            n += 1
+        return n
+
+    def insert_basic(self, values: Iterable[tuple]) -> int:
+        """stock_basic：(code, name, company_name, market, listing_date)"""
+        n = 0
+        for (code, name, company_name, market, listing_date) in values:
+            self.row(
+                'stock_basic',
+                {'code': code, 'market': market},
+                {'name': name, 'company_name': company_name, 'listing_date': listing_date},
+            )
+            n += 1
+        return n
+
+    def insert_inst_trading(self, values: Iterable[tuple]) -> int:
+        """inst_trading_tracker：(ingest_date, code, name, buy_amount, buy_times, sell_amount, sell_times, net_amount, query_type)"""
+        n = 0
+        for (ingest_date, code, name, buy_amt, buy_times, sell_amt, sell_times, net_amt, qt) in values:
+            self.row(
+                'inst_trading_tracker',
+                {'code': code},
+                {
+                    'ingest_date': ingest_date, 'name': name,
+                    'buy_amount': buy_amt, 'buy_times': None if buy_times is None else int(buy_times),
+                    'sell_amount': sell_amt, 'sell_times': None if sell_times is None else int(sell_times),
+                    'net_amount': net_amt, 'query_type': None if qt is None else int(qt),
+                },
+            )
+            n += 1
+        return n
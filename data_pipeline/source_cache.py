@@ -0,0 +1,221 @@
+"""
+数据源原始响应的本地磁盘缓存（Parquet，按内容寻址）。
+
+重试、重跑、调试以及向新的 QuestDB 实例重新灌库时，相同的 (函数, 参数) 无需再次访问网络：
+  - 键：sha256(函数全名 + 参数)，参数含 symbol / adjust / 日期区间等，文件为 <dir>/<键前2位>/<键>.parquet
+  - TTL：区间结束日早于今天的不复权历史数据永不过期；复权序列（adjust 非空，除权除息后基准整体变化）、
+    区间触及今天（或无日期参数，如因子表、代码列表）的结果 SOURCE_CACHE_TTL 秒后过期（默认 3600）
+  - 调用方已知缓存过时（如检测到前复权基准变化后整段重拉）时以 source_call(..., fresh=True) 绕过读取，结果覆盖旧缓存
+  - 容量：总大小超过 SOURCE_CACHE_MAX_MB（默认 2048）时按最近访问时间淘汰（LRU，访问时间记录在文件 atime）
+  - 统计：hits / misses / expired / writes / evictions / bytes
+只缓存非空的 DataFrame 结果（空结果可能是数据源暂时无数据）；需要 pyarrow（或 fastparquet），不可用时缓存自动关闭。
+SOURCE_CACHE=0 关闭缓存，SOURCE_CACHE_DIR 指定目录（默认项目根目录下 .cache/source）。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import pandas as pd
+except Exception:
+    pd = None
+
+_DATE_KEYS = ('end_date', 'date', 'trade_date', 'start_date')
+
+
+def _fn_name(fn: Callable) -> str:
+    return f"{getattr(fn, '__module__', '')}.{getattr(fn, '__qualname__', getattr(fn, '__name__', repr(fn)))}"
+
+
+def _norm(v: Any) -> Any:
+    if isinstance(v, (datetime, date)):
+        return v.strftime('%Y%m%d')
+    if isinstance(v, (list, tuple)):
+        return [_norm(x) for x in v]
+    return v
+
+
+def cache_key(fn: Callable, args: tuple, kwargs: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        {'fn': _fn_name(fn), 'args': [_norm(a) for a in args], 'kwargs': {k: _norm(v) for k, v in sorted(kwargs.items())}},
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _range_end(kwargs: Dict[str, Any]) -> Optional[str]:
+    """取参数中的区间结束日（YYYYMMDD）；无日期参数返回 None。"""
+    for k in _DATE_KEYS:
+        v = kwargs.get(k)
+        if v:
+            s = _norm(v)
+            return str(s).replace('-', '')[:8]
+    return None
+
+
+class SourceCache:
+    """SourceCache(root, max_bytes, ttl).get(fn, args, kwargs) / .put(...)；线程安全。"""
+
+    def __init__(self, root: str, max_bytes: int = 2048 << 20, ttl: float = 3600.0) -> None:
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl)
+        self.enabled = pd is not None
+        self._lock = threading.Lock()
+        self._bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> 'SourceCache':
+        root = os.getenv('SOURCE_CACHE_DIR') or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'source'
+        )
+        cache = cls(
+            root=root,
+            max_bytes=int(float(os.getenv('SOURCE_CACHE_MAX_MB', '2048')) * (1 << 20)),
+            ttl=float(os.getenv('SOURCE_CACHE_TTL', '3600')),
+        )
+        if (os.getenv('SOURCE_CACHE') or '1').strip().lower() in ('0', 'false', 'off', 'no'):
+            cache.enabled = False
+        return cache
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + '.parquet')
+
+    def _expired(self, path: str, kwargs: Dict[str, Any]) -> bool:
+        end = _range_end(kwargs)
+        if end and end < datetime.now().strftime('%Y%m%d') and not kwargs.get('adjust'):
+            # 不复权的历史区间：数据不再变化
+            return False
+        return time.time() - os.path.getmtime(path) > self.ttl
+
+    def get(self, fn: Callable, args: tuple, kwargs: Dict[str, Any]):
+        """命中返回 DataFrame，否则返回 None。"""
+        if not self.enabled:
+            return None
+        path = self._path(cache_key(fn, args, kwargs))
+        try:
+            if not os.path.exists(path):
+                with self._lock:
+                    self.misses += 1
+                return None
+            if self._expired(path, kwargs):
+                with self._lock:
+                    self.misses += 1
+                    self.expired += 1
+                return None
+            df = pd.read_parquet(path)
+            # 记录访问时间供 LRU 淘汰（显式设置，不依赖挂载选项）
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            with self._lock:
+                self.hits += 1
+            return df
+        except Exception:
+            with self._lock:
+                self.misses += 1
+            return None
+
+    def put(self, fn: Callable, args: tuple, kwargs: Dict[str, Any], value) -> bool:
+        if not self.enabled or pd is None or not isinstance(value, pd.DataFrame) or value.empty:
+            return False
+        path = self._path(cache_key(fn, args, kwargs))
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            old = os.path.getsize(path) if os.path.exists(path) else 0
+            value.to_parquet(tmp)
+            os.replace(tmp, path)
+            size = os.path.getsize(path)
+        except ImportError:
+            # 无 Parquet 引擎
+            self.enabled = False
+            return False
+        except Exception:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+            return False
+        with self._lock:
+            self.writes += 1
+            if self._bytes is not None:
+                self._bytes += size - old
+        if self.size_bytes() > self.max_bytes:
+            self.evict()
+        return True
+
+    # 容量管理
+    def _entries(self):
+        out = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.parquet'):
+                    p = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(p)
+                    except OSError:
+                        continue
+                    out.append((st.st_atime, st.st_size, p))
+        return out
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(e[1] for e in self._entries())
+            return self._bytes
+
+    def evict(self, target: Optional[int] = None) -> int:
+        """按最近访问时间淘汰到 target 字节以下（默认容量上限的 90%），返回淘汰文件数。"""
+        target = int(self.max_bytes * 0.9) if target is None else target
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(e[1] for e in entries)
+            removed = 0
+            for _, size, p in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(p)
+                    total -= size
+                    removed += 1
+                except OSError:
+                    pass
+            self._bytes = total
+            self.evictions += removed
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'dir': self.root,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'bytes': self._bytes,
+            }
+
+
+_default: Optional[SourceCache] = None
+_default_lock = threading.Lock()
+
+
+def default_cache() -> SourceCache:
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = SourceCache.from_env()
+    return _default
@@ -0,0 +1,267 @@
+"""
+数据源调用的子进程隔离（可选）。
+
+Python 线程无法被取消：卡住的 ak.stock_zh_a_daily / stock_lhb_detail_em 会一直占住执行线程，
+停止按钮（只设置停止标记）也要等到调用返回。开启隔离后，source_call() 把调用交给常驻的子进程池：
+  - 预热：首次使用时启动 SOURCE_ISOLATION_PROCESSES 个子进程（默认 SOURCE_DEFAULT_CONCURRENCY=4），之后复用
+  - 超时：每次调用有墙钟超时（SOURCE_TIMEOUTS="akshare=90"，未列出的数据源用 SOURCE_TIMEOUT_SECONDS，默认 120），
+    超时即强制杀掉子进程并启动新的子进程补位，调用方得到 SourceTimeoutError
+  - 取消：cancel_all() 杀掉所有正在执行的子进程（停止更新时调用），调用方得到 SourceCancelledError
+  - 回收：子进程执行 SOURCE_ISOLATION_MAX_CALLS 次（默认 500，0 不限）后替换，避免内存持续增长
+  - 结果：经 multiprocessing Pipe 以 pickle 传回（DataFrame 直接传输）；函数按模块路径 pickle，需为模块级函数
+SOURCE_ISOLATION 控制开关：空 / 0 关闭（默认），1 / all 所有数据源，或数据源名列表（如 "akshare"）。
+子进程默认以 spawn 方式启动（SOURCE_ISOLATION_START 可改为 forkserver / fork），不继承父进程的线程与连接。
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class SourceTimeoutError(TimeoutError):
+    """数据源调用超过墙钟超时，子进程已被杀掉。"""
+
+
+class SourceCancelledError(RuntimeError):
+    """数据源调用被 cancel_all() 取消。"""
+
+
+def _child_main(conn) -> None:
+    # 子进程：循环接收 (fn, args, kwargs)，返回 ('ok', 结果) 或 ('err', 异常)；收到 None 或管道关闭时退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return
+        if msg is None:
+            return
+        fn, args, kwargs = msg
+        try:
+            reply = ('ok', fn(*args, **kwargs))
+        except BaseException as e:
+            reply = ('err', e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # 结果或异常无法 pickle
+            conn.send(('err', RuntimeError(f"子进程结果无法传回: {type(e).__name__}: {e}")))
+
+
+class _Child:
+    __slots__ = ('conn', 'proc', 'calls', 'cancelled')
+
+    def __init__(self, ctx) -> None:
+        self.conn, child_conn = ctx.Pipe()
+        self.proc = ctx.Process(target=_child_main, args=(child_conn,), name='source-isolated', daemon=True)
+        self.proc.start()
+        child_conn.close()
+        self.calls = 0
+        self.cancelled = False
+
+    def kill(self) -> None:
+        try:
+            self.proc.kill()
+            self.proc.join(timeout=5)
+        except Exception:
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        try:
+            self.conn.send(None)
+            self.proc.join(timeout=2)
+        except Exception:
+            pass
+        if self.proc.is_alive():
+            self.kill()
+
+
+class IsolatedPool:
+    """常驻子进程池：call(source, fn, *args, **kwargs) 在空闲子进程中执行并等待结果（带超时）。"""
+
+    def __init__(
+        self,
+        size: int = 4,
+        timeouts: Optional[Dict[str, float]] = None,
+        default_timeout: float = 120.0,
+        max_calls: int = 500,
+        start_method: str = 'spawn',
+    ) -> None:
+        self.size = max(1, int(size))
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = float(default_timeout)
+        self.max_calls = max(0, int(max_calls))
+        self._ctx = multiprocessing.get_context(start_method)
+        self._idle: 'queue.Queue[_Child]' = queue.Queue()
+        self._busy: Set[_Child] = set()
+        self._lock = threading.Lock()
+        self._warm = False
+        self.calls = 0
+        self.timed_out = 0
+        self.crashed = 0
+        self.cancelled = 0
+        self.restarts = 0
+
+    @classmethod
+    def from_env(cls) -> 'IsolatedPool':
+        timeouts: Dict[str, float] = {}
+        for part in (os.getenv('SOURCE_TIMEOUTS') or '').split(','):
+            name, _, value = part.partition('=')
+            if name.strip() and value.strip():
+                try:
+                    timeouts[name.strip()] = float(value)
+                except ValueError:
+                    logger.warning("忽略无效的数据源超时配置: %s", part)
+        size = os.getenv('SOURCE_ISOLATION_PROCESSES') or os.getenv('SOURCE_DEFAULT_CONCURRENCY') or '4'
+        return cls(
+            size=int(size),
+            timeouts=timeouts,
+            default_timeout=float(os.getenv('SOURCE_TIMEOUT_SECONDS', '120')),
+            max_calls=int(os.getenv('SOURCE_ISOLATION_MAX_CALLS', '500')),
+            start_method=os.getenv('SOURCE_ISOLATION_START', 'spawn'),
+        )
+
+    def timeout_for(self, source: str) -> float:
+        return self.timeouts.get(source, self.default_timeout)
+
+    def warm(self) -> None:
+        with self._lock:
+            if self._warm:
+                return
+            self._warm = True
+            for _ in range(self.size):
+                self._idle.put(_Child(self._ctx))
+        logger.info("数据源隔离子进程已启动: %s 个", self.size)
+
+    def _release(self, child: _Child, healthy: bool) -> None:
+        with self._lock:
+            self._busy.discard(child)
+        if healthy and not (self.max_calls and child.calls >= self.max_calls):
+            self._idle.put(child)
+            return
+        if healthy:
+            child.close()
+        else:
+            child.kill()
+        with self._lock:
+            self.restarts += 1
+        self._idle.put(_Child(self._ctx))
+
+    def call(self, source: str, fn: Callable, *args, **kwargs) -> Any:
+        self.warm()
+        timeout = self.timeout_for(source)
+        child = self._idle.get()
+        with self._lock:
+            self._busy.add(child)
+            self.calls += 1
+        child.calls += 1
+        healthy = False
+        try:
+            child.conn.send((fn, args, kwargs))
+            deadline = time.monotonic() + timeout
+            while not child.conn.poll(min(max(0.0, deadline - time.monotonic()), 0.5)):
+                if child.cancelled:
+                    raise EOFError
+                if time.monotonic() >= deadline:
+                    with self._lock:
+                        self.timed_out += 1
+                    logger.warning("数据源调用超时，已终止子进程: %s %s (%.0fs)", source, getattr(fn, '__name__', fn), timeout)
+                    raise SourceTimeoutError(f"{source}.{getattr(fn, '__name__', fn)} 超过 {timeout:.0f}s 未返回")
+                if not child.proc.is_alive():
+                    raise EOFError
+            status, value = child.conn.recv()
+            healthy = True
+        except SourceTimeoutError:
+            # TimeoutError 是 OSError 的子类，需先于下面的管道异常处理
+            raise
+        except (EOFError, OSError):
+            if child.cancelled:
+                with self._lock:
+                    self.cancelled += 1
+                raise SourceCancelledError(f"{source}.{getattr(fn, '__name__', fn)} 已取消")
+            with self._lock:
+                self.crashed += 1
+            raise RuntimeError(f"数据源子进程异常退出: {source}.{getattr(fn, '__name__', fn)}")
+        finally:
+            self._release(child, healthy)
+        if status == 'err':
+            raise value
+        return value
+
+    def cancel_all(self) -> int:
+        """杀掉所有正在执行调用的子进程（各调用方抛出 SourceCancelledError，子进程随后补位）。"""
+        with self._lock:
+            busy = list(self._busy)
+        for child in busy:
+            child.cancelled = True
+            try:
+                child.proc.kill()
+            except Exception:
+                pass
+        return len(busy)
+
+    def shutdown(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._warm = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'processes': self.size,
+                'busy': len(self._busy),
+                'calls': self.calls,
+                'timed_out': self.timed_out,
+                'crashed': self.crashed,
+                'cancelled': self.cancelled,
+                'restarts': self.restarts,
+            }
+
+
+def isolated_sources() -> Optional[Set[str]]:
+    """需要隔离的数据源集合；返回 None 表示关闭，空集合表示全部。"""
+    value = (os.getenv('SOURCE_ISOLATION') or '').strip().lower()
+    if value in ('', '0', 'false', 'off', 'no'):
+        return None
+    if value in ('1', 'all', 'true', 'on', 'yes'):
+        return set()
+    return {s.strip() for s in value.split(',') if s.strip()}
+
+
+_pool: Optional[IsolatedPool] = None
+_pool_lock = threading.Lock()
+
+
+def isolated_pool(source: str) -> Optional[IsolatedPool]:
+    """该数据源启用隔离时返回进程内共享的子进程池，否则返回 None。"""
+    global _pool
+    sources = isolated_sources()
+    if sources is None or (sources and source not in sources):
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = IsolatedPool.from_env()
+    return _pool
+
+
+def cancel_all() -> int:
+    return _pool.cancel_all() if _pool else 0
+
+
+def isolation_stats() -> Optional[Dict[str, Any]]:
+    return _pool.stats() if _pool else None
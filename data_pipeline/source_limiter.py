@@ -0,0 +1,153 @@
+"""
+数据源调用限流：全局令牌桶 + 按数据源的并发上限。
+
+多线程并发拉取时，所有对外数据源调用都应经过 source_call()，保证：
+  - 全局请求速率不超过 SOURCE_RATE_LIMIT（次/秒，令牌桶，突发上限 SOURCE_BURST）
+  - 每个数据源同时进行的请求数不超过其并发上限（SOURCE_CONCURRENCY，如 "akshare:4,sina:2"，
+    未列出的数据源使用 SOURCE_DEFAULT_CONCURRENCY，默认 4）
+
+    df = source_call('akshare', ak.stock_zh_a_daily, symbol='sz000001', adjust='')
+    df = source_call('akshare', fn, stop_event=ctrl['stop_event'], ...)   # 停止时放弃等待令牌，抛出 SourceCancelledError
+
+调用结果先查本地 Parquet 缓存（data_pipeline.source_cache），命中时直接返回。
+SOURCE_ISOLATION 开启时调用在常驻子进程中执行，带墙钟超时（见 data_pipeline.source_isolation）。
+"""
+import functools
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+try:
+    from data_pipeline.source_cache import default_cache
+    from data_pipeline.source_isolation import SourceCancelledError, isolated_pool, isolation_stats
+except Exception:
+    from source_cache import default_cache
+    from source_isolation import SourceCancelledError, isolated_pool, isolation_stats
+
+
+class TokenBucket:
+    """线程安全令牌桶。rate<=0 表示不限速。"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0, stop_event: Optional[threading.Event] = None) -> bool:
+        """阻塞直到取得令牌；stop_event 置位时放弃并返回 False。"""
+        if self.rate <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if stop_event is not None and stop_event.wait(min(wait, 0.5)):
+                return False
+            if stop_event is None:
+                time.sleep(wait)
+
+
+class SourceLimiter:
+    """全局令牌桶 + 每数据源并发信号量，并统计调用次数与等待时间。"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None, caps: Optional[Dict[str, int]] = None, default_cap: int = 4) -> None:
+        self.bucket = TokenBucket(rate, burst)
+        self.default_cap = max(1, int(default_cap))
+        self._caps = dict(caps or {})
+        self._sems: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.wait_seconds: Dict[str, float] = {}
+
+    @classmethod
+    def from_env(cls) -> 'SourceLimiter':
+        caps = {}
+        for part in (os.getenv('SOURCE_CONCURRENCY') or '').split(','):
+            if ':' in part:
+                name, n = part.split(':', 1)
+                try:
+                    caps[name.strip()] = max(1, int(n))
+                except Exception:
+                    pass
+        burst = os.getenv('SOURCE_BURST')
+        return cls(
+            rate=float(os.getenv('SOURCE_RATE_LIMIT', '8')),
+            burst=float(burst) if burst else None,
+            caps=caps,
+            default_cap=int(os.getenv('SOURCE_DEFAULT_CONCURRENCY', '4')),
+        )
+
+    def _sem(self, source: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._sems.get(source)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self._caps.get(source, self.default_cap))
+                self._sems[source] = sem
+            return sem
+
+    def call(self, source: str, fn: Callable, *args, stop_event: Optional[threading.Event] = None, **kwargs):
+        """在并发上限与令牌桶内调用 fn；stop_event 置位时放弃等待令牌并抛出 SourceCancelledError。"""
+        t0 = time.monotonic()
+        sem = self._sem(source)
+        with sem:
+            if not self.bucket.acquire(stop_event=stop_event):
+                raise SourceCancelledError(f"{source}.{getattr(fn, '__name__', fn)} 等待限流时已停止")
+            waited = time.monotonic() - t0
+            with self._lock:
+                self.calls[source] = self.calls.get(source, 0) + 1
+                self.wait_seconds[source] = self.wait_seconds.get(source, 0.0) + waited
+            return fn(*args, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                s: {'calls': n, 'wait_seconds': round(self.wait_seconds.get(s, 0.0), 3)}
+                for s, n in self.calls.items()
+            }
+
+
+_default: Optional[SourceLimiter] = None
+_default_lock = threading.Lock()
+
+
+def default_limiter() -> SourceLimiter:
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = SourceLimiter.from_env()
+    return _default
+
+
+def source_call(
+    source: str, fn: Callable, *args, stop_event: Optional[threading.Event] = None, fresh: bool = False, **kwargs,
+):
+    """
+    经本地缓存（见 source_cache）与全局限流器调用数据源函数；缓存命中时不占用限流配额。
+    传入 stop_event（如更新控制的 ctrl['stop_event']）时，停止后不再等待令牌，抛出 SourceCancelledError。
+    fresh=True 时不读缓存，直接访问数据源并以结果覆盖缓存。
+    """
+    cache = default_cache()
+    df = None if fresh else cache.get(fn, args, kwargs)
+    if df is not None:
+        return df
+    pool = isolated_pool(source)
+    if pool is not None:
+        fn_call = functools.partial(pool.call, source, fn)
+        result = default_limiter().call(source, fn_call, *args, stop_event=stop_event, **kwargs)
+    else:
+        result = default_limiter().call(source, fn, *args, stop_event=stop_event, **kwargs)
+    cache.put(fn, args, kwargs, result)
+    return result
+
+
+def source_stats() -> Dict[str, object]:
+    return {'limiter': default_limiter().stats(), 'cache': default_cache().stats(), 'isolation': isolation_stats()}
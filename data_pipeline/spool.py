@@ -0,0 +1,323 @@
+"""
+QuestDB 不可用时的本地写后（write-behind）缓冲。
+
+数据库连接失败或写入中途断开时，已经从限速数据源拉到的行不再丢弃，而是追加到本地 spool：
+  - 每次追加写一个 Arrow IPC 段文件 <dir>/<table>/<毫秒时间戳>-<序号>-<行数>.arrow（先写临时文件再改名，
+    进程崩溃不会留下半个段）
+  - 后台 SpoolReplayer 每 SPOOL_REPLAY_INTERVAL 秒（默认 30）检查一次，数据库恢复后按段从旧到新
+    经 BulkWriter 批量回放，成功后删除该段；回放时连接再次断开则保留剩余段，等待下一轮
+  - 多个进程（Web 与各 qdb_worker）可同时回放同一目录：回放前先把段改名为 *.replaying 认领，
+    改名失败（已被其他进程认领）即跳过；认领者崩溃遗留的 *.replaying 超过 SPOOL_CLAIM_STALE_SECONDS（默认 600）后退回待回放
+  - 数据库拒绝的坏行（BulkWriter 二分隔离出的全部 rejected 行）写入 <dir>/_rejected/<table>/，不参与回放，留待排查
+  - stats()：各表段数、行数、字节数与最老段的年龄（秒）
+SPOOL=0 关闭，SPOOL_DIR 指定目录（默认项目根目录下 .cache/spool）；需要 pyarrow，不可用时 spool 自动关闭。
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except Exception:
+    pa = None
+    pa_ipc = None
+
+try:
+    from data_pipeline.bulk_writer import BulkWriter, BulkWriteConnectionError
+except Exception:
+    from bulk_writer import BulkWriter, BulkWriteConnectionError
+
+logger = logging.getLogger(__name__)
+
+_REJECTED = '_rejected'
+_CLAIMED = '.replaying'
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class Spool:
+    """按表分目录的追加式段文件缓冲；线程安全。"""
+
+    def __init__(self, root: str, enabled: bool = True) -> None:
+        self.root = root
+        self.enabled = enabled and pa is not None
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.appended_rows = 0
+        self.replayed_rows = 0
+        self.rejected_rows = 0
+
+    @classmethod
+    def from_env(cls) -> 'Spool':
+        root = os.getenv('SPOOL_DIR') or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'spool'
+        )
+        enabled = (os.getenv('SPOOL') or '1').strip().lower() not in ('0', 'false', 'off', 'no')
+        return cls(root, enabled)
+
+    # 写入
+    def _write(self, directory: str, columns: Sequence[str], values: Sequence[tuple]) -> str:
+        os.makedirs(directory, exist_ok=True)
+        name = f'{int(time.time() * 1000):013d}-{next(self._seq):06d}-{len(values)}.arrow'
+        path = os.path.join(directory, name)
+        cols = list(zip(*values))
+        table = pa.Table.from_pydict({c: list(cols[i]) for i, c in enumerate(columns)})
+        tmp = path + '.tmp'
+        with pa.OSFile(tmp, 'wb') as sink:
+            with pa_ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+        return path
+
+    def append(self, table: str, columns: Sequence[str], values: Sequence[tuple]) -> int:
+        """追加一段待回放的行，返回写入 spool 的行数（spool 不可用时为 0）。"""
+        if not self.enabled or not values:
+            return 0
+        try:
+            self._write(os.path.join(self.root, table), columns, values)
+        except Exception as e:
+            logger.exception("spool 写入失败: table=%s, rows=%s, error=%s", table, len(values), e)
+            return 0
+        with self._lock:
+            self.appended_rows += len(values)
+        return len(values)
+
+    def reject(self, table: str, columns: Sequence[str], values: Sequence[tuple]) -> None:
+        """保存被数据库拒绝的坏行（不回放）。"""
+        if not self.enabled or not values:
+            return
+        try:
+            self._write(os.path.join(self.root, _REJECTED, table), columns, values)
+            with self._lock:
+                self.rejected_rows += len(values)
+        except Exception as e:
+            logger.warning("spool 保存坏行失败: table=%s, error=%s", table, e)
+
+    # 读取
+    def segments(self, table: Optional[str] = None) -> List[Tuple[str, str]]:
+        """返回待回放段 [(table, path)]，按创建时间从旧到新。"""
+        if not os.path.isdir(self.root):
+            return []
+        tables = [table] if table else [t for t in os.listdir(self.root) if t != _REJECTED]
+        out = []
+        for t in tables:
+            d = os.path.join(self.root, t)
+            if not os.path.isdir(d):
+                continue
+            out.extend((t, os.path.join(d, n)) for n in os.listdir(d) if n.endswith('.arrow'))
+        out.sort(key=lambda x: os.path.basename(x[1]))
+        return out
+
+    @staticmethod
+    def read(path: str) -> Tuple[List[str], List[tuple]]:
+        with pa.memory_map(path, 'r') as source:
+            table = pa_ipc.open_file(source).read_all()
+        columns = table.column_names
+        data = [table.column(c).to_pylist() for c in columns]
+        return columns, list(zip(*data))
+
+    # 回放
+    def replay(self, conn, max_segments: Optional[int] = None) -> Dict[str, int]:
+        """
+        将待回放段写入 QuestDB。连接断开时停止并保留剩余段（抛出 BulkWriteConnectionError）。
+        返回 {'segments', 'rows', 'rejected'}。
+        """
+        done = {'segments': 0, 'rows': 0, 'rejected': 0}
+        self._release_stale_claims()
+        for table, path in self.segments()[:max_segments]:
+            # 原子认领：改名成功的进程独占回放该段
+            claimed = path + _CLAIMED
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                columns, values = self.read(claimed)
+            except Exception as e:
+                logger.error("spool 段损坏，移入坏行目录: %s, error=%s", path, e)
+                self._quarantine(table, claimed)
+                continue
+            try:
+                report = BulkWriter(conn, table, columns).write(values)
+            except BaseException:
+                # 连接断开等：退回待回放，下一轮重试
+                try:
+                    os.rename(claimed, path)
+                except OSError:
+                    pass
+                raise
+            if report.rejected:
+                self.reject(table, columns, report.rejected_rows)
+            _remove(claimed)
+            done['segments'] += 1
+            done['rows'] += report.written
+            done['rejected'] += report.rejected
+            with self._lock:
+                self.replayed_rows += report.written
+        return done
+
+    def _release_stale_claims(self) -> None:
+        """认领后进程崩溃遗留的 *.replaying 段（改名时间超过 SPOOL_CLAIM_STALE_SECONDS）退回待回放。"""
+        if not os.path.isdir(self.root):
+            return
+        stale = float(os.getenv('SPOOL_CLAIM_STALE_SECONDS', '600'))
+        now = time.time()
+        for t in os.listdir(self.root):
+            d = os.path.join(self.root, t)
+            if t == _REJECTED or not os.path.isdir(d):
+                continue
+            for n in os.listdir(d):
+                if not n.endswith(_CLAIMED):
+                    continue
+                p = os.path.join(d, n)
+                try:
+                    # 改名会更新 ctime
+                    if now - os.stat(p).st_ctime > stale:
+                        os.rename(p, p[:-len(_CLAIMED)])
+                except OSError:
+                    pass
+
+    def _quarantine(self, table: str, path: str) -> None:
+        d = os.path.join(self.root, _REJECTED, table)
+        os.makedirs(d, exist_ok=True)
+        name = os.path.basename(path)
+        if name.endswith(_CLAIMED):
+            name = name[:-len(_CLAIMED)]
+        try:
+            os.replace(path, os.path.join(d, name + '.bad'))
+        except OSError:
+            pass
+
+    # 指标
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        tables: Dict[str, Dict[str, Any]] = {}
+        for table, path in self.segments():
+            name = os.path.basename(path)
+            t = tables.setdefault(table, {'segments': 0, 'rows': 0, 'bytes': 0, 'oldest_age_seconds': None})
+            t['segments'] += 1
+            try:
+                t['rows'] += int(name.rsplit('.', 1)[0].split('-')[2])
+                t['bytes'] += os.path.getsize(path)
+                age = now - int(name.split('-')[0]) / 1000.0
+            except (ValueError, IndexError, OSError):
+                continue
+            if t['oldest_age_seconds'] is None or age > t['oldest_age_seconds']:
+                t['oldest_age_seconds'] = round(age, 1)
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'dir': self.root,
+                'pending_segments': sum(t['segments'] for t in tables.values()),
+                'pending_rows': sum(t['rows'] for t in tables.values()),
+                'pending_bytes': sum(t['bytes'] for t in tables.values()),
+                'oldest_age_seconds': max((t['oldest_age_seconds'] or 0 for t in tables.values()), default=None),
+                'tables': tables,
+                'appended_rows': self.appended_rows,
+                'replayed_rows': self.replayed_rows,
+                'rejected_rows': self.rejected_rows,
+            }
+
+
+class SpoolReplayer:
+    """后台线程：定期检查 spool，数据库可连接时回放。"""
+
+    def __init__(self, spool: Spool, connect: Callable[[], Any], interval: float = 30.0) -> None:
+        self.spool = spool
+        self.connect = connect
+        self.interval = float(interval)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+        self.last_run: Optional[float] = None
+
+    def start(self) -> 'SpoolReplayer':
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='spool-replayer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def run_once(self) -> Optional[Dict[str, int]]:
+        if not self.spool.segments():
+            return None
+        conn = self.connect()
+        if not conn:
+            self.last_error = 'QuestDB 连接不可用'
+            return None
+        try:
+            done = self.spool.replay(conn)
+            self.last_error = None
+            if done['segments']:
+                logger.info("spool 回放完成: %s", done)
+            return done
+        except BulkWriteConnectionError as e:
+            self.last_error = str(e)
+            logger.warning("spool 回放中断（连接断开），稍后重试: %s", e)
+            return None
+        finally:
+            self.last_run = time.time()
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.exception("spool 回放异常: %s", e)
+
+
+_default: Optional[Spool] = None
+_replayer: Optional[SpoolReplayer] = None
+_default_lock = threading.Lock()
+
+
+def default_spool() -> Spool:
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = Spool.from_env()
+    return _default
+
+
+def start_replayer(connect: Callable[[], Any]) -> Optional[SpoolReplayer]:
+    """启动（或返回已在运行的）后台回放线程；spool 关闭时返回 None。"""
+    global _replayer
+    spool = default_spool()
+    if not spool.enabled:
+        return None
+    with _default_lock:
+        if _replayer is None:
+            _replayer = SpoolReplayer(spool, connect, interval=float(os.getenv('SPOOL_REPLAY_INTERVAL', '30')))
+        return _replayer.start()
+
+
+def spool_stats() -> Dict[str, Any]:
+    stats = default_spool().stats()
+    stats['replayer'] = {
+        'running': bool(_replayer and _replayer.running),
+        'last_run': _replayer.last_run if _replayer else None,
+        'last_error': _replayer.last_error if _replayer else None,
+    }
+    return stats